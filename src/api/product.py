@@ -13,12 +13,15 @@
 # limitations under the License.
 
 
+import asyncio
 import json
+from typing import Any, AsyncIterator, Callable
 from fastapi import Response, status, FastAPI, APIRouter, Depends
+from fastapi.responses import StreamingResponse
 from fastapi_throttle import RateLimiter
 from pydantic import ValidationError
-from model.examples import Product, example_category, example_product
-from commands.main import product_enrichment_from_image
+from model.examples import Product
+from commands.main import product_enrichment_from_image, product_enrichment_streaming
 from PIL import Image
 from model.chain import Context
 from model.config import Config
@@ -26,10 +29,11 @@ from opentelemetry import trace
 import os
 
 
-def register(app: FastAPI, config: Config) -> APIRouter:
+def register(app: FastAPI, get_config: Callable[[], Config]) -> APIRouter:
     """
     Registers the router for /api/v1/products.
     Demonstrates using a throttle on the end-point.
+    The configuration is only loaded by get_config when a request needs it.
     """
     router = APIRouter(prefix="/api/v1/products")
     
@@ -48,30 +52,77 @@ def register(app: FastAPI, config: Config) -> APIRouter:
     async def product_example(response: Response):
         tracer = trace.get_tracer(__name__)
         
-        script_dir = os.path.dirname(os.path.realpath(__file__))
         with tracer.start_span("test_product_enrichment"):
-            # Load an image
-            apparel_image = Image.open(f"{script_dir}/assets/images/apparel.jpeg")
-            
-            # Load two example objects and get their JSON representations
-            category_model = example_category.model_dump_json()
-            product_attribute_value_model = example_product.model_dump_json()
-            
-            # Create the context
-            context = Context(config)
-            context.set("product_image", apparel_image)
-            context.set("category_model", category_model)
-            context.set("product_attribute_value_model", product_attribute_value_model)
+            context = example_context(get_config())
             
             # Execute the Chain of responsibility
-            await product_enrichment_from_image.execute(context=context)
-            
             try:
-                outProduct = Product.model_validate(json.loads(context.get("product_json")))
-                # Verify the content was created
-                return outProduct
+                await product_enrichment_from_image.execute(context=context)
+                # The product is parsed from the schema constrained response
+                return context.get("product")
             except ValidationError:
                 response.status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
                 return {"status": "error", "message": "validation error, bad response from Gemini"}
+
+    @router.get("/example/stream",
+                status_code=status.HTTP_200_OK,
+                tags=["Products"],
+                dependencies=[Depends(RateLimiter(times=1, seconds=10))])
+    async def product_example_stream():
+        """
+        The example enrichment as server-sent events: command progress, each product field
+        as soon as Gemini has generated it, and finally the validated product (or an error).
+        """
+        return StreamingResponse(stream_events(example_context(get_config())), media_type="text/event-stream")
                 
-    return router
\ No newline at end of file
+    return router
+
+
+def example_context(config: Config) -> Context:
+    """Creates a context with the example image."""
+    script_dir = os.path.dirname(os.path.realpath(__file__))
+    # Load an image
+    apparel_image = Image.open(f"{script_dir}/assets/images/apparel.jpeg")
+    
+    # Create the context, the category and product structure come from the response schemas
+    context = Context(config)
+    context.set("product_image", apparel_image)
+    return context
+
+
+async def stream_events(context: Context) -> AsyncIterator[str]:
+    """
+    Executes the streaming chain in the background and yields the events it publishes.
+    Listeners may be called from the command thread pool, so events are handed to the
+    event loop thread-safely.
+    """
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue[tuple[str, Any]|None] = asyncio.Queue()
+    context.subscribe(lambda event, data: loop.call_soon_threadsafe(events.put_nowait, (event, data)))
+    
+    async def run():
+        try:
+            await product_enrichment_streaming.execute(context=context)
+            if context.has_errors():
+                events.put_nowait(("error", {"message": str(context.errors[0])}))
+            else:
+                events.put_nowait(("product", context.get("product").model_dump(mode="json")))
+        except ValidationError:
+            events.put_nowait(("error", {"message": "validation error, bad response from Gemini"}))
+        except Exception as e:
+            events.put_nowait(("error", {"message": str(e)}))
+        finally:
+            # let the callbacks scheduled by the listener drain before ending the stream
+            loop.call_soon(events.put_nowait, None)
+    
+    task = asyncio.create_task(run())
+    try:
+        while (item := await events.get()) is not None:
+            yield format_sse(*item)
+    finally:
+        task.cancel()
+
+
+def format_sse(event: str, data: Any) -> str:
+    """Formats a server-sent event, see https://html.spec.whatwg.org/multipage/server-sent-events.html"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
\ No newline at end of file
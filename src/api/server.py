@@ -12,25 +12,80 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import threading
+
 import uvicorn
 from fastapi import FastAPI
 
+from commands.image_processing import shutdown_image_process_pool
+from model.clients import get_client_registry
 from model.config import Config
+from model.executor import shutdown_command_executor
+from model.ingestion import shutdown_image_ingester
+from model.sinks import close_sinks
 from utils.logging import setup_logging, setup_tracer
 
 from api.product import register as products
 from api.checks import register as api_checks
 
-config = Config("env.toml")
+CONFIG_FILE_NAME = "env.toml"
+
+_config: Config | None = None
+_config_lock = threading.Lock()
+
+
+def get_config() -> Config:
+    """Returns the configuration of the server, loaded on first use rather than on import."""
+    global _config
+    if _config is None:
+        with _config_lock:
+            if _config is None:
+                _config = Config(CONFIG_FILE_NAME)
+    return _config
+
+
 app = FastAPI(title="Gemini Content Enrichment")
-app.include_router(api_checks(config))
-app.include_router(products(app, config))
+app.include_router(api_checks(app))
+app.include_router(products(app, get_config))
+
+
+def load_config():
+    """Loads the configuration before the first request, so a bad configuration fails the startup."""
+    get_config()
+
+
+async def delete_video_files():
+    """Removes the uploaded videos kept for reuse rather than leaving them to expire."""
+    if _config is None:
+        return
+    for generator in _config.generative_ai.generators.values():
+        if generator.video_files is not None:
+            await generator.video_files.clear(generator.client)
+
+
+async def delete_cached_contents():
+    """Removes the cached prompt prefixes rather than leaving them to expire."""
+    if _config is None:
+        return
+    for generator in _config.generative_ai.generators.values():
+        if generator.context_cache_manager is not None:
+            await generator.context_cache_manager.clear_async(generator)
+
+
+app.add_event_handler("startup", load_config)
+app.add_event_handler("shutdown", shutdown_command_executor)
+app.add_event_handler("shutdown", close_sinks)
+app.add_event_handler("shutdown", delete_video_files)
+app.add_event_handler("shutdown", delete_cached_contents)
+app.add_event_handler("shutdown", get_client_registry().aclose)
+app.add_event_handler("shutdown", shutdown_image_process_pool)
+app.add_event_handler("shutdown", shutdown_image_ingester)
 
 def start(host: str, port: int, reload: bool):
     """Starts the server"""
     try:
         setup_logging()
-        setup_tracer(config)
+        setup_tracer(get_config())
     except Exception as e:
         print(e)
     
@@ -14,11 +14,11 @@
 
 import logging
 import argparse
+import asyncio
 import getpass
+import json
 
-from model.config import Config
 import utils.ezcrypt as crypt
-import api.server as api_server
 from utils.logging import setup_logging
 
 
@@ -62,6 +62,29 @@ def initialize_api_functions(subparsers):
     api_server.add_argument("-r", "--reload", help='Reload the server on file changes', default=DEFAULT_RELOAD)
     
 
+def initialize_vocabulary_functions(subparsers):
+    """Initializes the vocabulary functions."""
+    build_vocabulary = subparsers.add_parser('build-vocabulary',
+                                             help='Embeds the known categories for the category lookup and saves them to the [vocabulary] path.')
+    build_vocabulary.add_argument("-i", "--input", help='A JSON file with a list of categories.', required=True)
+
+
+def build_vocabulary(config_file_name: str, input_file_name: str) -> None:
+    """Embeds the categories in the input file and saves them as the vocabulary."""
+    # imported on use, as is the server, so the password actions start without loading genai
+    from model.config import Config
+    from model.examples import Category
+    from model.vocabulary import CategoryVocabulary
+
+    config = Config(config_file_name)
+    with open(input_file_name, "r") as f:
+        categories = [Category.model_validate(c) for c in json.load(f)]
+    vocabulary = CategoryVocabulary()
+    asyncio.run(vocabulary.add_embedded(config.get_embedding(), categories))
+    vocabulary.save(config.vocabulary.path)
+    print(f"Saved {len(vocabulary)} categories to {config.vocabulary.path}")
+
+
 def main():
     """The main function of the CLI"""
     logging.basicConfig(filename="gemini-content-enrichment.log", level=logging.INFO, format=FORMAT)
@@ -70,9 +93,9 @@ def main():
     subparsers = parser.add_subparsers(dest="action", help='Command Help')
     initialize_password_functions(subparsers)
     initialize_api_functions(subparsers)
+    initialize_vocabulary_functions(subparsers)
     
     args = parser.parse_args()
-    config = Config(args.config)
     
     match args.action:
         case 'encrypt-password':
@@ -82,8 +105,11 @@ def main():
         case 'generate-salt':
             print("Salt: ", crypt.generate_random_string(DEFAULT_SALT_LENGTH))
         case 'api-server':
+            import api.server as api_server
             print(f'Starting Server: {args.ip}:{args.port}')
             api_server.start(args.ip, args.port, args.reload)
+        case 'build-vocabulary':
+            build_vocabulary(args.config, args.input)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
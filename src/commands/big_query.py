@@ -12,22 +12,39 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from model.bulk_load import DEFAULT_MAX_FILE_BYTES, FORMAT_NDJSON, BigQueryLoader, get_bulk_load_sink
 from model.chain import Command, Context
+from model.clients import get_bigquery_client, get_client_registry
+from model.sinks import DEFAULT_FLUSH_BYTES, DEFAULT_FLUSH_ROWS, DEFAULT_FLUSH_SECONDS, get_streaming_insert_sink
+from utils.cache import create_tiered_cache
+from utils.single_flight import SingleFlight
 from google.cloud import bigquery
 from google.cloud.bigquery.table import RowIterator
+from typing import Any
+import datetime
+import functools
 import tempfile
 import json
 
+DEFAULT_LOOKUP_TTL_SECONDS = 600.0
+DEFAULT_LOOKUP_CACHE_ENTRIES = 4096
+# the query parameter type of a Python value, bool before int as bool is an int
+PARAMETER_TYPES = ((bool, "BOOL"), (int, "INT64"), (float, "FLOAT64"), (datetime.datetime, "TIMESTAMP"),
+                   (datetime.date, "DATE"), (str, "STRING"))
+
 
 def FQTN(project_id: str, dataset_name: str, table_name: str):
         return f"{project_id}.{dataset_name}.{table_name}"
-    
-bigquery_client = bigquery.Client()
+
 
 class BQPersistenceCommand(Command):
     """
     Represents a command that can query BQ and if needed create the table from 
-    the provided schema.
+    the provided schema, once per process on the first execution. The rows are handed
+    to the process wide sink of the table, which writes them in batches from a
+    background thread (see model.sinks). With a load_directory, e.g. for backfills, rows
+    are written to local NDJSON or Parquet files that are loaded with load jobs instead
+    (see model.bulk_load).
     """
     def __init__(self,
                  name: str,
@@ -36,58 +53,113 @@ class BQPersistenceCommand(Command):
                  dataset_name: str,
                  table_name: str,
                  json_schema: str | None,
-                 create_table_if_not_exists: bool = False):
+                 create_table_if_not_exists: bool = False,
+                 flush_rows: int = DEFAULT_FLUSH_ROWS,
+                 flush_bytes: int = DEFAULT_FLUSH_BYTES,
+                 flush_seconds: float = DEFAULT_FLUSH_SECONDS,
+                 load_directory: str | None = None,
+                 file_format: str = FORMAT_NDJSON,
+                 max_file_bytes: int = DEFAULT_MAX_FILE_BYTES):
         
         super().__init__(name, self.do_execute)
         self.fqtn = FQTN(project_id, dataset_name, table_name)
         self.json_schema = json_schema
         self.create_table_if_not_exists = create_table_if_not_exists
-        self.table_created = bigquery.Table(self.fqtn).exists()
         self.input_variable_name = input_variable_name
+        self.sink_settings = {"flush_rows": flush_rows, "flush_bytes": flush_bytes, "flush_seconds": flush_seconds}
+        self.load_directory = load_directory
+        self.load_settings = {"file_format": file_format, "max_file_bytes": max_file_bytes}
         
         
+    @functools.cached_property
+    def schema(self) -> list[bigquery.SchemaField] | None:
+        """The table schema parsed from json_schema."""
+        if self.json_schema is None:
+            return None
+        with tempfile.TemporaryFile(mode="w+") as fp:
+            fp.write(self.json_schema)
+            fp.seek(0)
+            return get_bigquery_client().schema_from_json(fp)
+        
+    def create_table(self) -> None:
+        get_bigquery_client().create_table(bigquery.Table(self.fqtn, schema=self.schema), exists_ok=True)
+
     def do_execute(self, context: Context):
-        if not self.table_created and self.create_table_if_not_exists and self.json_schema is not None:
-            with tempfile.TemporaryFile(mode="w+") as fp:
-                fp.write(self.json_schema)
-                fp.seek(0)
-                bigquery_client.schema_from_json(fp)
-                bigquery_client.create_table(self.fqtn, exists_ok=True)
-                self.table_created = True
+        if self.create_table_if_not_exists and self.json_schema is not None:
+            get_client_registry().ensure_exists("bigquery.table", self.fqtn, self.create_table)
 
         if context.has_key(self.input_variable_name):
-            if isinstance(context.get(self.input_variable_name), list):
-                bigquery_client.insert_rows_json(self.fqtn, [context.get(self.input_variable_name)])
+            rows = context.get(self.input_variable_name)
+            if self.load_directory is not None:
+                sink = get_bulk_load_sink(BigQueryLoader(get_bigquery_client()), self.fqtn, self.load_directory,
+                                          schema=self.schema, **self.load_settings)
             else:
-                bigquery_client.insert_rows_json(self.fqtn, context.get(self.input_variable_name))
+                sink = get_streaming_insert_sink(get_bigquery_client(), self.fqtn, **self.sink_settings)
+            sink.put(rows if isinstance(rows, list) else [rows])
     
                     
 class BQEnrichmentCommand(Command):
     """
     Allows the user to enrich their context with query results from big query.
+    The query is the clause following SELECT ... FROM the table, e.g. "WHERE brand = @brand",
+    and parameters maps each query parameter to the context variable bound to it, so values
+    are never pasted into the SQL. Only the given columns are selected. Results are cached
+    as JSON by the parameter values for ttl_seconds, and concurrent contexts with the same
+    values share one query, so reference data is served from memory for most of a batch.
     """
     def __init__(self, name: str,
                  project_id: str,
                  dataset_name: str,
                  table_name: str, 
                  query: str, 
-                 output_variable_name: str) -> None:
-        super().__init__(name, self.do_execute)
+                 output_variable_name: str,
+                 parameters: list[str] | dict[str, str] | None = None,
+                 columns: list[str] | None = None,
+                 ttl_seconds: float | None = DEFAULT_LOOKUP_TTL_SECONDS,
+                 max_entries: int = DEFAULT_LOOKUP_CACHE_ENTRIES,
+                 client: bigquery.Client | None = None) -> None:
+        if isinstance(parameters, list):
+            parameters = {p: p for p in parameters}
+        self.parameters: dict[str, str] = parameters or {}
+        super().__init__(name, self.do_execute, reads=list(self.parameters.values()), writes=[output_variable_name])
         self.fqtn = FQTN(project_id, dataset_name, table_name)
         self.query = query
         self.output_variable_name = output_variable_name
+        projection = ", ".join(f"`{c}`" for c in columns) if columns else "*"
+        self.query_text = f"SELECT {projection} FROM `{self.fqtn}` {query}"
+        self.client = client
+        self.cache = None
+        if ttl_seconds:
+            self.cache = create_tiered_cache(f"bigquery.{name}", {"max_entries": max_entries, "ttl_seconds": ttl_seconds})
+        self.single_flight = SingleFlight(f"bigquery.{name}")
         
     def do_execute(self, context: Context):
-       query_text = f"SELECT * from `{self.fqtn}` {super.expand_variables(self.query, context)}"
-       
-       out = []
-       row_iterator: RowIterator = bigquery_client.query_and_wait(query_text)
-       
-       for row in row_iterator:
-           out.append(dict(row))
-       
-       export = json.dumps(out)
-       context.set(self.output_variable_name, export)
-                    
-                
-        
\ No newline at end of file
+        values = {p: context.get(v) for p, v in self.parameters.items()}
+        key = json.dumps(values, sort_keys=True, default=str)
+        cached = self.cache.get(key) if self.cache is not None else None
+        export = cached.decode() if cached is not None else self.single_flight.do(key, lambda: self.lookup(key, values))
+        context.set(self.output_variable_name, export)
+        
+    def lookup(self, key: str, values: dict[str, Any]) -> str:
+        """Queries the rows for the parameter values as a JSON list, caching the result."""
+        client = self.client if self.client is not None else get_bigquery_client()
+        job_config = bigquery.QueryJobConfig(query_parameters=[get_query_parameter(n, v) for n, v in values.items()])
+        row_iterator: RowIterator = client.query_and_wait(self.query_text, job_config=job_config)
+        export = json.dumps([dict(row) for row in row_iterator], default=str)
+        if self.cache is not None:
+            self.cache.put(key, export.encode())
+        return export
+
+
+def get_parameter_type(value: Any) -> str:
+    for python_type, parameter_type in PARAMETER_TYPES:
+        if isinstance(value, python_type):
+            return parameter_type
+    return "STRING"
+
+
+def get_query_parameter(name: str, value: Any) -> bigquery.ScalarQueryParameter | bigquery.ArrayQueryParameter:
+    if isinstance(value, (list, tuple)):
+        items = list(value)
+        return bigquery.ArrayQueryParameter(name, get_parameter_type(items[0]) if items else "STRING", items)
+    return bigquery.ScalarQueryParameter(name, get_parameter_type(value), value)
@@ -0,0 +1,210 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import copy
+import fnmatch
+import io
+import re
+from typing import Any, AsyncIterable, AsyncIterator, Iterable
+
+from opentelemetry import metrics
+from PIL import Image
+
+from commands.image_processing import get_source
+from model.chain import DEFAULT_MAX_IN_FLIGHT, BatchProgress, Command, Context, to_async_iterator
+from model.config import Deduplication
+from model.examples import BaseProduct, Product, ProductAttributeValue
+
+meter = metrics.get_meter(__name__)
+dedup_counter = meter.create_counter(
+    "dedup.contexts", description="Contexts of deduplicated batches by role (representative or duplicate).")
+
+
+async def execute_deduplicated(command: Command,
+                               contexts: Iterable[Context],
+                               max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+                               progress: BatchProgress|None = None,
+                               per_variant: Command|None = None) -> AsyncIterator[Context]:
+    """
+    Executes the command over a batch like Command.execute_many, but only for one context
+    of each cluster of near-duplicate products (e.g. colour and size variants) in the batch.
+    The keys the command wrote to the representative are copied to the other contexts of
+    its cluster, with the values of their variant_attributes patched into the attributes
+    and the generated text (see patch_variant). The optional per_variant command, e.g.
+    the translations, is executed for every copy instead of having its keys copied.
+    Clustering needs the whole batch, so the input is read before the first execution.
+    """
+    contexts = list(contexts)
+    progress = progress if progress is not None else BatchProgress()
+    if len(contexts) == 0:
+        return
+    settings = contexts[0].get_config().dedup
+    if not settings.enabled:
+        async for context in command.execute_many(contexts, max_in_flight=max_in_flight, progress=progress):
+            yield context
+        return
+
+    clusters = await asyncio.to_thread(cluster_contexts, settings, contexts)
+    representatives = {id(contexts[r]): members for r, members in clusters.items()}
+    dedup_counter.add(len(clusters), {"command": command.name, "role": "representative"})
+    dedup_counter.add(len(contexts) - len(clusters), {"command": command.name, "role": "duplicate"})
+
+    representative_contexts = [contexts[r] for r in clusters]
+    async for representative in command.execute_many(representative_contexts, max_in_flight=max_in_flight, progress=progress):
+        yield representative
+        duplicates = [contexts[p] for p in representatives[id(representative)][1:]]
+        for duplicate in duplicates:
+            fan_out(command, representative, duplicate, settings.variant_variable_name, per_variant)
+        if per_variant is not None and not representative.has_errors():
+            duplicates = [d async for d in per_variant.execute_many(duplicates, max_in_flight=max_in_flight)]
+        for duplicate in duplicates:
+            progress.submitted += 1
+            if duplicate.has_errors():
+                progress.failed += 1
+            else:
+                progress.succeeded += 1
+            yield duplicate
+
+
+async def execute_deduplicated_batches(command: Command,
+                                       contexts: Iterable[Context]|AsyncIterable[Context],
+                                       batch_size: int,
+                                       max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+                                       progress: BatchProgress|None = None,
+                                       per_variant: Command|None = None) -> AsyncIterator[Context]:
+    """
+    execute_deduplicated over an unbounded input, e.g. a table, read batch_size contexts at
+    a time. Only near-duplicates within the same batch are clustered, so a larger batch
+    saves more calls at the cost of memory and of the batch being read before it starts.
+    """
+    progress = progress if progress is not None else BatchProgress()
+    batch = []
+    async for context in to_async_iterator(contexts):
+        batch.append(context)
+        if len(batch) == batch_size:
+            async for result in execute_deduplicated(command, batch, max_in_flight, progress, per_variant):
+                yield result
+            batch = []
+    async for result in execute_deduplicated(command, batch, max_in_flight, progress, per_variant):
+        yield result
+
+
+def cluster_contexts(settings: Deduplication, contexts: list[Context]) -> dict[int, list[int]]:
+    """The positions of the contexts in each cluster, by the position of its representative."""
+    index = settings.create_index()
+    for context in contexts:
+        text = "\n".join(str(context.get(n)) for n in settings.text_variable_names if context.get(n))
+        image = None
+        if settings.image_variable_name is not None and context.has_key(settings.image_variable_name):
+            image = get_image(context.get(settings.image_variable_name))
+        index.add(text, image)
+    return index.get_clusters()
+
+
+def get_image(image: Any) -> Image.Image|None:
+    source = get_source(image)
+    if isinstance(source, bytes):
+        return Image.open(io.BytesIO(source))
+    return source if isinstance(source, Image.Image) else None
+
+
+def fan_out(command: Command, representative: Context, duplicate: Context, variant_variable_name: str,
+            per_variant: Command|None = None) -> None:
+    """Copies the results of the representative the duplicate does not have as inputs."""
+    if representative.has_errors():
+        for error in representative.errors:
+            duplicate.add_error(error)
+        return
+    variant = duplicate.get(variant_variable_name) or {}
+    replacements = get_replacements(representative.get(variant_variable_name) or {}, variant)
+    for key, value in representative.state.items():
+        if duplicate.has_key(key) or not is_written(command, key):
+            continue
+        if per_variant is not None and is_written(per_variant, key):
+            continue
+        duplicate.set(key, patch_variant(value, variant, replacements) if variant else copy.deepcopy(value))
+    product = duplicate.get("product")
+    if variant and isinstance(product, Product):
+        duplicate.set("product_json", product.model_dump_json())
+
+
+def is_written(command: Command, key: str) -> bool:
+    if command.writes is None:
+        return True
+    return any(fnmatch.fnmatchcase(key, pattern) for pattern in command.writes)
+
+
+def get_replacements(representative: dict[str, str], variant: dict[str, str]) -> dict[str, str]:
+    """The variant's value by the representative's value, lower cased, of every attribute they differ in."""
+    values = {name.lower(): str(value) for name, value in representative.items()}
+    replacements = {}
+    for name, value in variant.items():
+        old = values.get(name.lower())
+        if old and old.lower() != str(value).lower():
+            replacements[old.lower()] = str(value)
+    return replacements
+
+
+def patch_variant(value: Any, variant: dict[str, str], replacements: dict[str, str]|None = None) -> Any:
+    """
+    Replaces the attribute values of a product, or the JSON of a translated product, with
+    the variant's own values, matching attribute names case insensitively. In the name,
+    description and SEO header, whole word occurrences of the representative's values are
+    replaced with the variant's (e.g. "Blue M" becomes "Red L"). The representative's
+    images are not copied. Other values are copied.
+    """
+    replacements = replacements or {}
+    if isinstance(value, Product):
+        return value.model_copy(update={"base": patch_variant(value.base, variant, replacements), "images": []}, deep=True)
+    if isinstance(value, BaseProduct):
+        return value.model_copy(update={
+            "name": patch_text(value.name, replacements),
+            "description": patch_text(value.description, replacements),
+            "seo_html_header": patch_text(value.seo_html_header, replacements),
+            "attribute_values": patch_attribute_values(value.attribute_values, variant)})
+    if isinstance(value, str) and value.startswith("{"):
+        try:
+            base = BaseProduct.model_validate_json(value)
+        except ValueError:
+            return value
+        return patch_variant(base, variant, replacements).model_dump_json()
+    return copy.deepcopy(value)
+
+
+def patch_text(text: str, replacements: dict[str, str]) -> str:
+    """Replaces whole words and phrases in one pass, so a replaced value is never replaced again."""
+    if not replacements:
+        return text
+    alternatives = "|".join(re.escape(old) for old in sorted(replacements, key=len, reverse=True))
+    pattern = re.compile(rf"(?<!\w)(?:{alternatives})(?!\w)", re.IGNORECASE)
+    return pattern.sub(lambda m: match_case(m.group(0), replacements[m.group(0).lower()]), text)
+
+
+def match_case(old: str, new: str) -> str:
+    if old.islower():
+        return new.lower()
+    if old.isupper() and len(old) > 1:
+        return new.upper()
+    return new
+
+
+def patch_attribute_values(values: list[ProductAttributeValue], variant: dict[str, str]) -> list[ProductAttributeValue]:
+    remaining = {name.lower(): (name, str(value)) for name, value in variant.items()}
+    patched = []
+    for value in values:
+        override = remaining.pop(value.name.lower(), None)
+        patched.append(ProductAttributeValue(name=value.name, value=override[1]) if override else value.model_copy())
+    patched.extend(ProductAttributeValue(name=name, value=value) for name, value in remaining.values())
+    return patched
+
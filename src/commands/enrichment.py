@@ -12,42 +12,131 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+from collections import ChainMap
+
 from model.chain import Chain, Context, Command
+from model.config import Config
+from model.examples import BaseProduct, Category, Product
+from utils.json_stream import IncrementalJSONParser
+
+DEFAULT_BASE_LANGUAGE = "US_EN"
 
 
-def category_detection_from_image(context: Context) -> None:
+async def category_detection_from_image(context: Context) -> None:
     """Using the context variables:
     * product_image
-    * category_model
-    extract the category attributes into the model"""
-    generator = context.get_config().get_generator_by_name("flash")
-    prompt_template = context.get_config().get_prompt_by_name("category_detection")
-    prompt = context.expand_variables(prompt_template.prompt)
-    context.set("category_attributes", generator.understand_image(prompt, context.get("product_image")))
+    extract the category and its attributes
+    OUT
+    * category
+    * category_attributes (the category as JSON for prompts)
+    Detection is skipped when category_attributes already exists, e.g. when the category
+    was matched from the vocabulary. The known categories of the vocabulary are offered to
+    the model as known_categories, which is the same for every product."""
+    if context.has_key("category_attributes"):
+        return
+    config = context.get_config()
+    generator = config.get_generator_by_name("flash")
+    prompt_template = config.get_prompt_by_name("category_detection")
+    defaults = {"known_categories": await get_known_categories(config)}
+    prefix = prompt_template.render_prefix(context, defaults)
+    prompt = prompt_template.render(context, defaults)
+    category = await generator.understand_image_async(prompt, context.get("product_image"), prefix=prefix,
+                                                      response_schema=Category)
+    context.set("category", category)
+    context.set("category_attributes", category.model_dump_json())
     
     
-def extract_product_details(context: Context) -> None:
+async def extract_product_details(context: Context) -> None:
     """ Using the category attributes, create a product detail using:
     IN
     * category_attributes
-    * product_attribute_value_model
     OUT
+    * product
+    * product_json
+    """
+    generator = context.get_config().get_generator_by_name("flash")
+    prompt_template = context.get_config().get_prompt_by_name("extract_product_details")
+    prefix = prompt_template.render_prefix(context)
+    prompt = prompt_template.render(context)
+    base = await generator.generate_content_async(prompt, prefix=prefix, response_schema=BaseProduct)
+    set_product(context, base)
+
+
+async def stream_product_details(context: Context) -> None:
+    """ The streaming form of extract_product_details, publishing a 'field' event
+    for each top-level field of the product as soon as it is complete.
+    OUT
+    * product
     * product_json
     """
     generator = context.get_config().get_generator_by_name("flash")
     prompt_template = context.get_config().get_prompt_by_name("extract_product_details")
-    prompt = context.expand_variables(prompt_template.prompt)
-    context.set("product_json", generator.generate_content(prompt))
+    prefix = prompt_template.render_prefix(context)
+    prompt = prompt_template.render(context)
+    
+    parser = IncrementalJSONParser()
+    chunks = []
+    async for chunk in generator.generate_content_stream_async(prompt, prefix=prefix, response_schema=BaseProduct):
+        chunks.append(chunk)
+        for name, value in parser.feed(chunk):
+            context.publish("field", {"name": name, "value": value})
+    set_product(context, BaseProduct.model_validate_json("".join(chunks)))
+
+
+async def parse_product_details(context: Context) -> None:
+    """Composes the product from the product details generated by a batch job using:
+    IN
+    * product_details (the BaseProduct as JSON)
+    OUT
+    * product
+    * product_json
+    """
+    set_product(context, BaseProduct.model_validate_json(context.get("product_details")))
+
+
+async def get_known_categories(config: Config) -> str:
+    """The categories of the vocabulary as a JSON list, empty without a vocabulary."""
+    vocabulary = await config.vocabulary.get_categories_async()
+    return vocabulary.to_json()
+
+
+def set_product(context: Context, base: BaseProduct) -> None:
+    """Composes the generated product values with the detected category into the product."""
+    category = context.get("category")
+    if category is None:
+        category = Category.model_validate_json(context.get("category_attributes"))
+    product = Product(base=base, category=category, images=[], related_products=[], derived_products=[])
+    context.set("product", product)
+    context.set("product_json", product.model_dump_json())
+
+
+async def extract_attributes_from_video(context: Context) -> None:
+    """Extracts the product attributes shown in a video using:
+    IN
+    * product_video (the path of the video file)
+    OUT
+    * video_attributes
+    Products without a video are skipped."""
+    if not context.has_key("product_video"):
+        return
+    generator = context.get_config().get_generator_by_name("flash")
+    prompt = context.get_config().get_prompt_by_name("translate_video_to_product").render(context)
+    context.set("video_attributes", await generator.understand_video_async(prompt, context.get("product_video")))
 
 
-def extract_languages(context: Context) -> None:
+async def extract_languages(context: Context) -> None:
+    """Translates the product_json into every language in languages concurrently,
+    writing each translated BaseProduct as JSON to language_<language>."""
     languages = context.get("languages")
     if languages is not None:
         generator = context.get_config().get_generator_by_name("flash")
         prompt_template = context.get_config().get_prompt_by_name("translate_product_details")
         if isinstance(languages, list):
-            for language in languages:
-                context.set("target_language", language)
-                prompt = context.expand_variables(prompt_template.prompt)
-                context.set("language_{language}", generator.generate_content(prompt))  
-            
\ No newline at end of file
+            async def translate(language: str) -> None:
+                values = ChainMap({"target_language": language}, context.state)
+                prompt = prompt_template.render(values, defaults={"base_language": DEFAULT_BASE_LANGUAGE})
+                translated = await generator.generate_content_async(prompt, response_schema=BaseProduct)
+                context.set(f"language_{language}", translated.model_dump_json())
+            
+            await asyncio.gather(*[translate(language) for language in languages])
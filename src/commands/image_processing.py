@@ -0,0 +1,179 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import io
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any
+
+from google.genai import types
+from opentelemetry import metrics
+from PIL import Image, ImageOps
+
+from model.chain import Command, Context
+from model.config import ImageProcessing, content_digest
+
+EXIF_ORIENTATION = 0x0112
+# below this size the round trip to a worker process costs more than the resize
+PROCESS_POOL_MIN_BYTES = 256 * 1024
+
+meter = metrics.get_meter(__name__)
+image_bytes_histogram = meter.create_histogram(
+    "images.encoded_size", unit="By", description="Image sizes before and after pre-processing.")
+
+
+class ImagePreprocessCommand(Command):
+    """
+    Shrinks the image in input_variable_name before it is sent to a model: it is EXIF
+    oriented, resized to fit max_edge and re-encoded, and written to output_variable_name
+    as an inline types.Part. The settings default to the [images] table of the config.
+    Encoded images are cached by the hash of the source, and large images are resized
+    in a process pool so the work never competes with the event loop.
+    """
+    def __init__(self,
+                 name: str,
+                 input_variable_name: str,
+                 output_variable_name: str,
+                 max_edge: int|None = None,
+                 image_format: str|None = None,
+                 quality: int|None = None):
+        super().__init__(name, self.do_execute, reads=[input_variable_name], writes=[output_variable_name])
+        self.input_variable_name = input_variable_name
+        self.output_variable_name = output_variable_name
+        self.max_edge = max_edge
+        self.image_format = image_format
+        self.quality = quality
+
+    async def do_execute(self, context: Context) -> None:
+        if not context.has_key(self.input_variable_name):
+            return
+        settings = context.get_config().images
+        max_edge = self.max_edge if self.max_edge is not None else settings.max_edge
+        image_format = self.image_format if self.image_format is not None else settings.format
+        quality = self.quality if self.quality is not None else settings.quality
+
+        source, digest = await asyncio.to_thread(read_source, context.get(self.input_variable_name))
+        key = f"{digest.hex()}:{max_edge}:{image_format}:{quality}"
+
+        async def process() -> bytes:
+            encoded = await settings.encoded_cache.get_async(key)
+            if encoded is None:
+                encoded = await run_preprocess(settings, source, max_edge, image_format, quality)
+                await settings.encoded_cache.put_async(key, encoded)
+            return encoded
+
+        encoded = await settings.single_flight.do_async(key, process)
+        if isinstance(source, bytes):
+            image_bytes_histogram.record(len(source), {"stage": "source"})
+        image_bytes_histogram.record(len(encoded), {"stage": "encoded"})
+        mime_type = Image.MIME.get(image_format.upper(), "image/jpeg")
+        context.set(self.output_variable_name, types.Part.from_bytes(data=encoded, mime_type=mime_type))
+
+
+def get_source(image: Any) -> bytes|Image.Image:
+    """
+    The source of an image as its encoded bytes when available, which are both cheaper to
+    hash and to send to a worker process than the decoded pixels.
+    """
+    if isinstance(image, types.Part) and image.inline_data is not None:
+        return image.inline_data.data
+    if isinstance(image, Image.Image) and getattr(image, "filename", None):
+        with open(image.filename, "rb") as f:
+            return f.read()
+    if isinstance(image, (bytes, bytearray)):
+        return bytes(image)
+    return image
+
+
+def read_source(image: Any) -> tuple[bytes|Image.Image, bytes]:
+    """The source of an image and its digest, run in a thread as it may read a file and hashes the whole image."""
+    source = get_source(image)
+    return source, content_digest(source)
+
+
+def get_source_size(source: bytes|Image.Image) -> int:
+    if isinstance(source, bytes):
+        return len(source)
+    return source.width * source.height * len(source.getbands())
+
+
+async def run_preprocess(settings: ImageProcessing,
+                         source: bytes|Image.Image,
+                         max_edge: int,
+                         image_format: str,
+                         quality: int) -> bytes:
+    if settings.process_pool_size > 0 and get_source_size(source) >= PROCESS_POOL_MIN_BYTES:
+        pool = get_image_process_pool(settings.process_pool_size)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(pool, preprocess_image, source, max_edge, image_format, quality)
+    return await asyncio.to_thread(preprocess_image, source, max_edge, image_format, quality)
+
+
+def preprocess_image(source: bytes|Image.Image, max_edge: int, image_format: str, quality: int) -> bytes:
+    """
+    Orients, resizes and re-encodes an image. A source already in the target format that
+    needs no changes is returned as is when re-encoding would not make it smaller.
+    """
+    image = Image.open(io.BytesIO(source)) if isinstance(source, bytes) else source
+    source_format = image.format
+    if image is not source:
+        if source_format == "JPEG":
+            # decode a reduced scale of large JPEGs rather than every pixel
+            image.draft("RGB", (max_edge, max_edge))
+    else:
+        # the image is the context's value, which later commands read unchanged
+        image = image.copy()
+
+    rotated = image.getexif().get(EXIF_ORIENTATION, 1) != 1
+    image = ImageOps.exif_transpose(image)
+    resized = max(image.size) > max_edge
+    if resized:
+        image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+    if image_format.upper() == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, quality=quality, optimize=True)
+    encoded = buffer.getvalue()
+    unchanged = not (rotated or resized) and source_format == image_format.upper()
+    if isinstance(source, bytes) and unchanged and len(source) <= len(encoded):
+        return source
+    return encoded
+
+
+_image_process_pool: ProcessPoolExecutor|None = None
+_image_process_pool_lock = threading.Lock()
+
+
+def get_image_process_pool(max_workers: int) -> ProcessPoolExecutor:
+    """
+    Returns the process wide pool for resizing images, creating it on first use. Workers
+    are spawned rather than forked, since the parent runs threads (e.g. the command executor).
+    """
+    global _image_process_pool
+    if _image_process_pool is None:
+        with _image_process_pool_lock:
+            if _image_process_pool is None:
+                _image_process_pool = ProcessPoolExecutor(
+                    max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+    return _image_process_pool
+
+
+def shutdown_image_process_pool(wait: bool = True) -> None:
+    global _image_process_pool
+    with _image_process_pool_lock:
+        if _image_process_pool is not None:
+            _image_process_pool.shutdown(wait=wait)
+            _image_process_pool = None
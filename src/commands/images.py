@@ -11,74 +11,77 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import asyncio
+import os
+import urllib.parse
+from typing import Any
 
-import tempfile
 from model.chain import Command, Context
-from google.cloud import storage
-import requests
-import os
+from model.clients import get_client_registry
+from model.ingestion import get_image_ingester
 
-import urllib.parse
 
 def get_filename_from_url(url):
     parsed_url = urllib.parse.urlparse(url)
     file_path = parsed_url.path
     return os.path.basename(file_path)
 
-storage_client = storage.Client()
 
-class ImageDownloadCommand(Command):
+def get_blob_name(url: str, prefix: str, suffix: str) -> str:
+    """The prefix, the file name of the URL with the suffix and then its extension."""
+    stem, extension = os.path.splitext(get_filename_from_url(url))
+    return f"{prefix}{stem}{suffix}{extension}"
 
+
+class ImageDownloadCommand(Command):
+    """
+    Copies the images of a product, e.g. a gallery, into a storage bucket. The images are
+    streamed concurrently from their URLs into the bucket by the process wide ingester,
+    configured by the optional [images.ingestion] table (see model.ingestion).
+    """
     def __init__(self,
                  name: str, 
                  input_variable_name: str, 
                  output_variable_name: str,
                  storage_bucket_name: str, prefix: str, suffix: str):
-        super(name, self.do_execute)
+        super().__init__(name, self.do_execute, reads=[input_variable_name], writes=[output_variable_name])
         self.input_variable_name  = input_variable_name
         self.output_variable_name = output_variable_name
         self.storage_bucket_name  = storage_bucket_name
         self.prefix               = prefix
         self.suffix               = suffix
-        self.bucket_exists = storage_client.bucket_exists(storage_bucket_name)
-        
-        if not self.bucket_exists:
-            try:
-                storage_client.create_bucket(storage_bucket_name)
-                self.bucket_exists = True
-            except Exception as e:
-                print(e)
         
+    def create_bucket(self, storage_client: Any):
+        """Creates the bucket unless it exists."""
+        if not storage_client.bucket(self.storage_bucket_name).exists():
+            storage_client.create_bucket(self.storage_bucket_name)
     
-    def do_execute(self, context: Context):
+    async def do_execute(self, context: Context):
         """
         Takes a list of URLs, downloads them to a storage bucket and returns a map of:
         {
-            "original_file_name": "gcs_path"
+            "url": "gcs_path"
         }
         Where:
-        * Original file name is the file name minus the URL prefix.
-        * gcs_path = bucket + prefix + file_name + suffix
+        * gcs_path = gs:// bucket / prefix + file_name + suffix + extension
+        An image that cannot be copied is added to the context errors and left out of the map.
         """
-        
-        if context.has_key(self.input_variable_name):
-            images = context.get(self.input_variable_name)
-            out = {}
-            if isinstance(images, list):
-                for image in images:
-                    full_name = get_filename_from_url(image)
-                    [fname, ext] = full_name.split('.')
-                    
-                    if image.startswith('http'):
-                        data = requests.get(image).content
-                        with tempfile.TemporaryFile(mode="w+") as fp:
-                            fp.write(data)
-                            fp.seek(0)
-                            bucket = storage_client.bucket(self.storage_bucket_name)
-                            blob = bucket.blob(f"{self.prefix}{fname}{self.suffix}{ext}")
-                            blob.upload_from_string(fp)
-                            out[image] = f"{bucket.path}{self.prefix}{fname}{self.suffix}{ext}"
-            
-            context.set(self.output_variable_name, out)
-            
-                    
\ No newline at end of file
+        if not context.has_key(self.input_variable_name):
+            return
+        images = context.get(self.input_variable_name)
+        urls = [images] if isinstance(images, str) else list(images or [])
+        urls = list(dict.fromkeys(url for url in urls if url.startswith("http")))
+        out = {}
+        if len(urls) > 0:
+            ingester = get_image_ingester(context.get_config().images.ingestion)
+            # checked once per process, however many commands use the bucket
+            await asyncio.to_thread(get_client_registry().ensure_exists, "storage.bucket", self.storage_bucket_name,
+                                    lambda: self.create_bucket(ingester.get_storage_client()))
+            results = await ingester.ingest_many(
+                [(url, self.storage_bucket_name, get_blob_name(url, self.prefix, self.suffix)) for url in urls])
+            for url, result in zip(urls, results):
+                if isinstance(result, Exception):
+                    context.add_error(result)
+                else:
+                    out[url] = result
+        context.set(self.output_variable_name, out)
@@ -13,13 +13,58 @@
 # limitations under the License.
 
 # A collection of command objects that can be reused in multiple chains
-from commands.enrichment import category_detection_from_image, extract_languages, extract_product_details
-from model.chain import Chain, Command
+from commands.enrichment import (category_detection_from_image, extract_attributes_from_video, extract_languages,
+                                 extract_product_details, parse_product_details, stream_product_details)
+from commands.image_processing import ImagePreprocessCommand
+from commands.vocabulary import CategoryLookupCommand
+from model.batch_prediction import BatchExecutor, BatchPredictor, GeminiBatchExecutor
+from model.chain import Chain, Command, GraphChain
+from model.config import Config
+from model.examples import BaseProduct
 
 
-category_detector = Command('category-detection', category_detection_from_image)
-content_enricher = Command('content-enricher)', extract_product_details)
-language_extractor = Command('language-extractor', extract_languages)
+# Shrinks the product image in place before it is sent to the model
+image_preprocessor = ImagePreprocessCommand('image-preprocessing', "product_image", "product_image")
+# Matches the product text to a known category, so detection only runs for unmatched products
+category_lookup = CategoryLookupCommand('category-lookup')
+category_detector = Command('category-detection', category_detection_from_image,
+                            reads=["product_image"],
+                            writes=["category", "category_attributes"])
+content_enricher = Command('content-enricher)', extract_product_details,
+                           reads=["category", "category_attributes"],
+                           writes=["product", "product_json"])
+content_streamer = Command('content-streamer', stream_product_details,
+                           reads=["category", "category_attributes"],
+                           writes=["product", "product_json"])
+language_extractor = Command('language-extractor', extract_languages,
+                             reads=["languages", "product_json", "base_language"],
+                             writes=["language_*"])
+product_parser = Command('product-parser', parse_product_details,
+                          reads=["product_details"],
+                          writes=["product", "product_json"])
+video_extractor = Command('video-extraction', extract_attributes_from_video,
+                          reads=["product_video"],
+                          writes=["video_attributes"])
 
-# A simple chain of responsibility that executes the commands in series
-product_enrichment_from_image = Chain("product-enrichment-from-image", category_detector, content_enricher, language_extractor)
\ No newline at end of file
+# A chain of responsibility that executes the commands as soon as the keys they read are written,
+# so commands added here without a data dependency on each other run concurrently.
+product_enrichment_from_image = GraphChain("product-enrichment-from-image", image_preprocessor, category_lookup, category_detector, content_enricher, language_extractor, video_extractor)
+
+# The same chain publishing the product fields as they are generated, for streaming responses.
+product_enrichment_streaming = GraphChain("product-enrichment-streaming", image_preprocessor, category_lookup, category_detector, content_streamer, language_extractor, video_extractor)
+
+# The commands of product_enrichment_from_image before and after the product details, for
+# generating the product details of many products as a batch job in between (see worker --batch).
+product_detection_from_image = GraphChain("product-detection-from-image", image_preprocessor, category_lookup, category_detector)
+product_completion = GraphChain("product-completion", product_parser, language_extractor, video_extractor)
+
+
+def create_batch_enricher(config: Config, executor: BatchExecutor|None = None) -> BatchPredictor:
+    """
+    The extract_product_details prompt of the flash generator as a batch prediction
+    writing product_details, executed as a Gemini batch job unless given an executor.
+    """
+    generator = config.get_generator_by_name("flash")
+    return BatchPredictor(generator, config.get_prompt_by_name("extract_product_details"), "product_details",
+                          executor=executor if executor is not None else GeminiBatchExecutor(generator),
+                          response_schema=BaseProduct)
@@ -10,4 +10,73 @@
 # distributed under the License is distributed on an "AS IS" BASIS,
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
-# limitations under the License.
\ No newline at end of file
+# limitations under the License.
+
+import numpy as np
+from opentelemetry import metrics
+
+from model.chain import Command, Context
+from model.vocabulary import DEFAULT_TEXT_VARIABLE_NAMES
+
+meter = metrics.get_meter(__name__)
+lookup_counter = meter.create_counter(
+    "vocabulary.lookups", description="Category lookups by result (matched, unmatched or skipped).")
+score_histogram = meter.create_histogram(
+    "vocabulary.score", description="Cosine similarity of the nearest known category.")
+
+
+class CategoryLookupCommand(Command):
+    """
+    Matches the product to the nearest known category of the [vocabulary] before category
+    detection. The product is embedded from the text in text_variable_names, or taken from
+    vector_variable_name when an embedding in the same space is already in the context.
+    When the similarity reaches min_score the category and category_attributes are written,
+    and category detection, which reads neither, is skipped as their value already exists.
+    Without text_variable_names the command declares it reads the default product_name and
+    product_description, a [vocabulary] configured with other names needs them passed here.
+    """
+    def __init__(self,
+                 name: str,
+                 text_variable_names: list[str]|None = None,
+                 vector_variable_name: str|None = None,
+                 min_score: float|None = None):
+        text_reads = text_variable_names if text_variable_names is not None else DEFAULT_TEXT_VARIABLE_NAMES
+        reads = list(text_reads) + ([vector_variable_name] if vector_variable_name else [])
+        super().__init__(name, self.do_execute, reads=reads, writes=["category", "category_attributes", "category_score"])
+        self.text_variable_names = text_variable_names
+        self.vector_variable_name = vector_variable_name
+        self.min_score = min_score
+
+    async def do_execute(self, context: Context) -> None:
+        config = context.get_config()
+        settings = config.vocabulary
+        vocabulary = await settings.get_categories_async()
+        if context.has_key("category_attributes") or len(vocabulary) == 0:
+            lookup_counter.add(1, {"result": "skipped"})
+            return
+
+        vector = await self.get_vector(context, settings.text_variable_names)
+        if vector is None:
+            lookup_counter.add(1, {"result": "skipped"})
+            return
+
+        category, score = vocabulary.nearest(vector)
+        score_histogram.record(score)
+        min_score = self.min_score if self.min_score is not None else settings.min_score
+        if category is None or score < min_score:
+            lookup_counter.add(1, {"result": "unmatched"})
+            return
+        lookup_counter.add(1, {"result": "matched"})
+        context.set("category", category)
+        context.set("category_attributes", category.model_dump_json())
+        context.set("category_score", score)
+
+    async def get_vector(self, context: Context, default_text_variable_names: list[str]) -> np.ndarray|None:
+        if self.vector_variable_name is not None and context.has_key(self.vector_variable_name):
+            return np.asarray(context.get(self.vector_variable_name), dtype=np.float32)
+        names = self.text_variable_names if self.text_variable_names is not None else default_text_variable_names
+        text = "\n".join(str(context.get(n)) for n in names if context.get(n))
+        if len(text) == 0:
+            return None
+        embedding = context.get_config().get_embedding()
+        return (await embedding.embed_texts_async([text]))[0]
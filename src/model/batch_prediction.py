@@ -0,0 +1,314 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import abc
+import asyncio
+import base64
+import io
+import json
+import logging
+import os
+import tempfile
+from typing import Any, AsyncIterator, Callable, Iterator, Mapping
+
+from google.genai import types
+from PIL import Image
+from pydantic import BaseModel, ValidationError
+
+from model.chain import DEFAULT_MAX_IN_FLIGHT, Command, Context
+from model.config import JSON_MIME_TYPE, ContentGenerator, NamedPrompt
+
+logger = logging.getLogger(__name__)
+
+JSONL_MIME_TYPE = "jsonl"
+DEFAULT_POLL_INTERVAL_SECONDS = 30.0
+MAX_POLL_INTERVAL_SECONDS = 300.0
+
+JOB_SUCCEEDED = "JOB_STATE_SUCCEEDED"
+JOB_TERMINAL_STATES = {
+    "JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED",
+    "JOB_STATE_EXPIRED", "JOB_STATE_PARTIALLY_SUCCEEDED"}
+
+
+class BatchResult():
+    """The response (or error) for a single keyed request of a batch job."""
+    def __init__(self, key: str, text: str|None = None, error: str|None = None):
+        self.key = key
+        self.text = text
+        self.error = error
+
+
+class BatchExecutor(abc.ABC):
+    """
+    Executes a JSONL file of keyed generate content requests out of band.
+    Implementations submit the file, report the job state and return keyed results.
+    """
+    @abc.abstractmethod
+    def submit(self, generator: ContentGenerator, request_file: str) -> str:
+        pass
+
+    @abc.abstractmethod
+    def get_state(self, job_name: str) -> str:
+        pass
+
+    @abc.abstractmethod
+    def get_results(self, job_name: str) -> Iterator[BatchResult]:
+        pass
+
+
+class GeminiBatchExecutor(BatchExecutor):
+    """Runs the request file as a Gemini batch job, uploading the file and downloading the results."""
+    def __init__(self, generator: ContentGenerator):
+        self.client = generator.client
+
+    def submit(self, generator: ContentGenerator, request_file: str) -> str:
+        uploaded = self.client.files.upload(
+            file=request_file,
+            config=types.UploadFileConfig(mime_type=JSONL_MIME_TYPE, display_name=os.path.basename(request_file)))
+        job = self.client.batches.create(
+            model=generator.model_name,
+            src=uploaded.name,
+            config=types.CreateBatchJobConfig(display_name=os.path.basename(request_file)))
+        return job.name
+
+    def get_state(self, job_name: str) -> str:
+        return self.client.batches.get(name=job_name).state.name
+
+    def get_results(self, job_name: str) -> Iterator[BatchResult]:
+        job = self.client.batches.get(name=job_name)
+        if job.dest is None or job.dest.file_name is None:
+            return
+        content = self.client.files.download(file=job.dest.file_name)
+        for line in content.decode().splitlines():
+            if line.strip():
+                yield parse_result_line(json.loads(line))
+
+
+class LocalBatchExecutor(BatchExecutor):
+    """
+    Runs the request file in process with the given function, which receives a request
+    (the REST GenerateContentRequest dictionary) and returns the response text.
+    Intended for tests and small runs without submitting a batch job.
+    """
+    def __init__(self, respond: Callable[[dict[str, Any]], str]):
+        self.respond = respond
+        self.jobs: dict[str, list[BatchResult]] = {}
+
+    def submit(self, generator: ContentGenerator, request_file: str) -> str:
+        results = []
+        with open(request_file) as f:
+            for line in f:
+                entry = json.loads(line)
+                try:
+                    results.append(BatchResult(entry["key"], text=self.respond(entry["request"])))
+                except Exception as e:
+                    results.append(BatchResult(entry["key"], error=str(e)))
+        job_name = f"local/{len(self.jobs)}"
+        self.jobs[job_name] = results
+        return job_name
+
+    def get_state(self, job_name: str) -> str:
+        return JOB_SUCCEEDED
+
+    def get_results(self, job_name: str) -> Iterator[BatchResult]:
+        return iter(self.jobs[job_name])
+
+
+class BatchPredictor():
+    """
+    Runs a single prompt of a chain over many contexts as an offline batch job instead of
+    the online request path. Each context's prompt (and optional image) is rendered into a
+    keyed line of a JSONL request file, the file is executed, and every response is joined
+    back to its context by key before the remainder of the chain is executed.
+    With a response_schema, responses are constrained to the model and validated on join.
+    The defaults fill the prompt variables that are not in the context.
+    """
+    def __init__(self,
+                 generator: ContentGenerator,
+                 prompt: NamedPrompt,
+                 output_variable_name: str,
+                 executor: BatchExecutor|None = None,
+                 image_variable_name: str|None = None,
+                 key_variable_name: str|None = None,
+                 work_dir: str|None = None,
+                 poll_interval_seconds: float = DEFAULT_POLL_INTERVAL_SECONDS,
+                 response_schema: type[BaseModel]|None = None,
+                 defaults: Mapping[str, Any]|None = None):
+        self.generator = generator
+        self.prompt = prompt
+        self.output_variable_name = output_variable_name
+        self.executor = executor if executor is not None else GeminiBatchExecutor(generator)
+        self.image_variable_name = image_variable_name
+        self.key_variable_name = key_variable_name
+        self.work_dir = work_dir
+        self.poll_interval_seconds = poll_interval_seconds
+        self.response_schema = response_schema
+        self.defaults = defaults
+
+    def get_key(self, index: int, context: Context) -> str:
+        if self.key_variable_name is not None and context.has_key(self.key_variable_name):
+            return str(context.get(self.key_variable_name))
+        return str(index)
+
+    def build_request(self, context: Context) -> dict[str, Any]:
+        """
+        Renders the context into a REST GenerateContentRequest with the same safety
+        settings and tools as the generator's online requests.
+        """
+        prefix = self.prompt.render_prefix(context, self.defaults)
+        text = self.prompt.render(context, self.defaults)
+        parts: list[dict[str, Any]] = [{"text": f"{prefix}\n{text}" if prefix else text}]
+        if self.image_variable_name is not None and context.has_key(self.image_variable_name):
+            parts.append(inline_data(context.get(self.image_variable_name)))
+
+        generator = self.generator
+        generation_config = {
+            "temperature": generator.temperature,
+            "topP": generator.top_p,
+            "topK": generator.top_k,
+            "maxOutputTokens": generator.max_output_tokens,
+            "responseMimeType": generator.output_format,
+        }
+        if self.response_schema is not None:
+            generation_config["responseMimeType"] = JSON_MIME_TYPE
+            generation_config["responseJsonSchema"] = self.response_schema.model_json_schema()
+        config = generator.get_generative_config()
+        request = {
+            "contents": [{"role": "user", "parts": parts}],
+            "systemInstruction": {"parts": [{"text": generator.instructions}]},
+            "generationConfig": generation_config,
+            "safetySettings": [to_rest(setting) for setting in config.safety_settings or []],
+        }
+        if config.tools:
+            request["tools"] = [to_rest(tool) for tool in config.tools]
+        return request
+
+    def write_requests(self, contexts: list[Context], request_file: str) -> dict[str, Context]:
+        """
+        Writes one keyed request per context, returning the contexts by key. A context that
+        cannot be rendered has the error recorded and is left out of the file.
+        """
+        keyed: dict[str, Context] = {}
+        with open(request_file, "w") as f:
+            for index, context in enumerate(contexts):
+                key = self.get_key(index, context)
+                if key in keyed:
+                    context.add_error(ValueError(f"duplicate batch key: {key}"))
+                    continue
+                try:
+                    request = self.build_request(context)
+                except Exception as e:
+                    context.add_error(e)
+                    continue
+                f.write(json.dumps({"key": key, "request": request}))
+                f.write("\n")
+                keyed[key] = context
+        return keyed
+
+    async def predict(self, contexts: list[Context]) -> list[Context]:
+        """Executes the prompt for every context as one batch job and joins the responses by key."""
+        directory = self.work_dir if self.work_dir is not None else tempfile.gettempdir()
+        with tempfile.NamedTemporaryFile(mode="w", suffix=".jsonl", dir=directory, delete=False) as f:
+            request_file = f.name
+        try:
+            keyed = await asyncio.to_thread(self.write_requests, contexts, request_file)
+            if len(keyed) == 0:
+                return contexts
+            job_name = await asyncio.to_thread(self.executor.submit, self.generator, request_file)
+            logger.info("submitted batch job %s with %d requests", job_name, len(keyed))
+
+            state = await self.wait_for(job_name)
+            results = await asyncio.to_thread(lambda: list(self.executor.get_results(job_name)))
+        finally:
+            os.remove(request_file)
+
+        for result in results:
+            context = keyed.pop(result.key, None)
+            if context is None:
+                continue
+            if result.error is not None:
+                context.add_error(RuntimeError(f"batch request {result.key} failed: {result.error}"))
+            elif self.response_schema is not None:
+                try:
+                    self.response_schema.model_validate_json(result.text)
+                    context.set(self.output_variable_name, result.text)
+                except ValidationError as e:
+                    context.add_error(e)
+            else:
+                context.set(self.output_variable_name, result.text)
+        for key, context in keyed.items():
+            context.add_error(RuntimeError(f"batch job {job_name} ended {state} without a response for {key}"))
+        return contexts
+
+    async def wait_for(self, job_name: str) -> str:
+        """Polls the job until it reaches a terminal state, backing off up to MAX_POLL_INTERVAL_SECONDS."""
+        interval = self.poll_interval_seconds
+        while True:
+            state = await asyncio.to_thread(self.executor.get_state, job_name)
+            if state in JOB_TERMINAL_STATES:
+                return state
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, MAX_POLL_INTERVAL_SECONDS)
+
+    async def execute_many(self,
+                           contexts: list[Context],
+                           then: Command|None = None,
+                           max_in_flight: int = DEFAULT_MAX_IN_FLIGHT) -> AsyncIterator[Context]:
+        """
+        Runs the batch prediction, then resumes the rest of the chain (then) for every
+        context that succeeded, yielding contexts as they complete.
+        """
+        await self.predict(contexts)
+        failed = [c for c in contexts if c.has_errors()]
+        for context in failed:
+            yield context
+
+        succeeded = [c for c in contexts if not c.has_errors()]
+        if then is None:
+            for context in succeeded:
+                yield context
+        else:
+            async for context in then.execute_many(succeeded, max_in_flight=max_in_flight):
+                yield context
+
+
+def inline_data(image: Any) -> dict[str, Any]:
+    """Encodes an image (PIL Image, types.Part or bytes) as a REST inline data part."""
+    if isinstance(image, types.Part) and image.inline_data is not None:
+        data, mime_type = image.inline_data.data, image.inline_data.mime_type
+    elif isinstance(image, Image.Image):
+        buffer = io.BytesIO()
+        image_format = image.format if image.format else "PNG"
+        image.save(buffer, format=image_format)
+        data, mime_type = buffer.getvalue(), Image.MIME.get(image_format, "image/png")
+    else:
+        data, mime_type = bytes(image), "image/jpeg"
+    return {"inlineData": {"mimeType": mime_type, "data": base64.b64encode(data).decode()}}
+
+
+def to_rest(value: BaseModel) -> dict[str, Any]:
+    """Serializes a google.genai type into its REST (camel case JSON) form."""
+    return value.model_dump(mode="json", exclude_none=True, by_alias=True)
+
+
+def parse_result_line(entry: dict[str, Any]) -> BatchResult:
+    """Parses a line of a batch job's output file into a keyed result."""
+    key = entry.get("key")
+    if entry.get("error"):
+        return BatchResult(key, error=json.dumps(entry["error"]))
+    response = entry.get("response", {})
+    candidates = response.get("candidates", [])
+    if len(candidates) == 0:
+        return BatchResult(key, error=json.dumps(response.get("promptFeedback", "no candidates")))
+    parts = candidates[0].get("content", {}).get("parts", [])
+    return BatchResult(key, text="".join(p.get("text", "") for p in parts))
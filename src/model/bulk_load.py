@@ -0,0 +1,332 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any
+
+from opentelemetry import metrics
+
+from model.sinks import get_sink
+
+logger = logging.getLogger(__name__)
+
+FORMAT_NDJSON = "NDJSON"
+FORMAT_PARQUET = "PARQUET"
+EXTENSIONS = {FORMAT_NDJSON: ".ndjson", FORMAT_PARQUET: ".parquet"}
+PART_SUFFIX = ".part"
+MANIFEST_FILE_NAME = "manifest.jsonl"
+STATE_WRITTEN = "written"
+STATE_FAILED = "failed"
+STATE_LOADED = "loaded"
+DEFAULT_MAX_FILE_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_LOADS_IN_FLIGHT = 4
+
+meter = metrics.get_meter(__name__)
+load_latency_histogram = meter.create_histogram(
+    "sink.load_latency", unit="s", description="Time to load a file into a table by table.")
+file_counter = meter.create_counter(
+    "sink.files", description="Files of bulk load sinks by table and result (loaded or failed).")
+file_bytes_histogram = meter.create_histogram(
+    "sink.file_size", unit="By", description="Size of the files loaded by bulk load sinks by table.")
+
+
+class LoadManifest():
+    """
+    The state of every file of a bulk load sink, appended to a JSON lines file and synced
+    to disk, so a restarted sink loads the files written but not loaded, and only those.
+    Failed loads are recorded too, so every attempt at a file gets its own load job.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.states: dict[str, str] = {}
+        self.attempts: dict[str, int] = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.update(entry["file"], entry["state"])
+
+    def update(self, file_name: str, state: str) -> None:
+        self.states[file_name] = state
+        if state == STATE_FAILED:
+            self.attempts[file_name] = self.attempts.get(file_name, 0) + 1
+
+    def record(self, file_name: str, state: str) -> None:
+        with self.lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps({"file": file_name, "state": state, "time": time.time()}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.update(file_name, state)
+
+    def get_attempt(self, file_name: str) -> int:
+        """The number of failed loads of the file, which is the attempt of its next load."""
+        with self.lock:
+            return self.attempts.get(file_name, 0)
+
+    def get_pending(self) -> list[str]:
+        with self.lock:
+            return [f for f, state in self.states.items() if state in (STATE_WRITTEN, STATE_FAILED)]
+
+
+class BigQueryLoader():
+    """
+    Appends a file to a table with a load job. The job id is derived from the table, the
+    file and the attempt, so a file loaded before a crash, but not yet recorded, is never
+    loaded again. An existing job is only reused if it has not failed, otherwise the load
+    moves on to the next attempt.
+    """
+    def __init__(self, client: Any):
+        self.client = client
+
+    def load(self, path: str, table: str, file_format: str, schema: list|None, attempt: int = 0) -> None:
+        from google.api_core.exceptions import Conflict
+        from google.cloud import bigquery
+
+        job_config = bigquery.LoadJobConfig(
+            source_format=(bigquery.SourceFormat.PARQUET if file_format == FORMAT_PARQUET
+                           else bigquery.SourceFormat.NEWLINE_DELIMITED_JSON),
+            schema=schema,
+            autodetect=schema is None,
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND)
+        while True:
+            job_id = get_job_id(table, path, attempt)
+            with open(path, "rb") as f:
+                try:
+                    job = self.client.load_table_from_file(f, table, job_id=job_id, job_config=job_config)
+                except Conflict:
+                    job = self.client.get_job(job_id)
+                    if job.done() and job.error_result is not None:
+                        # failed before a crash stopped it from being recorded
+                        attempt += 1
+                        continue
+            job.result()
+            return
+
+
+class LocalLoader():
+    """A stand-in for BigQueryLoader that copies loaded files to directory/table, for tests and local runs."""
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def load(self, path: str, table: str, file_format: str, schema: list|None, attempt: int = 0) -> None:
+        target = os.path.join(self.directory, table)
+        os.makedirs(target, exist_ok=True)
+        shutil.copyfile(path, os.path.join(target, os.path.basename(path)))
+
+    def read_rows(self, table: str) -> list[dict[str, Any]]:
+        """The rows of every file loaded into the table."""
+        target = os.path.join(self.directory, table)
+        rows = []
+        for name in sorted(os.listdir(target)) if os.path.exists(target) else []:
+            rows.extend(read_file(os.path.join(target, name)))
+        return rows
+
+
+class BulkLoadSink():
+    """
+    Writes rows for a table to local NDJSON or Parquet files, rotated at max_file_bytes,
+    and loads every finished file with the loader, up to max_loads_in_flight at once.
+    NDJSON rows are on disk once put returns, while Parquet rows are kept in memory until
+    the file is written. The manifest in the directory records which files are loaded,
+    and files left over from a previous process are loaded when the sink is created.
+    Files that failed to load are reported by flush and close, and loaded again by the
+    next sink. Parquet needs the optional pyarrow package.
+    """
+    def __init__(self,
+                 loader: Any,
+                 table: str,
+                 directory: str,
+                 file_format: str = FORMAT_NDJSON,
+                 schema: list|None = None,
+                 max_file_bytes: int = DEFAULT_MAX_FILE_BYTES,
+                 max_loads_in_flight: int = DEFAULT_MAX_LOADS_IN_FLIGHT):
+        if file_format not in EXTENSIONS:
+            raise ValueError(f"unsupported file format {file_format}, expected one of {list(EXTENSIONS)}")
+        if file_format == FORMAT_PARQUET:
+            import_pyarrow()
+        self.loader = loader
+        self.table = table
+        self.directory = directory
+        self.file_format = file_format
+        self.schema = schema
+        self.max_file_bytes = max_file_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = LoadManifest(os.path.join(directory, MANIFEST_FILE_NAME))
+        self.executor = ThreadPoolExecutor(max_workers=max_loads_in_flight, thread_name_prefix=f"load-{table}")
+        self.loads: set[Future] = set()
+        self.failures: list[tuple[str, Exception]] = []
+        self.loads_lock = threading.Lock()
+        self.lock = threading.Lock()
+
+        self.part_path: str|None = None
+        self.part_file: Any = None
+        self.part_rows: list[dict[str, Any]] = []
+        self.part_bytes = 0
+        self.recover()
+
+    def put(self, rows: list[dict[str, Any]]) -> None:
+        lines = [json.dumps(row, default=str) + "\n" for row in rows]
+        with self.lock:
+            if self.part_path is None:
+                self.part_path = os.path.join(self.directory, self.new_file_name() + PART_SUFFIX)
+            if self.file_format == FORMAT_NDJSON:
+                if self.part_file is None:
+                    self.part_file = open(self.part_path, "a")
+                self.part_file.writelines(lines)
+                self.part_file.flush()
+            else:
+                self.part_rows.extend(rows)
+            self.part_bytes += sum(len(line) for line in lines)
+            if self.part_bytes >= self.max_file_bytes:
+                self.rotate()
+
+    def new_file_name(self) -> str:
+        return f"{self.table}-{time.time_ns()}-{uuid.uuid4().hex[:8]}{EXTENSIONS[self.file_format]}"
+
+    def rotate(self) -> None:
+        """Finishes the current file and starts loading it, must be called holding the lock."""
+        if self.part_path is None:
+            return
+        if self.part_file is not None:
+            self.part_file.close()
+        else:
+            write_parquet(self.part_path, self.part_rows)
+        path = self.part_path.removesuffix(PART_SUFFIX)
+        os.replace(self.part_path, path)
+        self.part_path, self.part_file, self.part_rows, self.part_bytes = None, None, [], 0
+        self.manifest.record(os.path.basename(path), STATE_WRITTEN)
+        self.submit(os.path.basename(path))
+
+    def submit(self, file_name: str) -> None:
+        future = self.executor.submit(self.load, file_name)
+        with self.loads_lock:
+            self.loads.add(future)
+        future.add_done_callback(self.discard)
+
+    def discard(self, future: Future) -> None:
+        with self.loads_lock:
+            self.loads.discard(future)
+
+    def load(self, file_name: str) -> None:
+        path = os.path.join(self.directory, file_name)
+        attributes = {"table": self.table}
+        started = time.monotonic()
+        try:
+            file_bytes_histogram.record(os.path.getsize(path), attributes)
+            self.loader.load(path, self.table, self.file_format, self.schema, self.manifest.get_attempt(file_name))
+        except Exception as e:
+            # the file stays pending in the manifest and is loaded again, with a new job, by the next sink
+            logger.error("failed to load %s into %s: %s", file_name, self.table, e)
+            self.manifest.record(file_name, STATE_FAILED)
+            file_counter.add(1, dict(attributes, result="failed"))
+            with self.loads_lock:
+                self.failures.append((file_name, e))
+            raise
+        load_latency_histogram.record(time.monotonic() - started, attributes)
+        self.manifest.record(file_name, STATE_LOADED)
+        file_counter.add(1, dict(attributes, result="loaded"))
+        os.remove(path)
+
+    def recover(self) -> None:
+        """Finishes the files of a previous process and loads the files it did not load."""
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(PART_SUFFIX) and name.startswith(f"{self.table}-"):
+                path = os.path.join(self.directory, name)
+                if name.removesuffix(PART_SUFFIX).endswith(EXTENSIONS[FORMAT_NDJSON]):
+                    truncate_partial_line(path)
+                    final = path.removesuffix(PART_SUFFIX)
+                    os.replace(path, final)
+                    self.manifest.record(os.path.basename(final), STATE_WRITTEN)
+                else:
+                    os.remove(path)
+        for name in self.manifest.get_pending():
+            if name.startswith(f"{self.table}-") and os.path.exists(os.path.join(self.directory, name)):
+                logger.info("loading %s left by a previous process into %s", name, self.table)
+                self.submit(name)
+
+    def flush(self) -> None:
+        """Finishes the current file and waits until every file is loaded, raising LoadError if any failed."""
+        with self.lock:
+            self.rotate()
+        with self.loads_lock:
+            loads = list(self.loads)
+        wait(loads)
+        with self.loads_lock:
+            failures, self.failures = self.failures, []
+        if failures:
+            raise LoadError(self.table, failures)
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            self.executor.shutdown(wait=True)
+
+
+class LoadError(Exception):
+    """Files of a bulk load sink that failed to load, they are loaded again by the next sink."""
+    def __init__(self, table: str, failures: list[tuple[str, Exception]]):
+        super().__init__(f"{len(failures)} files failed to load into {table}: {failures[0][1]}")
+        self.table = table
+        self.failures = failures
+
+
+def get_job_id(table: str, path: str, attempt: int = 0) -> str:
+    job_id = "bulk_load_" + hashlib.sha256(f"{table}/{os.path.basename(path)}".encode()).hexdigest()[:40]
+    return job_id if attempt == 0 else f"{job_id}_{attempt}"
+
+
+def truncate_partial_line(path: str) -> None:
+    """Removes an incomplete last line, the row being written when a process stopped."""
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+
+
+def import_pyarrow() -> Any:
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("Parquet files need the pyarrow package, install the parquet extra") from e
+    return pyarrow
+
+
+def write_parquet(path: str, rows: list[dict[str, Any]]) -> None:
+    pyarrow = import_pyarrow()
+    pyarrow.parquet.write_table(pyarrow.Table.from_pylist(rows), path)
+
+
+def read_file(path: str) -> list[dict[str, Any]]:
+    if path.endswith(EXTENSIONS[FORMAT_PARQUET]):
+        return import_pyarrow().parquet.read_table(path).to_pylist()
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def get_bulk_load_sink(loader: Any, table: str, directory: str, **settings: Any) -> BulkLoadSink:
+    """Returns the process wide bulk load sink for a table, creating it on first use."""
+    return get_sink("load", table, lambda: BulkLoadSink(loader, table, directory, **settings))
@@ -12,14 +12,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import asyncio
-import re
-from typing import Callable, Any
+import fnmatch
+import inspect
+import time
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Any, Iterable
 
-from opentelemetry import trace
+from opentelemetry import metrics, trace
 
 
 from model.config import Config 
-VARIABLE_EXPANSION_PATTERN = r"\$\{(.+?)\}"
+from model.executor import get_command_executor
+from model.templates import compile_template
+from model.tokens import current_command
+DEFAULT_MAX_IN_FLIGHT = 16
+
+meter = metrics.get_meter(__name__)
+batch_completed_counter = meter.create_counter(
+    "batch.completed", description="Contexts completed by batch executions, by outcome.")
 
 class Context():
     """
@@ -33,6 +42,7 @@ class Context():
         self.state: dict[str, Any] = {}
         self.errors: list[Exception] = []
         self.config: Config = config
+        self.listeners: list[Callable[[str, dict[str, Any]], None]] = []
         
     def get_config(self) -> Config:
         return self.config
@@ -52,12 +62,52 @@ class Context():
     def has_key(self, key: str) -> bool:
         return key in self.state and self.state[key] is not None
     
+    def subscribe(self, listener: Callable[[str, dict[str, Any]], None]) -> None:
+        """Adds a listener for the events published while the context is being processed."""
+        self.listeners.append(listener)
+    
+    def publish(self, event: str, data: dict[str, Any]) -> None:
+        """Notifies the listeners of partial results, listeners may be called from any thread."""
+        for listener in self.listeners:
+            listener(event, data)
+    
     def expand_variables(self, input: str):
-        def replace_match(match):
-            key = match.group(1)
-            return self.get(key, "")
+        """
+        Expands ad-hoc text, missing variables become "". Prompts from the configuration
+        are precompiled and should be rendered with NamedPrompt.render instead.
+        """
+        return compile_template(input).render(self, strict=False)
 
-        return re.sub(VARIABLE_EXPANSION_PATTERN, replace_match, input)
+class BatchProgress():
+    """
+    Progress and throughput counters for a batch execution, updated as contexts
+    are submitted and completed. Safe to read while the batch is running.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.submitted = 0
+        self.succeeded = 0
+        self.failed = 0
+    
+    @property
+    def completed(self) -> int:
+        return self.succeeded + self.failed
+    
+    @property
+    def in_flight(self) -> int:
+        return self.submitted - self.completed
+    
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+    
+    def throughput(self) -> float:
+        """Completed contexts per second since the batch started."""
+        elapsed = self.elapsed()
+        return self.completed / elapsed if elapsed > 0 else 0.0
+    
+    def __str__(self) -> str:
+        return (f"submitted={self.submitted} succeeded={self.succeeded} failed={self.failed} "
+                f"in_flight={self.in_flight} throughput={self.throughput():.2f}/s")
 
 class Command():
     """
@@ -65,16 +115,111 @@ class Command():
     and hold little to no state of their own, and never persistent state, meaning
     the state of the command state IS NOT passivated or activated from serialization.
     Or simply put, the command state is renewed every time it's created.
+    
+    Blocking functions are run on the shared command executor so they never stall the
+    event loop, while coroutine functions are awaited natively.
+    
+    A command may declare the context keys it reads and writes (glob patterns such as
+    'language_*' are allowed), which a GraphChain uses to find the commands that can
+    run concurrently. A command that declares neither is treated as touching everything.
     """
-    def __init__(self, name: str, func: Callable[[Context], None]|None):
+    def __init__(self,
+                 name: str,
+                 func: Callable[[Context], None]|Callable[[Context], Awaitable[None]]|None,
+                 reads: list[str]|None = None,
+                 writes: list[str]|None = None):
         super().__init__()
         self.name = name
         self.func = func
+        self.reads = reads
+        self.writes = writes
+    
+    def is_declared(self) -> bool:
+        return self.reads is not None or self.writes is not None
+    
+    def depends_on(self, other: "Command") -> bool:
+        """
+        True if this command must run after the other when the other is declared first,
+        i.e. read-after-write, write-after-read or write-after-write on any key.
+        """
+        if not self.is_declared() or not other.is_declared():
+            return True
+        reads, writes = self.reads or [], self.writes or []
+        other_reads, other_writes = other.reads or [], other.writes or []
+        return (_keys_overlap(reads, other_writes)
+                or _keys_overlap(writes, other_reads)
+                or _keys_overlap(writes, other_writes))
     
     async def execute(self, context: Context):
         if self.func is not None:
             trace.get_current_span().set_attribute("command.context_size", len(context.state))
-            self.func(context)
+            executor = get_command_executor(context.get_config())
+            # attributes the model calls made by the function to this command
+            command_token = current_command.set(self.name)
+            try:
+                if inspect.iscoroutinefunction(self.func):
+                    started = time.perf_counter()
+                    try:
+                        await self.func(context)
+                    finally:
+                        executor.record(self.name, 0.0, time.perf_counter() - started)
+                else:
+                    await executor.run(self.name, self.func, context)
+            finally:
+                current_command.reset(command_token)
+    
+    async def execute_many(self,
+                           contexts: Iterable[Context]|AsyncIterable[Context],
+                           max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+                           progress: BatchProgress|None = None) -> AsyncIterator[Context]:
+        """
+        Executes this command over many contexts with at most max_in_flight running at once,
+        yielding each context as it completes (not in input order). Contexts are pulled from
+        the input lazily, so an unbounded iterator runs in bounded memory.
+        An exception raised for one context is added to its errors and does not stop the batch.
+        """
+        progress = progress if progress is not None else BatchProgress()
+        iterator = to_async_iterator(contexts)
+        running: set[asyncio.Task] = set()
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(running) < max_in_flight:
+                    try:
+                        context = await anext(iterator)
+                    except StopAsyncIteration:
+                        exhausted = True
+                        break
+                    running.add(asyncio.create_task(self.execute_isolated(context)))
+                    progress.submitted += 1
+                
+                if len(running) == 0:
+                    break
+                
+                finished, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    running.remove(task)
+                    context, failed = task.result()
+                    if failed:
+                        progress.failed += 1
+                    else:
+                        progress.succeeded += 1
+                    batch_completed_counter.add(1, {"command": self.name, "failed": failed})
+                    yield context
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+    
+    async def execute_isolated(self, context: Context) -> tuple[Context, bool]:
+        """Executes the command, recording any exception on the context instead of raising it."""
+        error_count = len(context.errors)
+        try:
+            await self.execute(context)
+        except Exception as e:
+            context.add_error(e)
+        return context, len(context.errors) > error_count
 
         
     
@@ -87,23 +232,121 @@ class Chain(Command):
     """
     def __init__(self, name: str, *args: Command):
         super().__init__(name=name, func=None)
-        self.commands: list[Command] = args
+        self.commands: list[Command] = list(args)
+        self.update_declarations()
     
     def get_commands(self) -> list[Command]:
         return self.commands
     
     def add_command(self, command: Command):
         self.commands.append(command)
+        self.update_declarations()
     
     def remove_command(self, command: Command):
         self.commands.remove(command)
+        self.update_declarations()
+    
+    def update_declarations(self) -> None:
+        """A chain reads and writes the union of its commands, when all of them are declared."""
+        if len(self.commands) > 0 and all(c.is_declared() for c in self.commands):
+            self.reads = [k for c in self.commands for k in (c.reads or [])]
+            self.writes = [k for c in self.commands for k in (c.writes or [])]
+        else:
+            self.reads = None
+            self.writes = None
 
     async def execute(self, context: Context):
         trace.get_current_span().add_event("chain_start: {name}", { "name": self.name })
         for command in self.commands:
             trace.get_current_span().add_event("command_start: {command}", { "command": command.name })
+            context.publish("command_start", { "command": command.name })
             await command.execute(context)
             trace.get_current_span().add_event("command_finish: {command}", { "command": command.name })
+            context.publish("command_finish", { "command": command.name })
         trace.get_current_span().add_event("chain_finish: {name}", { "name": self.name })
- 
-            
\ No newline at end of file
+
+
+class GraphChain(Chain):
+    """
+    A chain that builds a dependency graph from the keys each command reads and writes,
+    and runs every command whose dependencies are satisfied concurrently, up to max_concurrency.
+    Edges only ever point from an earlier declared command to a later one, so the declaration
+    order remains a valid serial order and the graph can never contain a cycle.
+    The latency of the chain becomes its critical path rather than the sum of all commands.
+    """
+    def __init__(self, name: str, *args: Command, max_concurrency: int|None = None):
+        super().__init__(name, *args)
+        self.max_concurrency = max_concurrency
+    
+    def get_dependencies(self) -> list[set[int]]:
+        """Returns, for each command index, the indexes of the commands it must wait for."""
+        dependencies = []
+        for i, command in enumerate(self.commands):
+            dependencies.append({j for j in range(i) if command.depends_on(self.commands[j])})
+        return dependencies
+    
+    async def execute(self, context: Context):
+        trace.get_current_span().add_event("chain_start: {name}", { "name": self.name })
+        dependencies = self.get_dependencies()
+        dependents: list[list[int]] = [[] for _ in self.commands]
+        for i, deps in enumerate(dependencies):
+            for j in deps:
+                dependents[j].append(i)
+        
+        limit = self.max_concurrency if self.max_concurrency else max(len(self.commands), 1)
+        ready = [i for i, deps in enumerate(dependencies) if len(deps) == 0]
+        running: dict[asyncio.Task, int] = {}
+        try:
+            while ready or running:
+                while ready and len(running) < limit:
+                    index = ready.pop(0)
+                    running[asyncio.create_task(self.execute_command(self.commands[index], context))] = index
+                
+                finished, _ = await asyncio.wait(running.keys(), return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    index = running.pop(task)
+                    task.result()
+                    for d in dependents[index]:
+                        dependencies[d].discard(index)
+                        if len(dependencies[d]) == 0:
+                            ready.append(d)
+                ready.sort()
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running.keys(), return_exceptions=True)
+        trace.get_current_span().add_event("chain_finish: {name}", { "name": self.name })
+    
+    async def execute_command(self, command: Command, context: Context):
+        trace.get_current_span().add_event("command_start: {command}", { "command": command.name })
+        context.publish("command_start", { "command": command.name })
+        await command.execute(context)
+        trace.get_current_span().add_event("command_finish: {command}", { "command": command.name })
+        context.publish("command_finish", { "command": command.name })
+
+
+def _keys_overlap(left: list[str], right: list[str]) -> bool:
+    for a in left:
+        for b in right:
+            if fnmatch.fnmatchcase(a, b) or fnmatch.fnmatchcase(b, a):
+                return True
+    return False
+
+
+async def run_batch(command: Command,
+                    contexts: Iterable[Context]|AsyncIterable[Context],
+                    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+                    progress: BatchProgress|None = None) -> list[Context]:
+    """Executes the command over all contexts and returns them in completion order."""
+    return [c async for c in command.execute_many(contexts, max_in_flight=max_in_flight, progress=progress)]
+
+
+async def to_async_iterator(items: Iterable[Context]|AsyncIterable[Context]) -> AsyncIterator[Context]:
+    """Iterates plain and async iterables of contexts alike."""
+    if isinstance(items, AsyncIterable):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
@@ -0,0 +1,218 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import functools
+import hashlib
+import importlib.util
+import logging
+import os
+import threading
+from typing import Any, Callable
+
+import httpx
+from google import genai
+from google.genai import types
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 20
+DEFAULT_KEEPALIVE_EXPIRY_SECONDS = 60.0
+
+
+class PoolSettings():
+    """
+    The HTTP connection pool of a client, read from the optional [application.http] table.
+    HTTP/2 needs the h2 package of httpx[http2], and is disabled with a warning without it.
+    """
+    def __init__(self,
+                 max_connections: int = DEFAULT_MAX_CONNECTIONS,
+                 max_keepalive_connections: int = DEFAULT_MAX_KEEPALIVE_CONNECTIONS,
+                 keepalive_expiry_seconds: float = DEFAULT_KEEPALIVE_EXPIRY_SECONDS,
+                 http2: bool = True,
+                 timeout_seconds: float|None = None,
+                 base_url: str|None = None):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry_seconds = keepalive_expiry_seconds
+        self.http2 = http2 and is_http2_available()
+        self.timeout_seconds = timeout_seconds
+        self.base_url = base_url
+
+    @staticmethod
+    def from_dict(d: dict[str, Any]|None) -> "PoolSettings":
+        return PoolSettings(**(d or {}))
+
+    def get_key(self) -> tuple:
+        return (self.max_connections, self.max_keepalive_connections, self.keepalive_expiry_seconds,
+                self.http2, self.timeout_seconds, self.base_url)
+
+    def get_http_options(self) -> types.HttpOptions:
+        limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry_seconds)
+        client_args = {"limits": limits, "http2": self.http2}
+        return types.HttpOptions(
+            base_url=self.base_url,
+            timeout=int(self.timeout_seconds * 1000) if self.timeout_seconds is not None else None,
+            client_args=client_args,
+            async_client_args=dict(client_args))
+
+
+@functools.cache
+def is_http2_available() -> bool:
+    """Whether the h2 package is installed, warning once when it is not."""
+    if importlib.util.find_spec("h2") is None:
+        logger.warning("HTTP/2 is disabled as the h2 package is not installed, install httpx[http2]")
+        return False
+    return True
+
+
+class SharedClient():
+    """
+    A handle to the registry's client for a credential and endpoint, used in place of a
+    genai.Client. Attribute access resolves the current client, so handles held by
+    generators pick up the client re-created after a fork.
+    """
+    def __init__(self, registry: "ClientRegistry", api_key: str, settings: PoolSettings):
+        self.registry = registry
+        self.api_key = api_key
+        self.settings = settings
+        self.key = registry.get_key(api_key, settings)
+
+    def get(self) -> genai.Client:
+        return self.registry.resolve(self)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.get(), name)
+
+
+class ClientRegistry():
+    """
+    Creates one genai.Client, and with it one HTTP connection pool, per credential and
+    endpoint, shared by every generator and the embedding model, along with one client
+    per Google Cloud service. Clients are created on first use, not when a handle is
+    taken, so importing a module or loading the configuration makes no network calls.
+    The registry is thread safe and forgets its clients in a forked child process.
+    """
+    def __init__(self):
+        self.clients: dict[tuple, genai.Client] = {}
+        self.cloud_clients: dict[str, Any] = {}
+        self.lock = threading.Lock()
+        self.created = 0
+        # clients inherited from the parent process, kept so they are never closed by the
+        # child, which would shut down connections still used by the parent
+        self.inherited: list[Any] = []
+        # the resources known to exist, e.g. tables and buckets, by kind and name
+        self.resources: set[tuple[str, str]] = set()
+        self.resource_locks: dict[tuple[str, str], threading.Lock] = {}
+
+    def get_key(self, api_key: str, settings: PoolSettings) -> tuple:
+        return (hashlib.sha256(api_key.encode()).hexdigest(),) + settings.get_key()
+
+    def get_client(self, api_key: str, settings: PoolSettings|None = None) -> SharedClient:
+        return SharedClient(self, api_key, settings if settings is not None else PoolSettings())
+
+    def resolve(self, client: SharedClient) -> genai.Client:
+        with self.lock:
+            resolved = self.clients.get(client.key)
+            if resolved is None:
+                resolved = genai.Client(api_key=client.api_key, http_options=client.settings.get_http_options())
+                self.clients[client.key] = resolved
+                self.created += 1
+                logger.debug("created genai client %d (http2=%s)", self.created, client.settings.http2)
+            return resolved
+
+    def get_cloud_client(self, service: str, factory: Callable[[], Any]) -> Any:
+        """Returns the client of a Google Cloud service, creating it with factory on first use."""
+        with self.lock:
+            client = self.cloud_clients.get(service)
+            if client is None:
+                client = factory()
+                self.cloud_clients[service] = client
+                logger.debug("created %s client", service)
+            return client
+
+    def ensure_exists(self, kind: str, name: str, create: Callable[[], Any]) -> None:
+        """
+        Calls create, which checks or creates a resource such as a table or a bucket, the
+        first time the resource is needed in this process. Concurrent callers wait for the
+        one call, and a failed call is tried again by the next caller.
+        """
+        key = (kind, name)
+        if key in self.resources:
+            return
+        with self.lock:
+            lock = self.resource_locks.setdefault(key, threading.Lock())
+        with lock:
+            if key in self.resources:
+                return
+            create()
+            self.resources.add(key)
+
+    def reset_after_fork(self) -> None:
+        self.lock = threading.Lock()
+        self.resource_locks = {}
+        self.inherited.extend(self.clients.values())
+        self.inherited.extend(self.cloud_clients.values())
+        self.clients = {}
+        self.cloud_clients = {}
+
+    def take_clients(self) -> list[Any]:
+        with self.lock:
+            clients = list(self.clients.values()) + list(self.cloud_clients.values())
+            self.clients = {}
+            self.cloud_clients = {}
+        return clients
+
+    def close(self) -> None:
+        """Closes every client, only the sync transport of the genai clients, see aclose."""
+        for client in self.take_clients():
+            client.close()
+
+    async def aclose(self) -> None:
+        """
+        Closes every client, awaiting the async transport of the genai clients first,
+        in the event loop its connections belong to.
+        """
+        for client in self.take_clients():
+            aclose = getattr(getattr(client, "aio", None), "aclose", None)
+            if aclose is not None:
+                await aclose()
+            client.close()
+
+
+_registry = ClientRegistry()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_registry.reset_after_fork)
+
+
+def get_client_registry() -> ClientRegistry:
+    return _registry
+
+
+def get_bigquery_client() -> Any:
+    """Returns the process wide bigquery.Client."""
+    def create():
+        from google.cloud import bigquery
+        return bigquery.Client()
+    return _registry.get_cloud_client("bigquery", create)
+
+
+def get_storage_client() -> Any:
+    """Returns the process wide storage.Client."""
+    def create():
+        from google.cloud import storage
+        return storage.Client()
+    return _registry.get_cloud_client("storage", create)
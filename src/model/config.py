@@ -12,18 +12,47 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
 import copy
+import functools
+import hashlib
+import json
+import os
+import threading
 import time
 import tomllib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Iterator, Mapping
 from model.api import TomlClass
+from model.clients import PoolSettings, SharedClient, get_client_registry
+from model.context_cache import ContextCacheManager
+from model.templates import PromptTemplate
+from model.tokens import CHARS_PER_TOKEN, TokenBudget, get_token_accounting
+from model.video import STATE_FAILED, STATE_PROCESSING, VideoFiles
+from model.vocabulary import DEFAULT_TEXT_VARIABLE_NAMES, CategoryVocabulary
 from PIL import Image
+from pydantic import BaseModel
 
-from google import genai
-from google.genai import types
+import numpy as np
+from google.genai import errors, types
 
+from utils.cache import LRUCache, TieredCache, create_tiered_cache
+from utils.dedup import (DEFAULT_BANDS, DEFAULT_MAX_IMAGE_DISTANCE, DEFAULT_MIN_SIMILARITY, DEFAULT_NUM_PERMUTATIONS,
+                         DEFAULT_SHINGLE_SIZE, NearDuplicateIndex)
 from utils.ezcrypt import decrypt
+from utils.rate_limit import AdaptiveRateLimiter, RetryPolicy
+from utils.single_flight import SingleFlight
 from utils.strings import get_env_file_name
 
+IMAGE_TOKENS = 258
+RETRYABLE_STATUS_CODES = (429, 503)
+QUOTA_EXHAUSTED_STATUS = "RESOURCE_EXHAUSTED"
+TOKEN_COUNT_CACHE_SIZE = 4096
+# the per request limit of batchEmbedContents
+DEFAULT_EMBEDDING_BATCH_SIZE = 100
+DEFAULT_EMBEDDING_CONCURRENCY = 4
+JSON_MIME_TYPE = "application/json"
+
 
 class Application(TomlClass):
     """
@@ -34,27 +63,149 @@ class Application(TomlClass):
     salt: str
     api_key: str
     thread_pool_size: int
+    http: dict[str, Any] = {}
 
 class Embedding(TomlClass):
     """
     Represents a class capable of generating text embeddings from a given model.
+    
+    embed_texts embeds many texts as a contiguous float32 matrix, one row per text. Texts
+    are sent in chunks of batch_size, up to max_concurrency chunks at once under the
+    optional [generative_ai.embedding.rate_limit] table, and vectors are cached by a hash
+    of the model, settings and text in the store configured by [generative_ai.embedding.cache].
     """
-    client: genai.Client
+    client: SharedClient
     model_name: str
+    batch_size: int = DEFAULT_EMBEDDING_BATCH_SIZE
+    max_concurrency: int = DEFAULT_EMBEDDING_CONCURRENCY
+    task_type: str|None = None
+    output_dimensionality: int|None = None
+    cache: dict[str, Any] = {}
+    vector_cache: TieredCache|None = None
+    rate_limit: dict[str, Any] = {}
+    rate_limiter: AdaptiveRateLimiter|None = None
+    retry_policy: RetryPolicy = RetryPolicy()
     
     def __init__(self, d = None):
         super().__init__(d)
         
-    def initialize_client(self, api_key: str) -> None:
-         self.client = genai.Client(api_key=api_key)
+    def initialize_client(self, api_key: str, settings: PoolSettings|None = None) -> None:
+         self.client = get_client_registry().get_client(api_key, settings)
+    
+    def initialize_cache(self) -> None:
+        if self.cache.get("enabled", False):
+            self.vector_cache = create_tiered_cache("embedding", self.cache)
+    
+    def initialize_rate_limiter(self) -> None:
+        if self.rate_limit.get("requests_per_minute"):
+            self.rate_limiter = AdaptiveRateLimiter(
+                "embedding",
+                requests_per_minute=self.rate_limit.get("requests_per_minute"),
+                tokens_per_minute=self.rate_limit.get("tokens_per_minute"))
+        self.retry_policy = RetryPolicy(
+            max_retries=self.rate_limit.get("max_retries", 5),
+            initial_backoff_seconds=self.rate_limit.get("initial_backoff_seconds", 1.0),
+            max_backoff_seconds=self.rate_limit.get("max_backoff_seconds", 60.0))
 
     def generate_text_embeddings(self, value: str):
         result = self.client.models.embed_content(
             model=self.model_name,
-            content=value
+            contents=value,
+            config=self.get_embed_config()
         )
         return result.embeddings
     
+    def get_embed_config(self) -> types.EmbedContentConfig:
+        return types.EmbedContentConfig(task_type=self.task_type, output_dimensionality=self.output_dimensionality)
+    
+    def get_cache_key(self, text: str) -> str:
+        digest = hashlib.sha256(f"{self.model_name}:{self.task_type}:{self.output_dimensionality}:".encode())
+        digest.update(text.encode())
+        return digest.hexdigest()
+    
+    def embed_texts(self, texts: list[str]) -> np.ndarray:
+        """Embeds the texts with a thread per concurrent chunk, see embed_texts_async."""
+        keys, vectors, chunks = self.lookup_vectors(texts)
+        if len(chunks) > 0:
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                for chunk, embedded in zip(chunks, executor.map(self.embed_chunk, chunks)):
+                    self.store_vectors(chunk, embedded, vectors)
+        return to_matrix(keys, vectors)
+    
+    async def embed_texts_async(self, texts: list[str]) -> np.ndarray:
+        """
+        Embeds the texts, returning a (len(texts), dimensions) float32 matrix in input order.
+        Only the distinct texts missing from the cache are sent to the model.
+        """
+        keys, vectors, chunks = await asyncio.to_thread(self.lookup_vectors, texts)
+        slots = asyncio.Semaphore(self.max_concurrency)
+        
+        async def embed(chunk: dict[str, str]) -> None:
+            async with slots:
+                embedded = await self.embed_chunk_async(chunk)
+            await asyncio.to_thread(self.store_vectors, chunk, embedded, vectors)
+        
+        await asyncio.gather(*[embed(chunk) for chunk in chunks])
+        return to_matrix(keys, vectors)
+    
+    def lookup_vectors(self, texts: list[str]) -> tuple[list[str], dict[str, np.ndarray], list[dict[str, str]]]:
+        """Returns the key of every text, the cached vectors and the missing texts by key in chunks."""
+        keys = [self.get_cache_key(text) for text in texts]
+        texts_by_key = dict(zip(keys, texts))
+        cached = self.vector_cache.get_many(list(texts_by_key)) if self.vector_cache is not None else {}
+        vectors = {key: np.frombuffer(value, dtype=np.float32) for key, value in cached.items()}
+        missing = {key: text for key, text in texts_by_key.items() if key not in vectors}
+        items = list(missing.items())
+        chunks = [dict(items[i:i + self.batch_size]) for i in range(0, len(items), self.batch_size)]
+        return keys, vectors, chunks
+    
+    def store_vectors(self, chunk: dict[str, str], embedded: list[np.ndarray], vectors: dict[str, np.ndarray]) -> None:
+        for key, vector in zip(chunk.keys(), embedded):
+            vectors[key] = vector
+            if self.vector_cache is not None:
+                self.vector_cache.put(key, vector.tobytes())
+    
+    def embed_chunk(self, chunk: dict[str, str]) -> list[np.ndarray]:
+        contents = list(chunk.values())
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(estimate_tokens(contents))
+            try:
+                result = self.client.models.embed_content(
+                    model=self.model_name, contents=contents, config=self.get_embed_config())
+            except errors.APIError as e:
+                if not self.should_retry(e, attempt):
+                    raise
+                time.sleep(self.retry_policy.backoff(attempt))
+                attempt += 1
+                continue
+            if self.rate_limiter is not None:
+                self.rate_limiter.on_success()
+            return [np.asarray(e.values, dtype=np.float32) for e in result.embeddings]
+    
+    async def embed_chunk_async(self, chunk: dict[str, str]) -> list[np.ndarray]:
+        contents = list(chunk.values())
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire_async(estimate_tokens(contents))
+            try:
+                result = await self.client.aio.models.embed_content(
+                    model=self.model_name, contents=contents, config=self.get_embed_config())
+            except errors.APIError as e:
+                if not self.should_retry(e, attempt):
+                    raise
+                await asyncio.sleep(self.retry_policy.backoff(attempt))
+                attempt += 1
+                continue
+            if self.rate_limiter is not None:
+                self.rate_limiter.on_success()
+            return [np.asarray(e.values, dtype=np.float32) for e in result.embeddings]
+    
+    def should_retry(self, error: errors.APIError, attempt: int) -> bool:
+        return should_retry(error, attempt, self.model_name, self.rate_limiter, self.retry_policy)
+    
 
 class ContentGenerator(TomlClass):
     """
@@ -62,8 +213,25 @@ class ContentGenerator(TomlClass):
     via the prompt. With the recent changes to the API, it's no longer beneficial
     (or possible) to create a running agent with instructions, but instead to add
     the instructions and settings per request.
+    
+    An optional [generative_ai.generators.<name>.cache] table enables a response cache
+    keyed on the model, generation config, prompt and image content (see utils.cache).
+    An optional [generative_ai.generators.<name>.rate_limit] table sets the request and
+    token budgets per minute, quota errors are retried with jittered exponential backoff.
+    With coalesce_requests, identical calls already in flight are awaited rather than repeated.
+    An optional [generative_ai.generators.<name>.context_cache] table uploads large prompt
+    prefixes as Gemini cached content and reuses them by name (see model.context_cache).
+    An optional [generative_ai.generators.<name>.video] table bounds the concurrent video
+    uploads and how long uploaded videos are reused (see model.video).
+    
+    The usage metadata of every response is recorded by command and model (see model.tokens).
+    With count_tokens_with_api the pre-call estimate uses count_tokens, cached by content,
+    rather than a local approximation.
+    
+    Passing a pydantic model as the response_schema constrains the response to the model's
+    JSON schema and returns an instance of the model instead of the response text.
     """
-    client: genai.Client
+    client: SharedClient
     model_name: str
     ground_with_google: bool
     instructions: str
@@ -72,22 +240,96 @@ class ContentGenerator(TomlClass):
     top_k: float
     max_output_tokens: int
     output_format: str
+    cache: dict[str, Any] = {}
+    response_cache: TieredCache|None = None
+    rate_limit: dict[str, Any] = {}
+    rate_limiter: AdaptiveRateLimiter|None = None
+    retry_policy: RetryPolicy = RetryPolicy()
+    coalesce_requests: bool = False
+    single_flight: SingleFlight|None = None
+    config_digest: str|None = None
+    context_cache: dict[str, Any] = {}
+    context_cache_manager: ContextCacheManager|None = None
+    video: dict[str, Any] = {}
+    video_files: VideoFiles|None = None
+    count_tokens_with_api: bool = False
+    token_counts: LRUCache|None = None
     
     def __init__(self, d = None):
         super().__init__(d)
+    
+    def updateValues(self, d = None):
+        super().updateValues(d)
+        self.config_digest = None
 
-    def initialize_client(self, api_key: str) -> None:
+    def initialize_client(self, api_key: str, settings: PoolSettings|None = None) -> None:
+        """Uses the registry's client for the key, sharing its connection pool with the other generators."""
         if (not hasattr(self, 'client') or self.client is None):
-            self.client = genai.Client(api_key=api_key)
+            self.client = get_client_registry().get_client(api_key, settings)
+    
+    def initialize_cache(self, name: str) -> None:
+        if self.cache.get("enabled", False):
+            self.response_cache = create_tiered_cache(f"generator.{name}", self.cache)
+        if self.coalesce_requests:
+            self.single_flight = SingleFlight(f"generator.{name}")
+        if self.context_cache.get("enabled", False):
+            self.context_cache_manager = ContextCacheManager(
+                f"generator.{name}",
+                ttl_seconds=self.context_cache.get("ttl_seconds", 3600),
+                refresh_before_seconds=self.context_cache.get("refresh_before_seconds", 300),
+                min_prefix_chars=self.context_cache.get("min_prefix_chars", 16384),
+                max_entries=self.context_cache.get("max_entries", 256))
+        self.video_files = VideoFiles(f"generator.{name}", **self.video)
+        self.token_counts = LRUCache(max_entries=TOKEN_COUNT_CACHE_SIZE)
+    
+    def initialize_rate_limiter(self, name: str) -> None:
+        if self.rate_limit.get("requests_per_minute"):
+            self.rate_limiter = AdaptiveRateLimiter(
+                f"generator.{name}",
+                requests_per_minute=self.rate_limit.get("requests_per_minute"),
+                tokens_per_minute=self.rate_limit.get("tokens_per_minute"))
+        self.retry_policy = RetryPolicy(
+            max_retries=self.rate_limit.get("max_retries", 5),
+            initial_backoff_seconds=self.rate_limit.get("initial_backoff_seconds", 1.0),
+            max_backoff_seconds=self.rate_limit.get("max_backoff_seconds", 60.0))
+    
+    def get_config_digest(self) -> str:
+        """A hash of the generation config, changing whenever a setting is updated."""
+        if self.config_digest is None:
+            self.config_digest = hashlib.sha256(
+                self.get_generative_config().model_dump_json(exclude_none=True).encode()).hexdigest()
+        return self.config_digest
+    
+    def get_cache_key(self, contents: list[Any], response_schema: type[BaseModel]|None = None) -> str:
+        """A stable key of the model name, generation config, response schema and a content hash of every part."""
+        digest = hashlib.sha256()
+        digest.update(self.model_name.encode())
+        digest.update(self.get_config_digest().encode())
+        if response_schema is not None:
+            digest.update(schema_digest(response_schema).encode())
+        for part in contents:
+            digest.update(content_digest(part))
+        return digest.hexdigest()
+    
+    def get_tools(self) -> list[types.Tool]:
+        return [types.Tool(google_search=types.GoogleSearchRetrieval)] if self.ground_with_google else []
 
-    def get_generative_config(self) -> types.GenerateContentConfig:
+    def get_generative_config(self,
+                              cached_content: str|None = None,
+                              response_schema: type[BaseModel]|None = None) -> types.GenerateContentConfig:
+        """
+        The per request generation config. With cached content, the system instructions
+        and tools are part of the cache and must not be sent again.
+        """
         return types.GenerateContentConfig(
-            system_instruction=self.instructions,
+            cached_content=cached_content,
+            system_instruction=self.instructions if cached_content is None else None,
             temperature=self.temperature,
             top_p=self.top_p,
             top_k=self.top_k,
             max_output_tokens=self.max_output_tokens,
-            response_mime_type=self.output_format,
+            response_mime_type=JSON_MIME_TYPE if response_schema is not None else self.output_format,
+            response_schema=response_schema,
             safety_settings=[
                 {
                     "category": types.HarmCategory.HARM_CATEGORY_HARASSMENT,
@@ -110,56 +352,521 @@ class ContentGenerator(TomlClass):
                     "threshold": types.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
                 },
             ],
-            tools = [types.Tool(google_search=types.GoogleSearchRetrieval)] if self.ground_with_google else []
+            tools = self.get_tools() if cached_content is None else None
         )
     
-    def generate_content(self, prompt: str) -> str:
+    def generate_content(self,
+                         prompt: str,
+                         prefix: str|None = None,
+                         response_schema: type[BaseModel]|None = None) -> str|BaseModel:
         """A simple method for generating responses from prompts"""
-        response =self.client.models.generate_content(
-            model=self.model_name,
-            config=self.get_generative_config(),
-            contents=[prompt])
-        return response.text
+        return parse_response(self.generate([prompt], prefix, response_schema), response_schema)
     
-    def understand_image(self, prompt: str, image: Image):
+    def understand_image(self,
+                         prompt: str,
+                         image: Image,
+                         prefix: str|None = None,
+                         response_schema: type[BaseModel]|None = None) -> str|BaseModel:
         """A simple method for generating responses from prompts and an image"""
-        response =self.client.models.generate_content(
-            model=self.model_name,
-            config=self.get_generative_config(),
-            contents=[prompt, image])
-        return response.text
+        return parse_response(self.generate([prompt, image], prefix, response_schema), response_schema)
     
-    def understand_video(self, prompt: str, video_path: str):
+    def generate(self,
+                 contents: list[Any],
+                 prefix: str|None = None,
+                 response_schema: type[BaseModel]|None = None) -> str:
         """
-        A simple method for generating responses from prompt and a video file.
-        Note: the video file should be uploaded and removed from the service.
+        Generates a response for the contents, through the response cache and
+        request coalescing when enabled. The prefix is the part of the prompt shared
+        across many requests, which is sent as cached content when context caching is enabled.
         """
-        video_file = self.client.files.upload(path=video_path)
-        while video_file.state.name == "PROCESSING":
-            print('.', end='')
-            time.sleep(1)
-            video_file = self.client.files.get(name=video_file.name)
-            
-        if video_file.state.name == "FAILED":
-            raise ValueError(video_file.state.name)
+        if self.response_cache is None and self.single_flight is None:
+            return self.call_model(contents, prefix, response_schema)
+        
+        key = self.get_cache_key(with_prefix(contents, prefix), response_schema)
+        if self.response_cache is not None:
+            cached = self.response_cache.get(key)
+            if cached is not None:
+                return cached.decode()
+        
+        def call() -> str:
+            text = self.call_model(contents, prefix, response_schema)
+            self.cache_response(key, text, response_schema)
+            return text
+        
+        if self.single_flight is None:
+            return call()
+        return self.single_flight.do(key, call)
+    
+    def cache_response(self, key: str, text: str|None, response_schema: type[BaseModel]|None) -> None:
+        """
+        Caches a response only if it parses into the response model, so a truncated or
+        invalid response is not replayed for the lifetime of the cache.
+        """
+        if text is None or self.response_cache is None or not is_valid_response(text, response_schema):
+            return
+        self.response_cache.put(key, text.encode())
+    
+    async def cache_response_async(self, key: str, text: str|None, response_schema: type[BaseModel]|None) -> None:
+        """The non-blocking form of cache_response."""
+        if text is None or self.response_cache is None or not is_valid_response(text, response_schema):
+            return
+        await self.response_cache.put_async(key, text.encode())
+    
+    def call_model(self,
+                   contents: list[Any],
+                   prefix: str|None = None,
+                   response_schema: type[BaseModel]|None = None) -> str:
+        cached_content = None
+        if self.context_cache_manager is not None:
+            cached_content = self.context_cache_manager.get(self, prefix)
+        if cached_content is None:
+            contents = with_prefix(contents, prefix)
+        
+        estimated_tokens = self.estimate_input_tokens(contents)
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(estimated_tokens)
+            try:
+                response =self.client.models.generate_content(
+                    model=self.model_name,
+                    config=self.get_generative_config(cached_content, response_schema),
+                    contents=contents)
+            except errors.APIError as e:
+                if not self.should_retry(e, attempt):
+                    raise
+                time.sleep(self.retry_policy.backoff(attempt))
+                attempt += 1
+                continue
+            if self.rate_limiter is not None:
+                self.rate_limiter.on_success()
+            self.record_usage(response, estimated_tokens)
+            return response.text
+    
+    def record_usage(self, response: types.GenerateContentResponse, estimated_tokens: int|None = None) -> None:
+        truncated = bool(response.candidates) and response.candidates[0].finish_reason == types.FinishReason.MAX_TOKENS
+        get_token_accounting().record(self.model_name, response.usage_metadata, estimated_tokens, truncated)
+    
+    def estimate_input_tokens(self, contents: list[Any]) -> int:
+        """The pre-call estimate of the prompt tokens, used for the token budget of the rate limiter."""
+        if self.count_tokens_with_api:
+            return self.count_tokens(contents)
+        return estimate_tokens(contents)
+    
+    async def estimate_input_tokens_async(self, contents: list[Any]) -> int:
+        if self.count_tokens_with_api:
+            return await self.count_tokens_async(contents)
+        return estimate_tokens(contents)
+    
+    def count_tokens(self, contents: list[Any]) -> int:
+        """Counts the tokens of the contents with the service, cached by model and content."""
+        key = self.get_token_count_key(contents)
+        cached = self.token_counts.get(key)
+        if cached is not None:
+            return int(cached)
+        count = self.client.models.count_tokens(model=self.model_name, contents=contents).total_tokens
+        self.token_counts.put(key, str(count).encode())
+        return count
+    
+    async def count_tokens_async(self, contents: list[Any]) -> int:
+        key = self.get_token_count_key(contents)
+        cached = self.token_counts.get(key)
+        if cached is not None:
+            return int(cached)
+        response = await self.client.aio.models.count_tokens(model=self.model_name, contents=contents)
+        self.token_counts.put(key, str(response.total_tokens).encode())
+        return response.total_tokens
+    
+    def get_token_count_key(self, contents: list[Any]) -> str:
+        digest = hashlib.sha256(self.model_name.encode())
+        for part in contents:
+            digest.update(content_digest(part))
+        return digest.hexdigest()
+    
+    def should_retry(self, error: errors.APIError, attempt: int) -> bool:
+        return should_retry(error, attempt, self.model_name, self.rate_limiter, self.retry_policy)
+    
+    async def generate_content_async(self,
+                                     prompt: str,
+                                     prefix: str|None = None,
+                                     response_schema: type[BaseModel]|None = None) -> str|BaseModel:
+        """The non-blocking form of generate_content using the SDK's aio client."""
+        return parse_response(await self.generate_async([prompt], prefix, response_schema), response_schema)
+    
+    async def understand_image_async(self,
+                                     prompt: str,
+                                     image: Image,
+                                     prefix: str|None = None,
+                                     response_schema: type[BaseModel]|None = None) -> str|BaseModel:
+        """The non-blocking form of understand_image using the SDK's aio client."""
+        return parse_response(await self.generate_async([prompt, image], prefix, response_schema), response_schema)
+    
+    async def generate_async(self,
+                             contents: list[Any],
+                             prefix: str|None = None,
+                             response_schema: type[BaseModel]|None = None) -> str:
+        """The non-blocking form of generate, sharing the same response cache and in-flight calls."""
+        if self.response_cache is None and self.single_flight is None:
+            return await self.call_model_async(contents, prefix, response_schema)
+        
+        key = self.get_cache_key(with_prefix(contents, prefix), response_schema)
+        if self.response_cache is not None:
+            cached = await self.response_cache.get_async(key)
+            if cached is not None:
+                return cached.decode()
+        
+        async def call() -> str:
+            text = await self.call_model_async(contents, prefix, response_schema)
+            await self.cache_response_async(key, text, response_schema)
+            return text
+        
+        if self.single_flight is None:
+            return await call()
+        return await self.single_flight.do_async(key, call)
+    
+    async def call_model_async(self,
+                               contents: list[Any],
+                               prefix: str|None = None,
+                               response_schema: type[BaseModel]|None = None) -> str:
+        cached_content = None
+        if self.context_cache_manager is not None:
+            cached_content = await self.context_cache_manager.get_async(self, prefix)
+        if cached_content is None:
+            contents = with_prefix(contents, prefix)
+        
+        estimated_tokens = await self.estimate_input_tokens_async(contents)
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire_async(estimated_tokens)
+            try:
+                response = await self.client.aio.models.generate_content(
+                    model=self.model_name,
+                    config=self.get_generative_config(cached_content, response_schema),
+                    contents=contents)
+            except errors.APIError as e:
+                if not self.should_retry(e, attempt):
+                    raise
+                await asyncio.sleep(self.retry_policy.backoff(attempt))
+                attempt += 1
+                continue
+            if self.rate_limiter is not None:
+                self.rate_limiter.on_success()
+            self.record_usage(response, estimated_tokens)
+            return response.text
+    
+    def generate_content_stream(self,
+                                prompt: str,
+                                prefix: str|None = None,
+                                response_schema: type[BaseModel]|None = None) -> Iterator[str]:
+        """
+        Yields the response text as it is generated, so the first tokens reach the caller
+        without waiting for the whole response. Served from the response cache when enabled.
+        """
+        contents = [prompt]
+        key = self.get_cache_key(with_prefix(contents, prefix), response_schema) if self.response_cache is not None else None
+        if key is not None:
+            cached = self.response_cache.get(key)
+            if cached is not None:
+                yield cached.decode()
+                return
+        
+        cached_content = None
+        if self.context_cache_manager is not None:
+            cached_content = self.context_cache_manager.get(self, prefix)
+        if cached_content is None:
+            contents = with_prefix(contents, prefix)
+        estimated_tokens = self.estimate_input_tokens(contents)
+        stream, chunk = self.open_stream(contents, cached_content, response_schema, estimated_tokens)
+        
+        chunks = []
+        last = None
+        while chunk is not None:
+            last = chunk
+            if chunk.text:
+                chunks.append(chunk.text)
+                yield chunk.text
+            chunk = next(stream, None)
+        if self.rate_limiter is not None:
+            self.rate_limiter.on_success()
+        if last is not None:
+            # the usage metadata of a stream is complete on its last chunk
+            self.record_usage(last, estimated_tokens)
+        if key is not None:
+            self.cache_response(key, "".join(chunks), response_schema)
+    
+    def open_stream(self,
+                    contents: list[Any],
+                    cached_content: str|None,
+                    response_schema: type[BaseModel]|None,
+                    estimated_tokens: int) -> tuple[Iterator[types.GenerateContentResponse], types.GenerateContentResponse|None]:
+        """
+        Starts a stream and reads its first chunk through the rate limiter, retrying like
+        call_model. Once the first chunk is yielded to the caller, a failure is raised.
+        """
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(estimated_tokens)
+            try:
+                stream = iter(self.client.models.generate_content_stream(
+                    model=self.model_name,
+                    config=self.get_generative_config(cached_content, response_schema),
+                    contents=contents))
+                return stream, next(stream, None)
+            except errors.APIError as e:
+                if not self.should_retry(e, attempt):
+                    raise
+                time.sleep(self.retry_policy.backoff(attempt))
+                attempt += 1
+    
+    async def generate_content_stream_async(self,
+                                            prompt: str,
+                                            prefix: str|None = None,
+                                            response_schema: type[BaseModel]|None = None) -> AsyncIterator[str]:
+        """The non-blocking form of generate_content_stream using the SDK's aio client."""
+        contents = [prompt]
+        key = self.get_cache_key(with_prefix(contents, prefix), response_schema) if self.response_cache is not None else None
+        if key is not None:
+            cached = await self.response_cache.get_async(key)
+            if cached is not None:
+                yield cached.decode()
+                return
+        
+        cached_content = None
+        if self.context_cache_manager is not None:
+            cached_content = await self.context_cache_manager.get_async(self, prefix)
+        if cached_content is None:
+            contents = with_prefix(contents, prefix)
+        estimated_tokens = await self.estimate_input_tokens_async(contents)
+        stream, chunk = await self.open_stream_async(contents, cached_content, response_schema, estimated_tokens)
         
-        response = self.client.models.generate_content(
-            model=self.model,
-            config=self.get_generative_config(),
-            contents=[
-                video_file,
-                prompt
-            ])
-        return response.text
+        chunks = []
+        last = None
+        while chunk is not None:
+            last = chunk
+            if chunk.text:
+                chunks.append(chunk.text)
+                yield chunk.text
+            chunk = await anext(stream, None)
+        if self.rate_limiter is not None:
+            self.rate_limiter.on_success()
+        if last is not None:
+            # the usage metadata of a stream is complete on its last chunk
+            self.record_usage(last, estimated_tokens)
+        if key is not None:
+            await self.cache_response_async(key, "".join(chunks), response_schema)
+    
+    async def open_stream_async(self,
+                                contents: list[Any],
+                                cached_content: str|None,
+                                response_schema: type[BaseModel]|None,
+                                estimated_tokens: int) -> tuple[AsyncIterator[types.GenerateContentResponse], types.GenerateContentResponse|None]:
+        """The non-blocking form of open_stream."""
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire_async(estimated_tokens)
+            try:
+                stream = await self.client.aio.models.generate_content_stream(
+                    model=self.model_name,
+                    config=self.get_generative_config(cached_content, response_schema),
+                    contents=contents)
+                return stream, await anext(stream, None)
+            except errors.APIError as e:
+                if not self.should_retry(e, attempt):
+                    raise
+                await asyncio.sleep(self.retry_policy.backoff(attempt))
+                attempt += 1
+    
+    def understand_video(self, prompt: str, video_path: str) -> str:
+        """
+        A simple method for generating responses from prompt and a video file, blocking
+        the calling thread while the video is processed. The uploaded file is removed afterwards.
+        Prefer understand_video_async, which reuses uploads and does not hold a thread.
+        """
+        video_file = self.client.files.upload(file=video_path)
+        try:
+            interval = 1.0
+            while video_file.state.name == STATE_PROCESSING:
+                time.sleep(interval)
+                interval = min(interval * 2, 30.0)
+                video_file = self.client.files.get(name=video_file.name)
+                
+            if video_file.state.name == STATE_FAILED:
+                raise ValueError(video_file.state.name)
+            
+            return self.call_model([video_file, prompt])
+        finally:
+            self.client.files.delete(name=video_file.name)
+    
+    async def understand_video_async(self,
+                                     prompt: str,
+                                     video_path: str,
+                                     response_schema: type[BaseModel]|None = None) -> str|BaseModel:
+        """
+        The non-blocking form of understand_video. The video is uploaded once per content
+        hash and shared by concurrent calls, at most max_concurrent_videos are in progress.
+        """
+        async with self.video_files.use(self.client, video_path) as video_file:
+            text = await self.generate_async([video_file, prompt], response_schema=response_schema)
+        return parse_response(text, response_schema)
         
 
 class NamedPrompt(TomlClass):
     """
     A class for holding prompts by name in the configuration files.
+    The prompt is compiled into a template once the configuration is loaded.
+    An optional budget, e.g. { max_tokens = 8000, trim = ["category_attributes"] },
+    trims the listed variables when the rendered prompt is over max_tokens.
+    An optional prefix holds the leading part of the prompt that is shared by many
+    requests (e.g. a category schema), which generators may send as cached content.
+    The cached content is keyed on the rendered prefix, so one is created per category.
     """
     name: str
     prompt: str
+    prefix: str|None = None
+    budget: dict[str, Any] = {}
+    template: PromptTemplate
+    prefix_template: PromptTemplate|None = None
+    token_budget: TokenBudget|None = None
     
+    def compile(self) -> None:
+        self.template = PromptTemplate(self.prompt, self.name)
+        if self.prefix is not None:
+            self.prefix_template = PromptTemplate(self.prefix, f"{self.name}.prefix")
+        if self.budget:
+            self.token_budget = TokenBudget(**self.budget)
+    
+    def render(self, values: Any, defaults: Mapping[str, Any]|None = None) -> str:
+        """Renders the prompt, raising MissingVariablesError if any variable has no value."""
+        return self.render_template(self.template, values, defaults)
+    
+    def render_prefix(self, values: Any, defaults: Mapping[str, Any]|None = None) -> str|None:
+        """Renders the shared prefix, or None when the prompt has no prefix."""
+        if self.prefix_template is None:
+            return None
+        return self.render_template(self.prefix_template, values, defaults)
+    
+    def render_template(self, template: PromptTemplate, values: Any, defaults: Mapping[str, Any]|None) -> str:
+        """Renders within the token budget, which applies to the prefix and the prompt each."""
+        if self.token_budget is not None:
+            return self.token_budget.render(template, values, defaults)
+        return template.render(values, defaults)
+    
+class ImageProcessing(TomlClass):
+    """
+    The pre-processing of product images before they are sent to a model, from the
+    optional [images] table (see commands.image_processing). Encoded images are cached
+    by source hash in the tiered cache configured by [images.cache]. Images copied into
+    buckets are transferred as configured by [images.ingestion] (see model.ingestion).
+    """
+    max_edge: int = 1536
+    format: str = "JPEG"
+    quality: int = 85
+    process_pool_size: int = 2
+    cache: dict[str, Any] = {}
+    ingestion: dict[str, Any] = {}
+    encoded_cache: TieredCache|None = None
+    single_flight: SingleFlight|None = None
+    
+    def __init__(self, d = None):
+        super().__init__(d)
+    
+    def initialize_cache(self) -> None:
+        self.encoded_cache = create_tiered_cache("images", self.cache)
+        self.single_flight = SingleFlight("images")
+
+
+class Vocabulary(TomlClass):
+    """
+    The known categories matched locally before category detection, from the optional
+    [vocabulary] table (see commands.vocabulary). The categories and their embeddings
+    are loaded from path, a file written by CategoryVocabulary.save, on first use.
+    """
+    path: str|None = None
+    min_score: float = 0.92
+    text_variable_names: list[str] = list(DEFAULT_TEXT_VARIABLE_NAMES)
+    categories: CategoryVocabulary|None = None
+
+    def __init__(self, d = None):
+        super().__init__(d)
+        self.lock = threading.Lock()
+
+    def get_categories(self) -> CategoryVocabulary:
+        """The categories, loaded from path the first time, empty without a file."""
+        if self.categories is None:
+            with self.lock:
+                if self.categories is None:
+                    if self.path is not None and os.path.exists(self.path):
+                        self.categories = CategoryVocabulary.load(self.path)
+                    else:
+                        self.categories = CategoryVocabulary()
+        return self.categories
+
+    async def get_categories_async(self) -> CategoryVocabulary:
+        """The non-blocking form of get_categories, loading the file in a thread."""
+        if self.categories is not None:
+            return self.categories
+        return await asyncio.to_thread(self.get_categories)
+
+
+class Deduplication(TomlClass):
+    """
+    The clustering of near-duplicate products in a batch before enrichment, from the
+    optional [dedup] table (see commands.dedup and utils.dedup). Only one product per
+    cluster is enriched and its results are copied to the others. The worker clusters
+    the rows of a table batch_size at a time.
+    """
+    enabled: bool = True
+    batch_size: int = 1000
+    num_permutations: int = DEFAULT_NUM_PERMUTATIONS
+    bands: int = DEFAULT_BANDS
+    shingle_size: int = DEFAULT_SHINGLE_SIZE
+    min_similarity: float = DEFAULT_MIN_SIMILARITY
+    max_image_distance: int = DEFAULT_MAX_IMAGE_DISTANCE
+    text_variable_names: list[str] = ["product_name", "product_description"]
+    image_variable_name: str|None = "product_image"
+    variant_variable_name: str = "variant_attributes"
+
+    def __init__(self, d = None):
+        super().__init__(d)
+
+    def create_index(self) -> NearDuplicateIndex:
+        return NearDuplicateIndex(num_permutations=self.num_permutations,
+                                  bands=self.bands,
+                                  shingle_size=self.shingle_size,
+                                  min_similarity=self.min_similarity,
+                                  max_image_distance=self.max_image_distance)
+
+
+class BigQuery(TomlClass):
+    """
+    The catalog tables, from the optional [bigquery] table. The origin_table is read with
+    the Storage Read API (see model.sources), only the selected_fields and the rows
+    matching row_restriction, and the read position is saved to checkpoint_path.
+    """
+    dataset_name: str = ""
+    origin_table: str = ""
+    output_table: str = ""
+    selected_fields: list[str] = []
+    row_restriction: str|None = None
+    max_streams: int = 4
+    max_queued_batches: int = 8
+    checkpoint_path: str|None = None
+
+    def __init__(self, d = None):
+        super().__init__(d)
+
+    def get_table(self, table_name: str, project_id: str|None = None) -> str:
+        """The project.dataset.table name of a table, table names already qualified are kept."""
+        if table_name.count(".") == 2:
+            return table_name
+        if table_name.count(".") == 1:
+            return f"{project_id}.{table_name}"
+        return f"{project_id}.{self.dataset_name}.{table_name}"
+
+
 class GenerativeAI(TomlClass):
     """
     A wrapper class for Generative structures.
@@ -175,6 +882,10 @@ class Config():
     application: Application
     generative_ai: GenerativeAI
     prompts: list[NamedPrompt]
+    images: ImageProcessing
+    vocabulary: Vocabulary
+    dedup: Deduplication
+    bigquery: BigQuery
     
     def __init__(self, file_name):
         env_file_name = get_env_file_name(file_name)
@@ -184,6 +895,10 @@ class Config():
             data = tomllib.load(f)
             
             setattr(self, "application", Application(data.get("application")))
+            setattr(self, "images", ImageProcessing(data.get("images")))
+            setattr(self, "vocabulary", Vocabulary(data.get("vocabulary")))
+            setattr(self, "dedup", Deduplication(data.get("dedup")))
+            setattr(self, "bigquery", BigQuery(data.get("bigquery")))
             
             prompts = []
             for p in data.get("prompts"):
@@ -208,6 +923,10 @@ class Config():
                 data = tomllib.load(f)
                 
                 self.application.updateValues(data.get("application"))
+                self.images.updateValues(data.get("images"))
+                self.vocabulary.updateValues(data.get("vocabulary"))
+                self.dedup.updateValues(data.get("dedup"))
+                self.bigquery.updateValues(data.get("bigquery"))
                 
                 if data.get("prompts") is not None:
                     existing_prompts = copy.deepcopy(self.prompts)
@@ -227,24 +946,113 @@ class Config():
                         self.generative_ai.embedding.updateValues(data.get("generative_ai")["embedding"])
                         
                     if data.get("generative_ai")["generators"] is not None:
-                        for k, g in self.generative_ai.generators:
+                        for k, g in self.generative_ai.generators.items():
                             if k in data.get("generative_ai")["generators"]:
                                 g.updateValues(data.get("generative_ai")["generators"][k])
                                 
+        for p in self.prompts:
+            p.compile()
+        
+        # the caches open their files and the vocabulary is loaded on first use
+        self.images.initialize_cache()
+                                
+        api_key = decrypt(self.application.api_key, self.application.salt)
+        pool_settings = PoolSettings.from_dict(self.application.http)
         if self.generative_ai.embedding is not None:
-            self.generative_ai.embedding.initialize_client(decrypt(self.application.api_key, self.application.salt))
+            self.generative_ai.embedding.initialize_client(api_key, pool_settings)
+            self.generative_ai.embedding.initialize_cache()
+            self.generative_ai.embedding.initialize_rate_limiter()
             
         for k, g in self.generative_ai.generators.items():
-            g.initialize_client(decrypt(self.application.api_key, self.application.salt))
+            g.initialize_client(api_key, pool_settings)
+            g.initialize_cache(k)
+            g.initialize_rate_limiter(k)
             
     def get_prompt_by_name(self, name: str) -> NamedPrompt:
         for p in self.prompts:
             if p.name == name:
                 return p
-        return None()
+        return None
     
     def get_generator_by_name(self, name: str) -> ContentGenerator:
         return self.generative_ai.generators[name]
     
     def get_embedding(self) -> Embedding:
-        return self.generative_ai.embedding
\ No newline at end of file
+        return self.generative_ai.embedding
+
+
+def should_retry(error: errors.APIError,
+                 attempt: int,
+                 name: str,
+                 rate_limiter: AdaptiveRateLimiter|None,
+                 retry_policy: RetryPolicy) -> bool:
+    """Adapts the rate limiter to quota errors and decides if the call may be retried."""
+    quota_error = error.code == 429 or error.status == QUOTA_EXHAUSTED_STATUS
+    if quota_error and rate_limiter is not None:
+        rate_limiter.on_quota_error()
+    if not (quota_error or error.code in RETRYABLE_STATUS_CODES) or attempt >= retry_policy.max_retries:
+        return False
+    retry_policy.record_retry(name, QUOTA_EXHAUSTED_STATUS if quota_error else str(error.code))
+    return True
+
+
+def with_prefix(contents: list[Any], prefix: str|None) -> list[Any]:
+    """The contents sent inline, led by the prefix when it is not sent as cached content."""
+    return [prefix] + contents if prefix else contents
+
+
+def estimate_tokens(contents: list[Any]) -> int:
+    """A local approximation of the input tokens of the contents, used for token budgets."""
+    tokens = 0
+    for part in contents:
+        if isinstance(part, str):
+            tokens += len(part) // CHARS_PER_TOKEN + 1
+        else:
+            tokens += IMAGE_TOKENS
+    return tokens
+
+
+def content_digest(part: Any) -> bytes:
+    """A content hash of a prompt part, hashing image pixels or inline bytes rather than object identity."""
+    if isinstance(part, str):
+        data = part.encode()
+    elif isinstance(part, bytes):
+        data = part
+    elif isinstance(part, Image.Image):
+        data = f"{part.mode}:{part.size}".encode() + part.tobytes()
+    elif isinstance(part, types.Part) and part.inline_data is not None:
+        data = (part.inline_data.mime_type or "").encode() + part.inline_data.data
+    elif isinstance(part, types.File):
+        data = (part.sha256_hash or part.name or "").encode()
+    else:
+        data = repr(part).encode()
+    return hashlib.sha256(data).digest()
+
+
+@functools.lru_cache(maxsize=None)
+def schema_digest(response_schema: type[BaseModel]) -> str:
+    """A hash of the JSON schema of a response model, so a changed model is never served a stale response."""
+    schema = json.dumps(response_schema.model_json_schema(), sort_keys=True)
+    return hashlib.sha256(schema.encode()).hexdigest()
+
+
+def parse_response(text: str, response_schema: type[BaseModel]|None) -> str|BaseModel:
+    """Validates the response text into the response model, or returns the text without one."""
+    if response_schema is None:
+        return text
+    return response_schema.model_validate_json(text)
+
+
+def is_valid_response(text: str, response_schema: type[BaseModel]|None) -> bool:
+    try:
+        parse_response(text, response_schema)
+    except ValueError:
+        return False
+    return True
+
+
+def to_matrix(keys: list[str], vectors: dict[str, np.ndarray]) -> np.ndarray:
+    """Stacks the vector of every key into a contiguous float32 matrix, one row per key."""
+    if len(keys) == 0:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.ascontiguousarray(np.stack([vectors[key] for key in keys]), dtype=np.float32)
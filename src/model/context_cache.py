@@ -0,0 +1,220 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+from google.genai import errors, types
+from opentelemetry import metrics
+
+from utils.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = 3600
+DEFAULT_REFRESH_BEFORE_SECONDS = 300
+# Gemini only caches prefixes of at least 1,024 - 4,096 tokens depending on the model
+DEFAULT_MIN_PREFIX_CHARS = 4096 * 4
+DEFAULT_MAX_ENTRIES = 256
+
+meter = metrics.get_meter(__name__)
+context_cache_counter = meter.create_counter(
+    "context_cache.requests", description="Cached content lookups by result (reused, created, refreshed, failed, evicted).")
+
+
+class CachedPrefix():
+    """A cached content handle on the service and when it expires, no name if it could not be created."""
+    def __init__(self, name: str|None, config_digest: str, expires: float):
+        self.name = name
+        self.config_digest = config_digest
+        self.expires = expires
+
+
+class ContextCacheManager():
+    """
+    Uploads large, repeated prompt prefixes (the system instructions plus e.g. a category
+    schema) once as Gemini cached content and hands out the cache name for every request
+    sharing the prefix. Handles are extended before they expire and deleted when the
+    generation config of the generator changes. Concurrent requests for a new prefix
+    share a single create call. At most max_entries handles are kept, the least recently
+    used handle is deleted to make room for a new one. A prefix the service refuses to
+    cache, e.g. one below the model's minimum size, is sent inline until the TTL passed.
+    """
+    def __init__(self,
+                 name: str,
+                 ttl_seconds: int = DEFAULT_TTL_SECONDS,
+                 refresh_before_seconds: int = DEFAULT_REFRESH_BEFORE_SECONDS,
+                 min_prefix_chars: int = DEFAULT_MIN_PREFIX_CHARS,
+                 max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.refresh_before_seconds = refresh_before_seconds
+        self.min_prefix_chars = min_prefix_chars
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, CachedPrefix] = OrderedDict()
+        self.config_digest: str|None = None
+        self.lock = threading.Lock()
+        self.flight = SingleFlight(f"context_cache.{name}")
+
+    def is_cacheable(self, prefix: str|None) -> bool:
+        return prefix is not None and len(prefix) >= self.min_prefix_chars
+
+    def get_key(self, generator: Any, prefix: str) -> str:
+        digest = hashlib.sha256()
+        digest.update(generator.model_name.encode())
+        digest.update(generator.get_config_digest().encode())
+        digest.update(prefix.encode())
+        return digest.hexdigest()
+
+    def lookup(self, key: str) -> tuple[CachedPrefix|None, bool]:
+        """Returns the current entry and True if the entry can be used as is."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+        usable = entry is not None and entry.expires - time.time() > self.refresh_before_seconds
+        if usable:
+            context_cache_counter.add(1, {"cache": self.name, "result": "reused"})
+        return entry, usable
+
+    def get(self, generator: Any, prefix: str|None) -> str|None:
+        """Returns the cached content name for the prefix, or None when it is sent inline."""
+        if not self.is_cacheable(prefix):
+            return None
+        for stale in self.take_stale_entries(generator.get_config_digest()):
+            self.delete_remote(generator, stale)
+        key = self.get_key(generator, prefix)
+        entry, usable = self.lookup(key)
+        if usable:
+            return entry.name
+        return self.flight.do(key, lambda: self.refresh_or_create(generator, key, prefix, entry))
+
+    async def get_async(self, generator: Any, prefix: str|None) -> str|None:
+        if not self.is_cacheable(prefix):
+            return None
+        for stale in self.take_stale_entries(generator.get_config_digest()):
+            await self.delete_remote_async(generator, stale)
+        key = self.get_key(generator, prefix)
+        entry, usable = self.lookup(key)
+        if usable:
+            return entry.name
+        return await self.flight.do_async(key, lambda: self.refresh_or_create_async(generator, key, prefix, entry))
+
+    def refresh_or_create(self, generator: Any, key: str, prefix: str, entry: CachedPrefix|None) -> str|None:
+        if entry is not None and entry.name is not None and entry.expires > time.time():
+            try:
+                generator.client.caches.update(name=entry.name, config=self.get_update_config())
+                return self.store(key, entry.name, generator, "refreshed")
+            except errors.APIError as e:
+                logger.warning("failed to refresh cached content %s, recreating: %s", entry.name, e)
+        try:
+            cached = generator.client.caches.create(model=generator.model_name, config=self.get_create_config(generator, key, prefix))
+        except errors.APIError as e:
+            logger.warning("failed to create cached content, sending the prefix inline: %s", e)
+            return self.store(key, None, generator, "failed")
+        name = self.store(key, cached.name, generator, "created")
+        for evicted in self.take_evicted_entries():
+            self.delete_remote(generator, evicted)
+        return name
+
+    async def refresh_or_create_async(self, generator: Any, key: str, prefix: str, entry: CachedPrefix|None) -> str|None:
+        if entry is not None and entry.name is not None and entry.expires > time.time():
+            try:
+                await generator.client.aio.caches.update(name=entry.name, config=self.get_update_config())
+                return self.store(key, entry.name, generator, "refreshed")
+            except errors.APIError as e:
+                logger.warning("failed to refresh cached content %s, recreating: %s", entry.name, e)
+        try:
+            cached = await generator.client.aio.caches.create(model=generator.model_name, config=self.get_create_config(generator, key, prefix))
+        except errors.APIError as e:
+            logger.warning("failed to create cached content, sending the prefix inline: %s", e)
+            return self.store(key, None, generator, "failed")
+        name = self.store(key, cached.name, generator, "created")
+        for evicted in self.take_evicted_entries():
+            await self.delete_remote_async(generator, evicted)
+        return name
+
+    def get_create_config(self, generator: Any, key: str, prefix: str) -> types.CreateCachedContentConfig:
+        return types.CreateCachedContentConfig(
+            display_name=f"{self.name}-{key[:16]}",
+            system_instruction=generator.instructions,
+            tools=generator.get_tools() or None,
+            contents=[prefix],
+            ttl=f"{self.ttl_seconds}s")
+
+    def get_update_config(self) -> types.UpdateCachedContentConfig:
+        return types.UpdateCachedContentConfig(ttl=f"{self.ttl_seconds}s")
+
+    def store(self, key: str, name: str|None, generator: Any, result: str) -> str|None:
+        with self.lock:
+            self.entries[key] = CachedPrefix(name, generator.get_config_digest(), time.time() + self.ttl_seconds)
+            self.entries.move_to_end(key)
+        context_cache_counter.add(1, {"cache": self.name, "result": result})
+        return name
+
+    def take_stale_entries(self, config_digest: str) -> list[CachedPrefix]:
+        """Removes and returns the entries created under a different generation config."""
+        with self.lock:
+            if self.config_digest == config_digest:
+                return []
+            self.config_digest = config_digest
+            stale = [e for e in self.entries.values() if e.config_digest != config_digest]
+            self.entries = OrderedDict((k, e) for k, e in self.entries.items() if e.config_digest == config_digest)
+        if stale:
+            context_cache_counter.add(len(stale), {"cache": self.name, "result": "invalidated"})
+        return stale
+
+    def take_evicted_entries(self) -> list[CachedPrefix]:
+        """Removes and returns the least recently used entries over max_entries."""
+        with self.lock:
+            evicted = []
+            while len(self.entries) > self.max_entries:
+                evicted.append(self.entries.popitem(last=False)[1])
+        if evicted:
+            context_cache_counter.add(len(evicted), {"cache": self.name, "result": "evicted"})
+        return evicted
+
+    def delete_remote(self, generator: Any, entry: CachedPrefix) -> None:
+        if entry.name is None:
+            return
+        try:
+            generator.client.caches.delete(name=entry.name)
+        except errors.APIError as e:
+            logger.warning("failed to delete cached content %s: %s", entry.name, e)
+
+    async def delete_remote_async(self, generator: Any, entry: CachedPrefix) -> None:
+        if entry.name is None:
+            return
+        try:
+            await generator.client.aio.caches.delete(name=entry.name)
+        except errors.APIError as e:
+            logger.warning("failed to delete cached content %s: %s", entry.name, e)
+
+    def take_entries(self) -> list[CachedPrefix]:
+        with self.lock:
+            entries = list(self.entries.values())
+            self.entries = OrderedDict()
+        return entries
+
+    def clear(self, generator: Any) -> None:
+        """Deletes every cached content handle, e.g. on shutdown, rather than waiting for the TTL."""
+        for entry in self.take_entries():
+            self.delete_remote(generator, entry)
+
+    async def clear_async(self, generator: Any) -> None:
+        for entry in self.take_entries():
+            await self.delete_remote_async(generator, entry)
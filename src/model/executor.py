@@ -0,0 +1,129 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from opentelemetry import metrics
+
+DEFAULT_THREAD_POOL_SIZE = 20
+THREAD_NAME_PREFIX = "command"
+
+meter = metrics.get_meter(__name__)
+queue_wait_histogram = meter.create_histogram(
+    "command.queue_wait", unit="s", description="Time a command waited for a worker thread.")
+run_time_histogram = meter.create_histogram(
+    "command.run_time", unit="s", description="Time a command spent executing.")
+
+
+class CommandTiming():
+    """
+    Aggregated queue-wait and run-time statistics for all executions of a command name.
+    Queue wait is the time between submission and a worker thread picking up the command,
+    which is the signal used to decide if the thread pool is under sized.
+    """
+    def __init__(self):
+        self.count = 0
+        self.total_queue_wait = 0.0
+        self.total_run_time = 0.0
+        self.max_queue_wait = 0.0
+        self.max_run_time = 0.0
+
+    def record(self, queue_wait: float, run_time: float) -> None:
+        self.count += 1
+        self.total_queue_wait += queue_wait
+        self.total_run_time += run_time
+        self.max_queue_wait = max(self.max_queue_wait, queue_wait)
+        self.max_run_time = max(self.max_run_time, run_time)
+
+    def mean_queue_wait(self) -> float:
+        return self.total_queue_wait / self.count if self.count > 0 else 0.0
+
+    def mean_run_time(self) -> float:
+        return self.total_run_time / self.count if self.count > 0 else 0.0
+
+
+class CommandExecutor():
+    """
+    A shared thread pool for running blocking command functions without blocking the
+    event loop. The context variables of the caller (e.g. the current trace span) are
+    copied into the worker thread so the wiretap continues to work.
+    """
+    def __init__(self, max_workers: int = DEFAULT_THREAD_POOL_SIZE):
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=THREAD_NAME_PREFIX)
+        self.timings: dict[str, CommandTiming] = {}
+        self.lock = threading.Lock()
+
+    async def run(self, name: str, func: Callable[..., Any], *args: Any) -> Any:
+        """Runs the blocking function on the pool and awaits its result."""
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        submitted = time.perf_counter()
+
+        def invoke():
+            started = time.perf_counter()
+            try:
+                return context.run(func, *args)
+            finally:
+                self.record(name, started - submitted, time.perf_counter() - started)
+
+        return await loop.run_in_executor(self.executor, invoke)
+
+    def record(self, name: str, queue_wait: float, run_time: float) -> None:
+        with self.lock:
+            if name not in self.timings:
+                self.timings[name] = CommandTiming()
+            self.timings[name].record(queue_wait, run_time)
+        queue_wait_histogram.record(queue_wait, {"command": name})
+        run_time_histogram.record(run_time, {"command": name})
+
+    def get_timing(self, name: str) -> CommandTiming | None:
+        with self.lock:
+            return self.timings.get(name)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self.executor.shutdown(wait=wait)
+
+
+_command_executor: CommandExecutor | None = None
+_command_executor_lock = threading.Lock()
+
+
+def get_command_executor(config=None) -> CommandExecutor:
+    """
+    Returns the process wide command executor, creating it on first use and sizing
+    it from the application thread_pool_size when a configuration is available.
+    """
+    global _command_executor
+    if _command_executor is None:
+        with _command_executor_lock:
+            if _command_executor is None:
+                size = DEFAULT_THREAD_POOL_SIZE
+                if config is not None:
+                    size = getattr(config.application, "thread_pool_size", DEFAULT_THREAD_POOL_SIZE)
+                _command_executor = CommandExecutor(max_workers=size)
+    return _command_executor
+
+
+def shutdown_command_executor(wait: bool = True) -> None:
+    """Shuts down the process wide command executor, a new one is created on next use."""
+    global _command_executor
+    with _command_executor_lock:
+        if _command_executor is not None:
+            _command_executor.shutdown(wait=wait)
+            _command_executor = None
@@ -0,0 +1,199 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import logging
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import requests
+from opentelemetry import metrics
+from requests.adapters import HTTPAdapter
+
+from model.clients import get_storage_client
+from utils.rate_limit import RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENT = 32
+DEFAULT_MAX_PER_HOST = 8
+# resumable uploads are sent in chunks of a multiple of 256 KiB, one chunk is buffered at a time
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+DEFAULT_READ_SIZE = 64 * 1024
+DEFAULT_CONNECT_TIMEOUT_SECONDS = 5.0
+DEFAULT_READ_TIMEOUT_SECONDS = 30.0
+DEFAULT_TIMEOUT_SECONDS = 120.0
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_CONTENT_TYPE = "application/octet-stream"
+RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+meter = metrics.get_meter(__name__)
+ingest_latency_histogram = meter.create_histogram(
+    "images.ingest_latency", unit="s", description="Time to copy an image into a bucket, including retries, by host.")
+ingest_bytes_counter = meter.create_counter(
+    "images.ingest_bytes", unit="By", description="Bytes of images copied into buckets by host.")
+ingest_throughput_histogram = meter.create_histogram(
+    "images.ingest_throughput", unit="By/s", description="Transfer rate of each image copied by host.")
+ingest_counter = meter.create_counter(
+    "images.ingested", description="Images by host and result (ingested, retried or failed).")
+
+
+class ImageIngester():
+    """
+    Copies images from their URLs into Cloud Storage. Each image is streamed from the
+    response straight into a resumable upload, so only one chunk of it is in memory and
+    nothing is written to disk. Downloads share one pooled HTTP session, at most
+    max_concurrent run at once and at most max_per_host against any one host. An image
+    taking longer than timeout_seconds fails, and connection errors, timeouts and
+    throttling or server errors are retried with a fresh download and upload.
+    """
+    def __init__(self,
+                 max_concurrent: int = DEFAULT_MAX_CONCURRENT,
+                 max_per_host: int = DEFAULT_MAX_PER_HOST,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 read_size: int = DEFAULT_READ_SIZE,
+                 connect_timeout_seconds: float = DEFAULT_CONNECT_TIMEOUT_SECONDS,
+                 read_timeout_seconds: float = DEFAULT_READ_TIMEOUT_SECONDS,
+                 timeout_seconds: float = DEFAULT_TIMEOUT_SECONDS,
+                 max_retries: int = DEFAULT_MAX_RETRIES,
+                 session: requests.Session|None = None,
+                 storage_client: Any = None):
+        self.max_per_host = max_per_host
+        self.chunk_size = chunk_size
+        self.read_size = read_size
+        self.timeouts = (connect_timeout_seconds, read_timeout_seconds)
+        self.timeout_seconds = timeout_seconds
+        self.retry_policy = RetryPolicy(max_retries=max_retries, initial_backoff_seconds=0.5, max_backoff_seconds=10.0)
+        self.session = session if session is not None else create_session(max_concurrent, max_per_host)
+        self.storage_client = storage_client
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="ingest")
+        self.host_semaphores: dict[str, asyncio.Semaphore] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def from_dict(d: dict[str, Any]|None) -> "ImageIngester":
+        return ImageIngester(**(d or {}))
+
+    async def ingest_many(self, images: list[tuple[str, str, str]]) -> list[str|Exception]:
+        """
+        Copies (url, bucket, blob name) images concurrently, returning the gs:// URI of each
+        image in the same order, or the exception it failed with.
+        """
+        return await asyncio.gather(*(self.ingest_async(*image) for image in images), return_exceptions=True)
+
+    async def ingest_async(self, url: str, bucket_name: str, blob_name: str) -> str:
+        """
+        Copies one image in a pool thread, retrying transient failures, and returns its
+        gs:// URI. The slot of its host is taken before the thread, so images waiting for
+        a busy host never hold the threads images of other hosts could use.
+        """
+        host = urllib.parse.urlparse(url).netloc
+        attributes = {"host": host}
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            try:
+                async with self.get_host_semaphore(host):
+                    transfer_started = time.monotonic()
+                    size = await loop.run_in_executor(self.executor, self.transfer, url, bucket_name, blob_name)
+                break
+            except Exception as e:
+                if attempt >= self.retry_policy.max_retries or not is_retryable(e):
+                    logger.warning("failed to ingest %s: %s", url, e)
+                    ingest_counter.add(1, dict(attributes, result="failed"))
+                    raise
+                ingest_counter.add(1, dict(attributes, result="retried"))
+                await asyncio.sleep(self.retry_policy.backoff(attempt))
+                attempt += 1
+
+        finished = time.monotonic()
+        ingest_latency_histogram.record(finished - started, attributes)
+        ingest_bytes_counter.add(size, attributes)
+        ingest_throughput_histogram.record(size / max(finished - transfer_started, 1e-6), attributes)
+        ingest_counter.add(1, dict(attributes, result="ingested"))
+        return f"gs://{bucket_name}/{blob_name}"
+
+    def transfer(self, url: str, bucket_name: str, blob_name: str) -> int:
+        """Streams the response into the blob, returning the bytes written. A failed upload is cancelled."""
+        deadline = time.monotonic() + self.timeout_seconds
+        with self.session.get(url, stream=True, timeout=self.timeouts) as response:
+            response.raise_for_status()
+            content_type = response.headers.get("Content-Type", DEFAULT_CONTENT_TYPE)
+            blob = self.get_storage_client().bucket(bucket_name).blob(blob_name)
+            size = 0
+            with blob.open("wb", chunk_size=self.chunk_size, content_type=content_type) as writer:
+                for chunk in response.iter_content(self.read_size):
+                    if time.monotonic() > deadline:
+                        raise TimeoutError(f"ingesting {url} took longer than {self.timeout_seconds}s")
+                    writer.write(chunk)
+                    size += len(chunk)
+        return size
+
+    def get_storage_client(self) -> Any:
+        return self.storage_client if self.storage_client is not None else get_storage_client()
+
+    def get_host_semaphore(self, host: str) -> asyncio.Semaphore:
+        with self.lock:
+            semaphore = self.host_semaphores.get(host)
+            if semaphore is None:
+                semaphore = asyncio.Semaphore(self.max_per_host)
+                self.host_semaphores[host] = semaphore
+            return semaphore
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+
+def create_session(max_concurrent: int, max_per_host: int) -> requests.Session:
+    """A session keeping up to max_per_host connections alive for each of max_concurrent hosts."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=max_concurrent, pool_maxsize=max_per_host, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def is_retryable(e: Exception) -> bool:
+    if isinstance(e, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError, TimeoutError)):
+        return True
+    if isinstance(e, requests.HTTPError):
+        return e.response is not None and e.response.status_code in RETRYABLE_STATUS_CODES
+    # errors of the storage client carry the HTTP status as code
+    return getattr(e, "code", None) in RETRYABLE_STATUS_CODES
+
+
+_image_ingester: ImageIngester|None = None
+_image_ingester_lock = threading.Lock()
+
+
+def get_image_ingester(settings: dict[str, Any]|None = None) -> ImageIngester:
+    """Returns the process wide image ingester, created on first use from the [images.ingestion] settings."""
+    global _image_ingester
+    if _image_ingester is None:
+        with _image_ingester_lock:
+            if _image_ingester is None:
+                _image_ingester = ImageIngester.from_dict(settings)
+    return _image_ingester
+
+
+def shutdown_image_ingester() -> None:
+    global _image_ingester
+    with _image_ingester_lock:
+        if _image_ingester is not None:
+            _image_ingester.close()
+            _image_ingester = None
@@ -0,0 +1,246 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import logging
+import threading
+import time
+import uuid
+from typing import Any, Callable
+
+from opentelemetry import metrics
+
+from utils.rate_limit import RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_ROWS = 500
+# the recommended maximum request size of insertAll is 10MB
+DEFAULT_FLUSH_BYTES = 5 * 1024 * 1024
+DEFAULT_FLUSH_SECONDS = 1.0
+# rows are refused with put blocking once this many are waiting, so memory stays bounded
+DEFAULT_MAX_BUFFERED_ROWS = 50000
+# row errors that will fail again on retry
+PERMANENT_ROW_ERRORS = ("invalid", "invalidQuery", "notFound")
+# a row waiting in the buffer, its row id, the row, its JSON size and its on_written callback
+BufferedRow = tuple[str, dict[str, Any], int, Callable[[bool], None]|None]
+
+meter = metrics.get_meter(__name__)
+flush_latency_histogram = meter.create_histogram(
+    "sink.flush_latency", unit="s", description="Time to write a batch of rows, including retries, by table.")
+flush_rows_histogram = meter.create_histogram(
+    "sink.flush_rows", unit="{row}", description="Rows per flushed batch by table.")
+row_counter = meter.create_counter(
+    "sink.rows", unit="{row}", description="Rows by table and result (inserted, retried or failed).")
+
+
+class StreamingInsertSink():
+    """
+    Buffers rows for a BigQuery table across contexts and writes them with one streaming
+    insert per batch, from a background thread. A batch is flushed once it reaches
+    flush_rows or flush_bytes, or its oldest row is flush_seconds old. Rows the service
+    rejects are retried on their own, with a row id per row so retried inserts are
+    de-duplicated, and close flushes whatever is left. The on_written callback of put is
+    called from the flushing thread with True once a row is inserted, or False if it
+    was dropped, e.g. for marking the row done only once it is in the table.
+    """
+    def __init__(self,
+                 client: Any,
+                 table: str,
+                 flush_rows: int = DEFAULT_FLUSH_ROWS,
+                 flush_bytes: int = DEFAULT_FLUSH_BYTES,
+                 flush_seconds: float = DEFAULT_FLUSH_SECONDS,
+                 max_buffered_rows: int = DEFAULT_MAX_BUFFERED_ROWS,
+                 retry_policy: RetryPolicy|None = None):
+        self.client = client
+        self.table = table
+        self.flush_rows = flush_rows
+        self.flush_bytes = flush_bytes
+        self.flush_seconds = flush_seconds
+        self.max_buffered_rows = max_buffered_rows
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy(max_retries=3)
+
+        self.rows: list[BufferedRow] = []
+        self.bytes = 0
+        self.oldest: float|None = None
+        self.flush_requested = False
+        self.flushing = 0
+        self.closed = False
+        self.failed_rows = 0
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name=f"sink-{table}", daemon=True)
+        self.thread.start()
+
+    def put(self, rows: list[dict[str, Any]], on_written: Callable[[bool], None]|None = None) -> None:
+        """Adds rows to the buffer, blocking while max_buffered_rows are already waiting."""
+        sized = [(uuid.uuid4().hex, row, len(json.dumps(row, default=str)), on_written) for row in rows]
+        with self.condition:
+            while len(self.rows) >= self.max_buffered_rows and not self.closed:
+                self.condition.wait()
+            if self.closed:
+                raise RuntimeError(f"the sink for {self.table} is closed")
+            first = self.oldest is None
+            if first:
+                self.oldest = time.monotonic()
+            self.rows.extend(sized)
+            self.bytes += sum(size for _, _, size, _ in sized)
+            # the first row starts the age timer of the flushing thread
+            if first or self.is_due():
+                self.condition.notify_all()
+
+    def is_due(self) -> bool:
+        if len(self.rows) == 0:
+            return False
+        return (self.flush_requested
+                or self.closed
+                or len(self.rows) >= self.flush_rows
+                or self.bytes >= self.flush_bytes
+                or time.monotonic() - self.oldest >= self.flush_seconds)
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                while not self.is_due() and not self.closed:
+                    timeout = None if self.oldest is None else self.oldest + self.flush_seconds - time.monotonic()
+                    self.condition.wait(timeout)
+                if len(self.rows) == 0:
+                    return
+                batch = self.take_batch()
+            try:
+                self.write(batch)
+            finally:
+                with self.condition:
+                    self.flushing -= 1
+                    self.condition.notify_all()
+
+    def take_batch(self) -> list[BufferedRow]:
+        """Removes the next batch from the buffer, must be called holding the condition."""
+        count, size = 0, 0
+        for _, _, row_size, _ in self.rows:
+            if count == self.flush_rows or (count > 0 and size + row_size > self.flush_bytes):
+                break
+            count += 1
+            size += row_size
+        batch, self.rows = self.rows[:count], self.rows[count:]
+        self.bytes -= size
+        self.oldest = time.monotonic() if self.rows else None
+        self.flush_requested = self.flush_requested and len(self.rows) > 0
+        self.flushing += 1
+        # wakes producers waiting for room in the buffer
+        self.condition.notify_all()
+        return batch
+
+    def write(self, batch: list[BufferedRow]) -> None:
+        started = time.monotonic()
+        attributes = {"table": self.table}
+        flush_rows_histogram.record(len(batch), attributes)
+        pending = batch
+        attempt = 0
+        while True:
+            try:
+                errors = self.client.insert_rows_json(
+                    self.table, [row for _, row, _, _ in pending], row_ids=[row_id for row_id, _, _, _ in pending])
+            except Exception as e:
+                # the whole request failed, e.g. a timeout or a 5xx, so every row is retried
+                logger.warning("insert into %s failed: %s", self.table, e)
+                errors = [{"index": i, "errors": [{"reason": "requestFailed", "message": str(e)}]} for i in range(len(pending))]
+
+            row_counter.add(len(pending) - len(errors), dict(attributes, result="inserted"))
+            failed = {e["index"] for e in errors}
+            notify([r for i, r in enumerate(pending) if i not in failed], True)
+            retryable = [pending[e["index"]] for e in errors if not is_permanent(e)]
+            self.drop([pending[e["index"]] for e in errors if is_permanent(e)], errors)
+            if len(retryable) == 0:
+                break
+            if attempt >= self.retry_policy.max_retries:
+                self.drop(retryable, errors)
+                break
+            row_counter.add(len(retryable), dict(attributes, result="retried"))
+            time.sleep(self.retry_policy.backoff(attempt))
+            attempt += 1
+            pending = retryable
+        flush_latency_histogram.record(time.monotonic() - started, attributes)
+
+    def drop(self, rows: list[BufferedRow], errors: list[dict[str, Any]]) -> None:
+        if len(rows) > 0:
+            logger.error("dropped %d rows for %s: %s", len(rows), self.table, errors[:3])
+            row_counter.add(len(rows), {"table": self.table, "result": "failed"})
+            self.failed_rows += len(rows)
+            notify(rows, False)
+
+    def flush(self, timeout: float|None = None) -> bool:
+        """Writes every buffered row now, returning False if that takes longer than timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            self.flush_requested = len(self.rows) > 0
+            self.condition.notify_all()
+            while len(self.rows) > 0 or self.flushing > 0:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def close(self, timeout: float|None = None) -> None:
+        """Stops accepting rows and waits until the buffered rows are written."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join(timeout)
+
+
+def notify(rows: list[BufferedRow], written: bool) -> None:
+    for _, _, _, on_written in rows:
+        if on_written is not None:
+            try:
+                on_written(written)
+            except Exception as e:
+                logger.error("on_written callback failed: %s", e)
+
+
+def is_permanent(error: dict[str, Any]) -> bool:
+    return any(e.get("reason") in PERMANENT_ROW_ERRORS for e in error.get("errors", []))
+
+
+_sinks: dict[tuple[str, str], Any] = {}
+_sinks_lock = threading.Lock()
+
+
+def get_sink(kind: str, table: str, factory: Callable[[], Any]) -> Any:
+    """Returns the process wide sink of a kind for a table, creating it with factory on first use."""
+    with _sinks_lock:
+        sink = _sinks.get((kind, table))
+        if sink is None:
+            sink = factory()
+            _sinks[(kind, table)] = sink
+        return sink
+
+
+def get_streaming_insert_sink(client: Any, table: str, **settings: Any) -> StreamingInsertSink:
+    return get_sink("stream", table, lambda: StreamingInsertSink(client, table, **settings))
+
+
+def close_sinks() -> None:
+    """Flushes and closes every sink, e.g. on shutdown."""
+    with _sinks_lock:
+        sinks = list(_sinks.values())
+        _sinks.clear()
+    errors = []
+    for sink in sinks:
+        try:
+            sink.close()
+        except Exception as e:
+            logger.error("failed to close the sink for %s: %s", sink.table, e)
+            errors.append(e)
+    if errors:
+        raise errors[0]
@@ -0,0 +1,272 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, AsyncIterator
+
+from opentelemetry import metrics
+
+from model.chain import Context
+from model.config import BigQuery
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_STREAMS = 4
+DEFAULT_MAX_QUEUED_BATCHES = 8
+DEFAULT_CHECKPOINT_SECONDS = 10.0
+# read sessions expire after 6 hours, a checkpoint older than this starts a new session
+SESSION_LIFETIME_SECONDS = 5.5 * 3600
+# the context keys recording where a row was read, used to complete it
+STREAM_KEY = "source_stream"
+OFFSET_KEY = "source_offset"
+# the context key of the row as read, e.g. for writing it with the results
+ROW_KEY = "source_row"
+QUEUE_POLL_SECONDS = 0.5
+
+meter = metrics.get_meter(__name__)
+source_rows_counter = meter.create_counter(
+    "source.rows", unit="{row}", description="Rows read by table.")
+source_batches_counter = meter.create_counter(
+    "source.batches", description="Arrow record batches read by table.")
+
+
+class ReadCheckpoint():
+    """
+    The read session of a table and, per stream, the offset of the first row not yet
+    completed, saved as JSON so a restarted reader continues where the last one stopped.
+    """
+    def __init__(self, table: str, options: dict[str, Any], session: str, streams: list[str],
+                 offsets: dict[str, int]|None = None, created: float|None = None):
+        self.table = table
+        self.options = options
+        self.session = session
+        self.streams = streams
+        self.offsets = offsets if offsets is not None else {s: 0 for s in streams}
+        self.created = created if created is not None else time.time()
+
+    def matches(self, table: str, options: dict[str, Any]) -> bool:
+        return (self.table == table and self.options == options
+                and time.time() - self.created < SESSION_LIFETIME_SECONDS)
+
+    def save(self, path: str) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary = f"{path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(vars(self), f)
+        os.replace(temporary, path)
+
+    @staticmethod
+    def load(path: str|None) -> "ReadCheckpoint|None":
+        if path is None or not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            return ReadCheckpoint(**json.load(f))
+
+
+class StreamWatermark():
+    """The offset below which every row of a stream is completed, rows may complete in any order."""
+    def __init__(self, offset: int):
+        self.offset = offset
+        self.completed: set[int] = set()
+
+    def complete(self, offset: int) -> bool:
+        """Marks a row completed, returning True if the watermark advanced."""
+        if offset < self.offset:
+            return False
+        self.completed.add(offset)
+        advanced = False
+        while self.offset in self.completed:
+            self.completed.remove(self.offset)
+            self.offset += 1
+            advanced = True
+        return advanced
+
+
+class StorageReadSource():
+    """
+    Reads a table with the BigQuery Storage Read API as Arrow record batches, one thread
+    per read stream, and turns the rows into contexts as they are consumed. At most
+    max_queued_batches batches wait to be consumed, so memory stays bounded regardless of
+    the table size. Only selected_fields are read, and row_restriction is a SQL filter.
+
+    Each context records the stream and offset of its row, and complete is called once its
+    results are written. With a checkpoint_path the lowest offset not completed of every stream is
+    saved, so a restarted reader resumes the same session without losing rows, though rows
+    in flight when the process stopped are read again. Needs the optional
+    google-cloud-bigquery-storage and pyarrow packages.
+    """
+    def __init__(self,
+                 project_id: str,
+                 table: str,
+                 selected_fields: list[str]|None = None,
+                 row_restriction: str|None = None,
+                 max_streams: int = DEFAULT_MAX_STREAMS,
+                 max_queued_batches: int = DEFAULT_MAX_QUEUED_BATCHES,
+                 checkpoint_path: str|None = None,
+                 checkpoint_seconds: float = DEFAULT_CHECKPOINT_SECONDS,
+                 client: Any = None):
+        self.project_id = project_id
+        self.table = table
+        self.selected_fields = selected_fields or []
+        self.row_restriction = row_restriction
+        self.max_streams = max_streams
+        self.max_queued_batches = max_queued_batches
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_seconds = checkpoint_seconds
+        self.client = client
+        self.checkpoint: ReadCheckpoint|None = None
+        self.watermarks: dict[str, StreamWatermark] = {}
+        self.saved = time.monotonic()
+        self.lock = threading.Lock()
+
+    def get_client(self) -> Any:
+        if self.client is None:
+            try:
+                from google.cloud import bigquery_storage_v1
+            except ImportError as e:
+                raise ImportError("reading tables needs the google-cloud-bigquery-storage and pyarrow packages, "
+                                  "install the bigquery-storage extra") from e
+            self.client = bigquery_storage_v1.BigQueryReadClient()
+        return self.client
+
+    def get_options(self) -> dict[str, Any]:
+        return {"selected_fields": self.selected_fields, "row_restriction": self.row_restriction}
+
+    def open_session(self) -> ReadCheckpoint:
+        """Resumes the session of the checkpoint, or creates a new read session."""
+        checkpoint = ReadCheckpoint.load(self.checkpoint_path)
+        if checkpoint is not None and checkpoint.matches(self.table, self.get_options()):
+            logger.info("resuming read session %s of %s", checkpoint.session, self.table)
+            return checkpoint
+
+        from google.cloud.bigquery_storage_v1 import types
+        read_options = types.ReadSession.TableReadOptions(
+            selected_fields=self.selected_fields, row_restriction=self.row_restriction or "")
+        requested = types.ReadSession(table=get_table_path(self.table),
+                                      data_format=types.DataFormat.ARROW,
+                                      read_options=read_options)
+        session = self.get_client().create_read_session(
+            parent=f"projects/{self.project_id}", read_session=requested, max_stream_count=self.max_streams)
+        logger.info("created read session %s of %s with %d streams", session.name, self.table, len(session.streams))
+        return ReadCheckpoint(self.table, self.get_options(), session.name, [s.name for s in session.streams])
+
+    async def read_contexts(self, config: Any) -> AsyncIterator[Context]:
+        """Yields a context per row, with a key per selected column, in no particular order."""
+        async for stream, offset, batch in self.read_batches():
+            for i, row in enumerate(batch.to_pylist()):
+                context = Context(config)
+                for key, value in row.items():
+                    context.set(key, value)
+                context.set(ROW_KEY, row)
+                context.set(STREAM_KEY, stream)
+                context.set(OFFSET_KEY, offset + i)
+                yield context
+
+    async def read_batches(self) -> AsyncIterator[tuple[str, int, Any]]:
+        """Yields the record batches of every stream with their stream and first offset."""
+        self.checkpoint = await asyncio.to_thread(self.open_session)
+        with self.lock:
+            self.watermarks = {s: StreamWatermark(self.checkpoint.offsets.get(s, 0)) for s in self.checkpoint.streams}
+        self.save_checkpoint()
+        batches: queue.Queue = queue.Queue(maxsize=self.max_queued_batches)
+        stop = threading.Event()
+        threads = [threading.Thread(target=self.read_stream, args=(s, w.offset, batches, stop),
+                                    name=f"read-{s.rsplit('/', 1)[-1]}", daemon=True)
+                   for s, w in self.watermarks.items()]
+        for thread in threads:
+            thread.start()
+        try:
+            remaining = len(threads)
+            while remaining > 0:
+                try:
+                    stream, offset, batch = await asyncio.to_thread(batches.get, timeout=QUEUE_POLL_SECONDS)
+                except queue.Empty:
+                    continue
+                if isinstance(batch, BaseException):
+                    raise batch
+                if batch is None:
+                    remaining -= 1
+                    continue
+                yield stream, offset, batch
+        finally:
+            stop.set()
+
+    def read_stream(self, stream: str, offset: int, batches: queue.Queue, stop: threading.Event) -> None:
+        attributes = {"table": self.table}
+        try:
+            reader = self.get_client().read_rows(stream, offset=offset)
+            for page in reader.rows().pages:
+                batch = page.to_arrow()
+                if not put_until_stopped(batches, (stream, offset, batch), stop):
+                    return
+                offset += batch.num_rows
+                source_batches_counter.add(1, attributes)
+                source_rows_counter.add(batch.num_rows, attributes)
+            put_until_stopped(batches, (stream, offset, None), stop)
+        except Exception as e:
+            logger.error("failed to read stream %s of %s: %s", stream, self.table, e)
+            put_until_stopped(batches, (stream, offset, e), stop)
+
+    def complete(self, context: Context) -> None:
+        """Marks the row of a processed context completed, saving the checkpoint periodically."""
+        with self.lock:
+            watermark = self.watermarks.get(context.get(STREAM_KEY))
+            if watermark is None or not watermark.complete(context.get(OFFSET_KEY)):
+                return
+            due = time.monotonic() - self.saved >= self.checkpoint_seconds
+        if due:
+            self.save_checkpoint()
+
+    def save_checkpoint(self) -> None:
+        if self.checkpoint_path is None or self.checkpoint is None:
+            return
+        with self.lock:
+            self.checkpoint.offsets = {s: w.offset for s, w in self.watermarks.items()}
+            self.checkpoint.save(self.checkpoint_path)
+            self.saved = time.monotonic()
+
+
+def put_until_stopped(batches: queue.Queue, item: tuple, stop: threading.Event) -> bool:
+    """Waits for room in the queue, returning False if the reader was stopped first."""
+    while not stop.is_set():
+        try:
+            batches.put(item, timeout=QUEUE_POLL_SECONDS)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def create_source(project_id: str, settings: BigQuery) -> StorageReadSource:
+    """A source of the origin_table of the [bigquery] table."""
+    return StorageReadSource(project_id,
+                             settings.get_table(settings.origin_table, project_id),
+                             selected_fields=settings.selected_fields,
+                             row_restriction=settings.row_restriction,
+                             max_streams=settings.max_streams,
+                             max_queued_batches=settings.max_queued_batches,
+                             checkpoint_path=settings.checkpoint_path)
+
+
+def get_table_path(table: str) -> str:
+    """The resource path of a project.dataset.table name."""
+    project, dataset, name = table.split(".")
+    return f"projects/{project}/datasets/{dataset}/tables/{name}"
@@ -0,0 +1,102 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import functools
+import re
+from typing import Any, Mapping
+
+from opentelemetry import metrics, trace
+
+VARIABLE_EXPANSION_PATTERN = r"\$\{(.+?)\}"
+TEMPLATE_CACHE_SIZE = 256
+
+_variable_expression = re.compile(VARIABLE_EXPANSION_PATTERN)
+
+meter = metrics.get_meter(__name__)
+rendered_size_histogram = meter.create_histogram(
+    "prompt.rendered_size", unit="{character}", description="Size of rendered prompts by template.")
+
+
+class MissingVariablesError(ValueError):
+    """Raised when a template is rendered without values for all of its variables."""
+    def __init__(self, template_name: str, variables: list[str]):
+        super().__init__(f"prompt '{template_name}' is missing variables: {', '.join(variables)}")
+        self.template_name = template_name
+        self.variables = variables
+
+
+class PromptTemplate():
+    """
+    A prompt parsed once into its literal text and ${variable} slots, so rendering is
+    a single join instead of a regular expression pass over the whole prompt.
+    Values are looked up from anything with a get(key) method, e.g. a Context or a dict.
+    """
+    def __init__(self, text: str, name: str = "anonymous"):
+        self.name = name
+        self.text = text
+        self.literals: list[str] = []
+        self.variables: list[str] = []
+
+        position = 0
+        for match in _variable_expression.finditer(text):
+            self.literals.append(text[position:match.start()])
+            self.variables.append(match.group(1))
+            position = match.end()
+        self.literals.append(text[position:])
+
+    def get_variable_names(self) -> set[str]:
+        return set(self.variables)
+
+    def missing_variables(self, values: Any, defaults: Mapping[str, Any]|None = None) -> list[str]:
+        """Returns the variables, in slot order, that have no value or default."""
+        missing = []
+        for name in self.variables:
+            if _lookup(values, name, defaults) is None and name not in missing:
+                missing.append(name)
+        return missing
+
+    def render(self, values: Any, defaults: Mapping[str, Any]|None = None, strict: bool = True) -> str:
+        """
+        Renders the template from the values, falling back to the defaults. When strict, every
+        missing variable is reported in a single MissingVariablesError, otherwise they become "".
+        """
+        parts = [self.literals[0]]
+        missing = []
+        for i, name in enumerate(self.variables):
+            value = _lookup(values, name, defaults)
+            if value is None:
+                missing.append(name)
+                value = ""
+            parts.append(value if isinstance(value, str) else str(value))
+            parts.append(self.literals[i + 1])
+
+        if strict and len(missing) > 0:
+            raise MissingVariablesError(self.name, list(dict.fromkeys(missing)))
+
+        rendered = "".join(parts)
+        rendered_size_histogram.record(len(rendered), {"template": self.name})
+        trace.get_current_span().set_attribute(f"prompt.{self.name}.rendered_size", len(rendered))
+        return rendered
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def compile_template(text: str, name: str = "anonymous") -> PromptTemplate:
+    """Compiles ad-hoc template text, reusing the compiled template for repeated text."""
+    return PromptTemplate(text, name)
+
+
+def _lookup(values: Any, name: str, defaults: Mapping[str, Any]|None) -> Any:
+    value = values.get(name) if values is not None else None
+    if value is None and defaults is not None:
+        value = defaults.get(name)
+    return value
@@ -0,0 +1,207 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import logging
+import threading
+from contextvars import ContextVar
+from typing import Any, Mapping
+
+from opentelemetry import metrics
+
+from model.templates import PromptTemplate
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4
+NO_COMMAND = "none"
+TRUNCATION_MARKER = "..."
+
+# The name of the command being executed, set by Command.execute and inherited by
+# the tasks and threads it starts, so model calls are attributed to their command.
+current_command: ContextVar[str|None] = ContextVar("current_command", default=None)
+
+meter = metrics.get_meter(__name__)
+input_token_counter = meter.create_counter(
+    "tokens.input", unit="{token}", description="Prompt tokens by command and model.")
+cached_token_counter = meter.create_counter(
+    "tokens.cached", unit="{token}", description="Prompt tokens served from cached content by command and model.")
+output_token_counter = meter.create_counter(
+    "tokens.output", unit="{token}", description="Response (and thinking) tokens by command and model.")
+truncated_counter = meter.create_counter(
+    "tokens.truncated", description="Responses cut off by max_output_tokens by command and model.")
+estimate_ratio_histogram = meter.create_histogram(
+    "tokens.estimate_ratio", description="Estimated over actual prompt tokens, the accuracy of the pre-call estimate.")
+trimmed_counter = meter.create_counter(
+    "prompt.trimmed", description="Prompt variables trimmed to fit a token budget, by prompt and variable.")
+
+
+def estimate_text_tokens(text: str) -> int:
+    """A local approximation of the tokens in text."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class TokenUsage():
+    """Token totals of the model calls for a command and model."""
+    def __init__(self):
+        self.calls = 0
+        self.input_tokens = 0
+        self.cached_tokens = 0
+        self.output_tokens = 0
+        self.truncated = 0
+
+    def add(self, input_tokens: int, cached_tokens: int, output_tokens: int, truncated: bool) -> None:
+        self.calls += 1
+        self.input_tokens += input_tokens
+        self.cached_tokens += cached_tokens
+        self.output_tokens += output_tokens
+        self.truncated += 1 if truncated else 0
+
+
+class TokenAccounting():
+    """
+    Records the usage metadata returned with every response, by the command that made
+    the call and the model, both as metrics and as in process totals for reports.
+    """
+    def __init__(self):
+        self.usage: dict[tuple[str, str], TokenUsage] = {}
+        self.lock = threading.Lock()
+
+    def record(self, model: str, usage_metadata: Any, estimated_tokens: int|None = None, truncated: bool = False) -> None:
+        if usage_metadata is None:
+            return
+        command = current_command.get() or NO_COMMAND
+        input_tokens = usage_metadata.prompt_token_count or 0
+        cached_tokens = usage_metadata.cached_content_token_count or 0
+        output_tokens = (usage_metadata.candidates_token_count or 0) + (usage_metadata.thoughts_token_count or 0)
+        with self.lock:
+            if (command, model) not in self.usage:
+                self.usage[(command, model)] = TokenUsage()
+            self.usage[(command, model)].add(input_tokens, cached_tokens, output_tokens, truncated)
+
+        attributes = {"command": command, "model": model}
+        input_token_counter.add(input_tokens, attributes)
+        cached_token_counter.add(cached_tokens, attributes)
+        output_token_counter.add(output_tokens, attributes)
+        if estimated_tokens is not None and input_tokens > 0:
+            estimate_ratio_histogram.record(estimated_tokens / input_tokens, attributes)
+        if truncated:
+            truncated_counter.add(1, attributes)
+            logger.warning("response of %s for command %s was truncated at max_output_tokens", model, command)
+
+    def get_usage(self, command: str|None = None, model: str|None = None) -> TokenUsage:
+        """The totals, optionally only for a command and or model."""
+        total = TokenUsage()
+        with self.lock:
+            for (c, m), usage in self.usage.items():
+                if (command is None or c == command) and (model is None or m == model):
+                    total.calls += usage.calls
+                    total.input_tokens += usage.input_tokens
+                    total.cached_tokens += usage.cached_tokens
+                    total.output_tokens += usage.output_tokens
+                    total.truncated += usage.truncated
+        return total
+
+    def report(self) -> list[dict[str, Any]]:
+        """One row per command and model, largest input first."""
+        with self.lock:
+            rows = [dict(command=c, model=m, **vars(u)) for (c, m), u in self.usage.items()]
+        return sorted(rows, key=lambda r: r["input_tokens"], reverse=True)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.usage = {}
+
+
+_token_accounting = TokenAccounting()
+
+
+def get_token_accounting() -> TokenAccounting:
+    return _token_accounting
+
+
+class OverlayValues():
+    """Values looked up from the overrides first, then the underlying values."""
+    def __init__(self, overrides: Mapping[str, Any], values: Any):
+        self.overrides = overrides
+        self.values = values
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in self.overrides:
+            return self.overrides[key]
+        return self.values.get(key, default) if self.values is not None else default
+
+
+class TokenBudget():
+    """
+    An upper bound on the estimated tokens of a rendered prompt, from a prompt's optional
+    budget table, e.g. budget = { max_tokens = 8000, trim = ["category_attributes"] }.
+    When the prompt is over budget the trim variables, in order, are shortened until it fits.
+    """
+    def __init__(self, max_tokens: int, trim: list[str]|None = None):
+        self.max_tokens = max_tokens
+        self.trim = trim or []
+
+    def render(self, template: PromptTemplate, values: Any, defaults: Mapping[str, Any]|None = None) -> str:
+        rendered = template.render(values, defaults)
+        excess = estimate_text_tokens(rendered) - self.max_tokens
+        overrides: dict[str, Any] = {}
+        for name in self.trim:
+            if excess <= 0:
+                break
+            value = values.get(name) if values is not None else None
+            if value is None and defaults is not None:
+                value = defaults.get(name)
+            if value is None:
+                continue
+            value = value if isinstance(value, str) else str(value)
+            overrides[name] = trim_value(value, max(len(value) - excess * CHARS_PER_TOKEN, 0))
+            trimmed_counter.add(1, {"prompt": template.name, "variable": name})
+            rendered = template.render(OverlayValues(overrides, values), defaults)
+            excess = estimate_text_tokens(rendered) - self.max_tokens
+
+        if excess > 0:
+            logger.warning("prompt %s is %d tokens over its budget of %d", template.name, excess, self.max_tokens)
+        return rendered
+
+
+def trim_value(value: str, max_chars: int) -> str:
+    """
+    Shortens a value to at most max_chars. JSON values stay valid by dropping the last
+    items of their longest array (e.g. the least relevant attributes), other text is cut.
+    """
+    if len(value) <= max_chars:
+        return value
+    try:
+        data = json.loads(value)
+    except ValueError:
+        data = None
+    if isinstance(data, (list, dict)):
+        trimmed = trim_json(data, max_chars)
+        if trimmed is not None:
+            return trimmed
+    return value[:max(max_chars - len(TRUNCATION_MARKER), 0)] + TRUNCATION_MARKER
+
+
+def trim_json(data: list|dict, max_chars: int) -> str|None:
+    candidates = [data] if isinstance(data, list) else [v for v in data.values() if isinstance(v, list)]
+    if len(candidates) == 0:
+        return None
+    items = max(candidates, key=lambda c: len(json.dumps(c)))
+    size = len(json.dumps(data))
+    sizes = [len(json.dumps(item)) + 2 for item in items]
+    while size > max_chars and len(items) > 0:
+        items.pop()
+        size -= sizes.pop()
+    trimmed = json.dumps(data)
+    return trimmed if len(trimmed) <= max_chars else None
@@ -0,0 +1,194 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator
+
+from google.genai import errors, types
+from opentelemetry import metrics
+
+from utils.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENT_VIDEOS = 4
+DEFAULT_MAX_CONCURRENT_UPLOADS = 2
+DEFAULT_INITIAL_POLL_SECONDS = 1.0
+DEFAULT_MAX_POLL_SECONDS = 30.0
+DEFAULT_PROCESSING_TIMEOUT_SECONDS = 900.0
+# uploaded files are kept for reuse, the service deletes them after 48 hours regardless
+DEFAULT_RETAIN_SECONDS = 3600.0
+
+STATE_PROCESSING = "PROCESSING"
+STATE_FAILED = "FAILED"
+
+meter = metrics.get_meter(__name__)
+video_upload_counter = meter.create_counter(
+    "video.uploads", description="Video files by result (uploaded or reused).")
+video_processing_histogram = meter.create_histogram(
+    "video.processing_time", unit="s", description="Time from upload until a video file was active.")
+
+
+class UploadedVideo():
+    """A video file on the service, the local content hash and the number of current users."""
+    def __init__(self, digest: str, file: types.File, expires: float):
+        self.digest = digest
+        self.file = file
+        self.expires = expires
+        self.references = 0
+
+
+class VideoFiles():
+    """
+    Uploads videos to the Files API for a generator. A video is uploaded once per content
+    hash, concurrent callers for the same video share the upload, and the file is reused
+    until retain_seconds after it was uploaded. The processing state is polled with
+    exponential backoff on the event loop, and files no longer retained are deleted once
+    unreferenced. References are only counted under the lock, and a video is not deleted
+    while callers are waiting for its upload. The SDK uploads files with resumable,
+    chunked requests.
+    """
+    def __init__(self,
+                 name: str,
+                 max_concurrent_videos: int = DEFAULT_MAX_CONCURRENT_VIDEOS,
+                 max_concurrent_uploads: int = DEFAULT_MAX_CONCURRENT_UPLOADS,
+                 initial_poll_seconds: float = DEFAULT_INITIAL_POLL_SECONDS,
+                 max_poll_seconds: float = DEFAULT_MAX_POLL_SECONDS,
+                 processing_timeout_seconds: float = DEFAULT_PROCESSING_TIMEOUT_SECONDS,
+                 retain_seconds: float = DEFAULT_RETAIN_SECONDS):
+        self.name = name
+        self.initial_poll_seconds = initial_poll_seconds
+        self.max_poll_seconds = max_poll_seconds
+        self.processing_timeout_seconds = processing_timeout_seconds
+        self.retain_seconds = retain_seconds
+        self.video_slots = asyncio.Semaphore(max_concurrent_videos)
+        self.upload_slots = asyncio.Semaphore(max_concurrent_uploads)
+        self.videos: dict[str, UploadedVideo] = {}
+        # the callers waiting for the upload of a digest, by digest
+        self.waiting: dict[str, int] = {}
+        self.lock = threading.Lock()
+        self.flight = SingleFlight(f"video.{name}")
+
+    @asynccontextmanager
+    async def use(self, client: Any, path: str) -> AsyncIterator[types.File]:
+        """
+        Holds one of the max_concurrent_videos slots and yields the active file for the
+        video, releasing the file when the block exits.
+        """
+        async with self.video_slots:
+            video = await self.acquire(client, path)
+            try:
+                yield video.file
+            finally:
+                await self.release(client, video)
+
+    async def acquire(self, client: Any, path: str) -> UploadedVideo:
+        await self.delete_expired(client)
+        digest = await asyncio.to_thread(file_digest, path)
+        with self.lock:
+            video = self.videos.get(digest)
+            if video is not None:
+                video.references += 1
+            else:
+                self.waiting[digest] = self.waiting.get(digest, 0) + 1
+        if video is not None:
+            video_upload_counter.add(1, {"videos": self.name, "result": "reused"})
+            return video
+
+        try:
+            video = await self.flight.do_async(digest, lambda: self.upload(client, digest, path))
+        finally:
+            with self.lock:
+                self.waiting[digest] -= 1
+                if self.waiting[digest] == 0:
+                    del self.waiting[digest]
+                if video is not None:
+                    video.references += 1
+        return video
+
+    async def release(self, client: Any, video: UploadedVideo) -> None:
+        with self.lock:
+            video.references -= 1
+        await self.delete_expired(client)
+
+    async def upload(self, client: Any, digest: str, path: str) -> UploadedVideo:
+        async with self.upload_slots:
+            uploaded = time.monotonic()
+            file = await client.aio.files.upload(
+                file=path,
+                config=types.UploadFileConfig(display_name=os.path.basename(path), mime_type=mimetypes.guess_type(path)[0]))
+        video_upload_counter.add(1, {"videos": self.name, "result": "uploaded"})
+        try:
+            file = await self.wait_until_active(client, file)
+        except BaseException:
+            await self.delete_remote(client, file)
+            raise
+        video_processing_histogram.record(time.monotonic() - uploaded, {"videos": self.name})
+
+        video = UploadedVideo(digest, file, time.monotonic() + self.retain_seconds)
+        with self.lock:
+            self.videos[digest] = video
+        return video
+
+    async def wait_until_active(self, client: Any, file: types.File) -> types.File:
+        """Polls the processing state with exponential backoff, raising if it fails or times out."""
+        deadline = time.monotonic() + self.processing_timeout_seconds
+        interval = self.initial_poll_seconds
+        while file.state is not None and file.state.name == STATE_PROCESSING:
+            if time.monotonic() + interval > deadline:
+                raise TimeoutError(f"video {file.name} is still processing after {self.processing_timeout_seconds}s")
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, self.max_poll_seconds)
+            file = await client.aio.files.get(name=file.name)
+
+        if file.state is not None and file.state.name == STATE_FAILED:
+            raise ValueError(f"video {file.name} failed processing: {file.error}")
+        return file
+
+    def take_expired(self, everything: bool = False) -> list[UploadedVideo]:
+        """Removes and returns the unreferenced videos past their retention."""
+        now = time.monotonic()
+        with self.lock:
+            expired = [v for v in self.videos.values()
+                       if v.references <= 0 and v.digest not in self.waiting and (everything or v.expires <= now)]
+            for video in expired:
+                del self.videos[video.digest]
+        return expired
+
+    async def delete_expired(self, client: Any) -> None:
+        for video in self.take_expired():
+            await self.delete_remote(client, video.file)
+
+    async def delete_remote(self, client: Any, file: types.File) -> None:
+        try:
+            await client.aio.files.delete(name=file.name)
+        except errors.APIError as e:
+            logger.warning("failed to delete video file %s: %s", file.name, e)
+
+    async def clear(self, client: Any) -> None:
+        """Deletes every unreferenced video file, e.g. on shutdown, rather than waiting for the service."""
+        for video in self.take_expired(everything=True):
+            await self.delete_remote(client, video.file)
+
+
+def file_digest(path: str) -> str:
+    """The SHA-256 of a file, read in chunks."""
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
@@ -0,0 +1,133 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import os
+import threading
+from typing import Any
+
+import numpy as np
+
+from model.examples import Category
+
+# the product text embedded for a lookup unless configured otherwise
+DEFAULT_TEXT_VARIABLE_NAMES = ["product_name", "product_description"]
+
+
+class VectorIndex():
+    """
+    An in process, exact nearest neighbour index by cosine similarity. Vectors are stored
+    normalized in one contiguous float32 matrix, so a search is a single matrix product.
+    Brute force stays well under a millisecond for the tens of thousands of categories
+    of a retail taxonomy, without the recall loss of an approximate (IVF/HNSW) index.
+    """
+    def __init__(self, dimensions: int|None = None):
+        self.vectors = np.empty((0, dimensions or 0), dtype=np.float32)
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+    def add(self, vectors: np.ndarray) -> None:
+        """Appends the rows of vectors, which are identified by their position in the index."""
+        normalized = normalize(np.atleast_2d(np.asarray(vectors, dtype=np.float32)))
+        with self.lock:
+            if len(self) == 0:
+                self.vectors = np.ascontiguousarray(normalized)
+            else:
+                self.vectors = np.ascontiguousarray(np.vstack([self.vectors, normalized]))
+
+    def search(self, queries: np.ndarray, k: int = 1) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the cosine similarity and position of the k nearest vectors for every query, best first."""
+        vectors = self.vectors
+        queries = normalize(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        if vectors.shape[0] == 0:
+            empty = np.empty((queries.shape[0], 0))
+            return empty.astype(np.float32), empty.astype(np.int64)
+
+        scores = queries @ vectors.T
+        k = min(k, vectors.shape[0])
+        nearest = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        nearest_scores = np.take_along_axis(scores, nearest, axis=1)
+        order = np.argsort(-nearest_scores, axis=1)
+        return np.take_along_axis(nearest_scores, order, axis=1), np.take_along_axis(nearest, order, axis=1)
+
+
+class CategoryVocabulary():
+    """
+    The known categories with their attribute schemas and the embedding of each, so a
+    product can be matched to a category without asking a model to detect it.
+    """
+    def __init__(self):
+        self.categories: list[Category] = []
+        self.index = VectorIndex()
+        self.categories_json: str|None = None
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.categories)
+
+    def add(self, categories: list[Category], vectors: np.ndarray) -> None:
+        with self.lock:
+            self.index.add(vectors)
+            self.categories.extend(categories)
+            self.categories_json = None
+
+    async def add_embedded(self, embedding: Any, categories: list[Category]) -> None:
+        """Adds the categories, embedding each one's text with the embedding model."""
+        vectors = await embedding.embed_texts_async([category_text(c) for c in categories])
+        self.add(categories, vectors)
+
+    def to_json(self) -> str:
+        """The categories and their attributes as a JSON list for prompts, built once per change."""
+        with self.lock:
+            if self.categories_json is None:
+                self.categories_json = f"[{','.join(c.model_dump_json() for c in self.categories)}]"
+            return self.categories_json
+
+    def nearest(self, vector: np.ndarray) -> tuple[Category|None, float]:
+        """The nearest category and its cosine similarity, or (None, 0.0) when the vocabulary is empty."""
+        scores, positions = self.index.search(vector, k=1)
+        if scores.shape[1] == 0:
+            return None, 0.0
+        return self.categories[int(positions[0, 0])], float(scores[0, 0])
+
+    def save(self, path: str) -> None:
+        """Saves the categories and their vectors as a single .npz file."""
+        with self.lock:
+            categories = json.dumps([c.model_dump() for c in self.categories])
+            vectors = self.index.vectors
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "wb") as f:
+            np.savez(f, vectors=vectors, categories=np.array(categories))
+
+    @staticmethod
+    def load(path: str) -> "CategoryVocabulary":
+        vocabulary = CategoryVocabulary()
+        with np.load(path) as data:
+            categories = [Category.model_validate(c) for c in json.loads(str(data["categories"]))]
+            if len(categories) > 0:
+                vocabulary.add(categories, data["vectors"])
+        return vocabulary
+
+
+def category_text(category: Category) -> str:
+    """The text embedded for a category, its path and attribute names."""
+    return f"{category.name}: {', '.join(a.name for a in category.attributes)}"
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
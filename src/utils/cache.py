@@ -0,0 +1,371 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from opentelemetry import metrics
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_DISK_BYTES = 1024 * 1024 * 1024
+ACCESS_FLUSH_SECONDS = 60.0
+# the default limit of variables in a statement before SQLite 3.32
+MAX_QUERY_KEYS = 999
+
+meter = metrics.get_meter(__name__)
+cache_request_counter = meter.create_counter(
+    "cache.requests", description="Cache lookups by cache name and result (memory, disk or miss).")
+cache_eviction_counter = meter.create_counter(
+    "cache.evictions", description="Entries evicted for size or expiry by cache name and tier.")
+
+
+class CacheStats():
+    """Hit, miss and eviction counters for a cache."""
+    def __init__(self):
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def hits(self) -> int:
+        return self.memory_hits + self.disk_hits
+
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+
+class LRUCache():
+    """
+    A thread safe, in memory, least recently used cache of byte values bounded
+    by both the number of entries and their total size, with an optional TTL.
+    """
+    def __init__(self,
+                 max_entries: int = DEFAULT_MAX_ENTRIES,
+                 max_bytes: int = DEFAULT_MAX_BYTES,
+                 ttl_seconds: float|None = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.entries: OrderedDict[str, tuple[bytes, float|None]] = OrderedDict()
+        self.size = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> bytes|None:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires <= time.time():
+                self._remove(key)
+                self.evictions += 1
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def get_many(self, keys: list[str]) -> dict[str, bytes]:
+        """The values found of the keys, by key."""
+        values = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                values[key] = value
+        return values
+
+    def put(self, key: str, value: bytes, ttl_seconds: float|None = None) -> None:
+        if len(value) > self.max_bytes:
+            return
+        ttl = ttl_seconds if ttl_seconds is not None else self.ttl_seconds
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, time.time() + ttl if ttl else None)
+            self.size += len(value)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _remove(self, key: str) -> None:
+        value, _ = self.entries.pop(key)
+        self.size -= len(value)
+
+
+class SqliteCache():
+    """
+    A persistent cache of byte values in a local SQLite database, shared by every
+    process on the host. Entries expire by TTL, and the least recently accessed
+    entries are evicted once the stored values exceed max_bytes.
+    A hit only reads the database: access times are kept in memory and written in
+    one transaction at most every ACCESS_FLUSH_SECONDS, or before an eviction, so
+    lookups never queue behind each other for the write lock. The total size is
+    kept in the database by triggers, so every process evicts by the same size.
+    The database is opened on first use, so creating the cache touches no files.
+    """
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_DISK_BYTES, ttl_seconds: float|None = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.accessed: dict[str, float] = {}
+        self.flushed = time.time()
+        self._connection: sqlite3.Connection|None = None
+        self.connect_lock = threading.Lock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """The connection to the database, which is created with its tables on first use."""
+        if self._connection is None:
+            with self.connect_lock:
+                if self._connection is None:
+                    self._connection = self.connect()
+        return self._connection
+
+    def connect(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        with connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+                "expires REAL, accessed REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER NOT NULL)")
+            connection.execute(
+                "INSERT OR IGNORE INTO totals (id, size) SELECT 0, COALESCE(SUM(size), 0) FROM entries")
+            connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_inserted AFTER INSERT ON entries "
+                "BEGIN UPDATE totals SET size = size + new.size; END")
+            connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_updated AFTER UPDATE OF size ON entries "
+                "BEGIN UPDATE totals SET size = size + new.size - old.size; END")
+            connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_deleted AFTER DELETE ON entries "
+                "BEGIN UPDATE totals SET size = size - old.size; END")
+        return connection
+
+    @property
+    def size(self) -> int:
+        """The total size of the values stored by every process."""
+        with self.lock:
+            return self.connection.execute("SELECT size FROM totals").fetchone()[0]
+
+    def get(self, key: str) -> bytes|None:
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT value, expires FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires = row
+            if expires is not None and expires <= now:
+                # removed by the next eviction rather than in a write transaction here
+                return None
+            self.accessed[key] = now
+            if now - self.flushed >= ACCESS_FLUSH_SECONDS:
+                with self.connection:
+                    self._flush_accessed(now)
+            return value
+
+    def get_many(self, keys: list[str]) -> dict[str, bytes]:
+        """The values found of the keys, by key, read with a query per MAX_QUERY_KEYS keys."""
+        now = time.time()
+        values = {}
+        with self.lock:
+            for i in range(0, len(keys), MAX_QUERY_KEYS):
+                chunk = keys[i:i + MAX_QUERY_KEYS]
+                rows = self.connection.execute(
+                    f"SELECT key, value, expires FROM entries WHERE key IN ({', '.join('?' * len(chunk))})", chunk)
+                for key, value, expires in rows:
+                    if expires is None or expires > now:
+                        values[key] = value
+                        self.accessed[key] = now
+            if now - self.flushed >= ACCESS_FLUSH_SECONDS:
+                with self.connection:
+                    self._flush_accessed(now)
+        return values
+
+    def put(self, key: str, value: bytes, ttl_seconds: float|None = None) -> None:
+        if len(value) > self.max_bytes:
+            return
+        now = time.time()
+        ttl = ttl_seconds if ttl_seconds is not None else self.ttl_seconds
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT INTO entries (key, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value, size = excluded.size, "
+                "expires = excluded.expires, accessed = excluded.accessed",
+                (key, value, len(value), now + ttl if ttl else None, now))
+            self.accessed.pop(key, None)
+            # read in the write transaction, so the size includes the writes of other processes
+            size = self.connection.execute("SELECT size FROM totals").fetchone()[0]
+            if size > self.max_bytes:
+                self._evict(now)
+
+    def delete(self, key: str) -> None:
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self.accessed.pop(key, None)
+
+    def close(self) -> None:
+        with self.lock:
+            if self._connection is None:
+                return
+            with self._connection:
+                self._flush_accessed(time.time())
+            self._connection.close()
+            self._connection = None
+
+    def _flush_accessed(self, now: float) -> None:
+        """Writes the access times recorded since the last flush, in the caller's transaction."""
+        if self.accessed:
+            self.connection.executemany("UPDATE entries SET accessed = ? WHERE key = ?",
+                                        [(accessed, key) for key, accessed in self.accessed.items()])
+            self.accessed.clear()
+        self.flushed = now
+
+    def _evict(self, now: float) -> None:
+        """Removes expired entries, then the least recently accessed until under max_bytes."""
+        self._flush_accessed(now)
+        expired = self.connection.execute("DELETE FROM entries WHERE expires IS NOT NULL AND expires <= ?", (now,))
+        self.evictions += expired.rowcount
+        size = self.connection.execute("SELECT size FROM totals").fetchone()[0]
+        for key, entry_size in self.connection.execute("SELECT key, size FROM entries ORDER BY accessed").fetchall():
+            if size <= self.max_bytes:
+                break
+            self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+            size -= entry_size
+            self.evictions += 1
+
+
+class TieredCache():
+    """
+    A bounded in-memory LRU in front of an optional persistent SQLite store.
+    Disk hits are promoted into memory, and every lookup is counted by result.
+    Coroutines use get_async and put_async, which access the SQLite store in a
+    thread so that disk I/O never blocks the event loop.
+    """
+    def __init__(self, name: str, memory: LRUCache, disk: SqliteCache|None = None):
+        self.name = name
+        self.memory = memory
+        self.disk = disk
+        self.stats = CacheStats()
+
+    def get(self, key: str) -> bytes|None:
+        value = self.memory.get(key)
+        if value is not None or self.disk is None:
+            return self.count_lookup(key, value, "memory")
+        return self.count_lookup(key, self.disk.get(key), "disk")
+
+    async def get_async(self, key: str) -> bytes|None:
+        """The non-blocking form of get, reading the disk tier in a thread."""
+        value = self.memory.get(key)
+        if value is not None or self.disk is None:
+            return self.count_lookup(key, value, "memory")
+        return self.count_lookup(key, await asyncio.to_thread(self.disk.get, key), "disk")
+
+    def get_many(self, keys: list[str]) -> dict[str, bytes]:
+        """The values found of the keys, by key, reading the keys missing from memory in one disk lookup."""
+        values = self.memory.get_many(keys)
+        for key, value in values.items():
+            self.count_lookup(key, value, "memory")
+        missing = [key for key in keys if key not in values]
+        if len(missing) == 0:
+            return values
+        found = self.disk.get_many(missing) if self.disk is not None else {}
+        for key in missing:
+            value = self.count_lookup(key, found.get(key), "disk")
+            if value is not None:
+                values[key] = value
+        return values
+
+    def count_lookup(self, key: str, value: bytes|None, tier: str) -> bytes|None:
+        """Counts a lookup by the tier the value was found in, promoting disk hits into memory."""
+        if value is None:
+            self.stats.misses += 1
+            cache_request_counter.add(1, {"cache": self.name, "result": "miss"})
+            return None
+        if tier == "disk":
+            self.memory.put(key, value)
+            self.stats.disk_hits += 1
+        else:
+            self.stats.memory_hits += 1
+        cache_request_counter.add(1, {"cache": self.name, "result": tier})
+        return value
+
+    def put(self, key: str, value: bytes, ttl_seconds: float|None = None) -> None:
+        self.put_memory(key, value, ttl_seconds)
+        if self.disk is not None:
+            self.put_disk(key, value, ttl_seconds)
+
+    async def put_async(self, key: str, value: bytes, ttl_seconds: float|None = None) -> None:
+        """The non-blocking form of put, writing the disk tier in a thread."""
+        self.put_memory(key, value, ttl_seconds)
+        if self.disk is not None:
+            await asyncio.to_thread(self.put_disk, key, value, ttl_seconds)
+
+    def put_memory(self, key: str, value: bytes, ttl_seconds: float|None) -> None:
+        evictions = self.memory.evictions
+        self.memory.put(key, value, ttl_seconds)
+        self.count_evictions("memory", self.memory.evictions - evictions)
+
+    def put_disk(self, key: str, value: bytes, ttl_seconds: float|None) -> None:
+        evictions = self.disk.evictions
+        self.disk.put(key, value, ttl_seconds)
+        self.count_evictions("disk", self.disk.evictions - evictions)
+
+    def count_evictions(self, tier: str, count: int) -> None:
+        if count > 0:
+            self.stats.evictions += count
+            cache_eviction_counter.add(count, {"cache": self.name, "tier": tier})
+
+    def delete(self, key: str) -> None:
+        self.memory.delete(key)
+        if self.disk is not None:
+            self.disk.delete(key)
+
+
+def create_tiered_cache(name: str, settings: dict) -> TieredCache:
+    """
+    Creates a tiered cache from a TOML table with the keys: max_entries, max_bytes,
+    ttl_seconds, and optionally path and max_disk_bytes for the persistent tier.
+    """
+    ttl = settings.get("ttl_seconds")
+    memory = LRUCache(max_entries=settings.get("max_entries", DEFAULT_MAX_ENTRIES),
+                      max_bytes=settings.get("max_bytes", DEFAULT_MAX_BYTES),
+                      ttl_seconds=ttl)
+    disk = None
+    if settings.get("path"):
+        disk = SqliteCache(settings.get("path"),
+                           max_bytes=settings.get("max_disk_bytes", DEFAULT_MAX_DISK_BYTES),
+                           ttl_seconds=ttl)
+    return TieredCache(name, memory, disk)
@@ -0,0 +1,139 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import re
+import zlib
+from collections import defaultdict
+
+import numpy as np
+from PIL import Image
+
+# a prime just below 2**32, so (a * x + b) never overflows 64 bits
+MINHASH_PRIME = 4294967291
+MINHASH_SEED = 1
+DEFAULT_NUM_PERMUTATIONS = 128
+DEFAULT_BANDS = 32
+DEFAULT_SHINGLE_SIZE = 4
+DEFAULT_MIN_SIMILARITY = 0.8
+# dHash distances up to IMAGE_BANDS - 1 bits always share a band
+DEFAULT_MAX_IMAGE_DISTANCE = 6
+IMAGE_HASH_SIZE = 8
+IMAGE_BANDS = 8
+
+WHITESPACE = re.compile(r"\s+")
+
+
+class NearDuplicateIndex():
+    """
+    Clusters near-duplicate items by MinHash signatures of their text and dHash of their
+    image. Candidates are found with locality sensitive hashing, bands of the signature
+    and bytes of the image hash, so items are only compared with their likely duplicates.
+    An item joins the first cluster whose representative it matches on every signal both
+    have, so clusters never chain across items that are not similar to each other.
+    """
+    def __init__(self,
+                 num_permutations: int = DEFAULT_NUM_PERMUTATIONS,
+                 bands: int = DEFAULT_BANDS,
+                 shingle_size: int = DEFAULT_SHINGLE_SIZE,
+                 min_similarity: float = DEFAULT_MIN_SIMILARITY,
+                 max_image_distance: int = DEFAULT_MAX_IMAGE_DISTANCE):
+        if num_permutations % bands != 0:
+            raise ValueError(f"num_permutations {num_permutations} is not a multiple of bands {bands}")
+        self.bands = bands
+        self.shingle_size = shingle_size
+        self.min_similarity = min_similarity
+        self.max_image_distance = max_image_distance
+        random = np.random.default_rng(MINHASH_SEED)
+        self.a = random.integers(1, MINHASH_PRIME, num_permutations, dtype=np.uint64)
+        self.b = random.integers(0, MINHASH_PRIME, num_permutations, dtype=np.uint64)
+
+        self.signatures: list[np.ndarray|None] = []
+        self.image_hashes: list[int|None] = []
+        self.representatives: list[int] = []
+        self.buckets: dict[tuple, list[int]] = defaultdict(list)
+
+    def add(self, text: str|None, image: Image.Image|None = None) -> int:
+        """Adds an item and returns the position of its cluster representative, possibly itself."""
+        position = len(self.signatures)
+        signature = self.get_signature(text) if text else None
+        image_hash = dhash(image) if image is not None else None
+        self.signatures.append(signature)
+        self.image_hashes.append(image_hash)
+
+        keys = self.get_bucket_keys(signature, image_hash)
+        representative = position
+        for candidate in dict.fromkeys(c for key in keys for c in self.buckets.get(key, [])):
+            if self.matches(position, candidate):
+                representative = candidate
+                break
+        if representative == position:
+            # only representatives are indexed, members are found through them
+            for key in keys:
+                self.buckets[key].append(position)
+        self.representatives.append(representative)
+        return representative
+
+    def get_clusters(self) -> dict[int, list[int]]:
+        """The positions of the items in each cluster, by the position of its representative."""
+        clusters: dict[int, list[int]] = defaultdict(list)
+        for position, representative in enumerate(self.representatives):
+            clusters[representative].append(position)
+        return dict(clusters)
+
+    def get_signature(self, text: str) -> np.ndarray:
+        shingles = np.fromiter(
+            (zlib.crc32(s.encode()) for s in get_shingles(text, self.shingle_size)), dtype=np.uint64)
+        return ((self.a[:, None] * shingles[None, :] + self.b[:, None]) % MINHASH_PRIME).min(axis=1)
+
+    def get_bucket_keys(self, signature: np.ndarray|None, image_hash: int|None) -> list[tuple]:
+        keys = []
+        if signature is not None:
+            keys.extend(("text", i, band.tobytes()) for i, band in enumerate(np.split(signature, self.bands)))
+        if image_hash is not None:
+            keys.extend(("image", i, (image_hash >> (i * 8)) & 0xFF) for i in range(IMAGE_BANDS))
+        return keys
+
+    def matches(self, left: int, right: int) -> bool:
+        compared = False
+        left_signature, right_signature = self.signatures[left], self.signatures[right]
+        if left_signature is not None and right_signature is not None:
+            if np.mean(left_signature == right_signature) < self.min_similarity:
+                return False
+            compared = True
+        left_hash, right_hash = self.image_hashes[left], self.image_hashes[right]
+        if left_hash is not None and right_hash is not None:
+            if (left_hash ^ right_hash).bit_count() > self.max_image_distance:
+                return False
+            compared = True
+        return compared
+
+
+def get_shingles(text: str, size: int) -> set[str]:
+    """The distinct character n-grams of the normalized text."""
+    text = WHITESPACE.sub(" ", text.lower()).strip()
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def dhash(image: Image.Image) -> int:
+    """
+    The 64 bit difference hash of an image, the sign of the horizontal gradients of a
+    9x8 grayscale thumbnail. Resizing, re-encoding and colour changes barely affect it.
+    """
+    if image.format == "JPEG":
+        image.draft("L", (IMAGE_HASH_SIZE * 4, IMAGE_HASH_SIZE * 4))
+    pixels = np.asarray(
+        image.convert("L").resize((IMAGE_HASH_SIZE + 1, IMAGE_HASH_SIZE), Image.Resampling.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
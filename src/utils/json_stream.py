@@ -0,0 +1,124 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+from typing import Any
+
+OPENERS = "{["
+CLOSERS = "}]"
+WHITESPACE = " \t\r\n"
+
+
+class IncrementalJSONParser():
+    """
+    Parses a streamed JSON document chunk by chunk, returning each top-level member as
+    soon as its value is complete: (key, value) for an object, or (index, value) for an
+    array. Text before the document (e.g. a markdown fence) is skipped.
+
+        parser = IncrementalJSONParser()
+        for chunk in stream:
+            for key, value in parser.feed(chunk):
+                ...
+    """
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0
+        self.started = False
+        self.finished = False
+        self.is_array = False
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_start = 0
+        self.key: str|int|None = None
+        self.expecting_key = False
+        self.value_start: int|None = None
+        self.member_done = False
+        self.index = 0
+
+    def feed(self, chunk: str) -> list[tuple[str|int, Any]]:
+        self.buffer += chunk
+        members = []
+        while self.position < len(self.buffer) and not self.finished:
+            member = self.step(self.buffer[self.position])
+            self.position += 1
+            if member is not None:
+                members.append(member)
+        return members
+
+    def step(self, char: str) -> tuple[str|int, Any]|None:
+        if not self.started:
+            if char in OPENERS:
+                self.started = True
+                self.is_array = char == "["
+                self.depth = 1
+                self.begin_member()
+            return None
+
+        if self.in_string:
+            if self.escape:
+                self.escape = False
+            elif char == "\\":
+                self.escape = True
+            elif char == '"':
+                self.in_string = False
+                if self.depth == 1 and self.expecting_key:
+                    self.key = json.loads(self.buffer[self.string_start:self.position + 1])
+                elif self.depth == 1 and self.value_start is not None:
+                    return self.complete(self.position + 1)
+            return None
+
+        if char == '"':
+            self.in_string = True
+            self.string_start = self.position
+            self.mark_value_start()
+        elif char in OPENERS:
+            self.mark_value_start()
+            self.depth += 1
+        elif char in CLOSERS:
+            self.depth -= 1
+            if self.depth == 1 and self.value_start is not None:
+                return self.complete(self.position + 1)
+            if self.depth == 0:
+                self.finished = True
+                if self.value_start is not None:
+                    return self.complete(self.position)
+        elif char == ":" and self.depth == 1 and not self.is_array:
+            self.expecting_key = False
+        elif char == "," and self.depth == 1:
+            member = self.complete(self.position) if self.value_start is not None else None
+            self.begin_member()
+            return member
+        elif char not in WHITESPACE:
+            self.mark_value_start()
+        return None
+
+    def begin_member(self) -> None:
+        self.key = None
+        self.value_start = None
+        self.member_done = False
+        self.expecting_key = not self.is_array
+
+    def mark_value_start(self) -> None:
+        if self.depth == 1 and not self.expecting_key and self.value_start is None and not self.member_done:
+            self.value_start = self.position
+
+    def complete(self, end: int) -> tuple[str|int, Any]:
+        """Decodes the value ending at end, once per member."""
+        value = json.loads(self.buffer[self.value_start:end])
+        key = self.index if self.is_array else self.key
+        if self.is_array:
+            self.index += 1
+        self.value_start = None
+        self.member_done = True
+        return key, value
@@ -0,0 +1,158 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import random
+import threading
+import time
+
+from opentelemetry import metrics
+
+SECONDS_PER_MINUTE = 60.0
+DEFAULT_DECREASE_FACTOR = 0.5
+DEFAULT_RECOVERY_FRACTION = 0.05
+DEFAULT_MIN_RATE_FRACTION = 0.05
+
+meter = metrics.get_meter(__name__)
+rate_gauge = meter.create_gauge(
+    "rate_limiter.requests_per_minute", description="The current, adapted, request rate of a limiter.")
+queue_depth_counter = meter.create_up_down_counter(
+    "rate_limiter.queue_depth", description="Callers waiting on a limiter.")
+throttled_time_counter = meter.create_counter(
+    "rate_limiter.throttled_time", unit="s", description="Time callers spent waiting on a limiter.")
+retry_counter = meter.create_counter(
+    "rate_limiter.retries", description="Calls retried after a quota or transient error.")
+
+
+class AdaptiveRateLimiter():
+    """
+    A pair of token buckets, requests per minute and (optionally) tokens per minute.
+    Callers reserve capacity and sleep until it is available, so waiting callers are
+    served in arrival order. When the service reports quota exhaustion the rate is cut
+    multiplicatively, and it recovers additively with each success (AIMD).
+    """
+    def __init__(self,
+                 name: str,
+                 requests_per_minute: float,
+                 tokens_per_minute: float|None = None,
+                 decrease_factor: float = DEFAULT_DECREASE_FACTOR,
+                 recovery_fraction: float = DEFAULT_RECOVERY_FRACTION,
+                 min_rate_fraction: float = DEFAULT_MIN_RATE_FRACTION):
+        self.name = name
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.decrease_factor = decrease_factor
+        self.recovery_fraction = recovery_fraction
+        self.min_rate_fraction = min_rate_fraction
+        self.rate_fraction = 1.0
+        self.request_balance = float(requests_per_minute)
+        self.token_balance = float(tokens_per_minute) if tokens_per_minute else 0.0
+        self.updated = time.monotonic()
+        self.waiting = 0
+        self.throttled_seconds = 0.0
+        self.quota_errors = 0
+        self.lock = threading.Lock()
+
+    def current_requests_per_minute(self) -> float:
+        return self.requests_per_minute * self.rate_fraction
+
+    def current_tokens_per_minute(self) -> float|None:
+        return self.tokens_per_minute * self.rate_fraction if self.tokens_per_minute else None
+
+    def reserve(self, tokens: int = 0) -> float:
+        """Takes one request and the tokens from the buckets, returning how long to wait before using them."""
+        with self.lock:
+            now = time.monotonic()
+            elapsed = now - self.updated
+            self.updated = now
+
+            request_rate = self.current_requests_per_minute() / SECONDS_PER_MINUTE
+            self.request_balance = min(self.request_balance + elapsed * request_rate, self.current_requests_per_minute())
+            self.request_balance -= 1
+            delay = -self.request_balance / request_rate if self.request_balance < 0 else 0.0
+
+            if self.tokens_per_minute:
+                token_rate = self.current_tokens_per_minute() / SECONDS_PER_MINUTE
+                self.token_balance = min(self.token_balance + elapsed * token_rate, self.current_tokens_per_minute())
+                self.token_balance -= min(tokens, self.current_tokens_per_minute())
+                if self.token_balance < 0:
+                    delay = max(delay, -self.token_balance / token_rate)
+            return delay
+
+    def acquire(self, tokens: int = 0) -> float:
+        """Blocks the calling thread until the request may be sent, returning the time throttled."""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            self.begin_wait()
+            try:
+                time.sleep(delay)
+            finally:
+                self.end_wait(delay)
+        return delay
+
+    async def acquire_async(self, tokens: int = 0) -> float:
+        """Waits, without blocking the event loop, until the request may be sent."""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            self.begin_wait()
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self.end_wait(delay)
+        return delay
+
+    def on_success(self) -> None:
+        with self.lock:
+            if self.rate_fraction < 1.0:
+                self.rate_fraction = min(1.0, self.rate_fraction + self.recovery_fraction)
+                rate_gauge.set(self.current_requests_per_minute(), {"limiter": self.name})
+
+    def on_quota_error(self) -> None:
+        with self.lock:
+            self.quota_errors += 1
+            self.rate_fraction = max(self.min_rate_fraction, self.rate_fraction * self.decrease_factor)
+            # drop any burst capacity so the reduced rate takes effect immediately
+            self.request_balance = min(self.request_balance, 0.0)
+            rate_gauge.set(self.current_requests_per_minute(), {"limiter": self.name})
+
+    def begin_wait(self) -> None:
+        with self.lock:
+            self.waiting += 1
+        queue_depth_counter.add(1, {"limiter": self.name})
+
+    def end_wait(self, delay: float) -> None:
+        with self.lock:
+            self.waiting -= 1
+            self.throttled_seconds += delay
+        queue_depth_counter.add(-1, {"limiter": self.name})
+        throttled_time_counter.add(delay, {"limiter": self.name})
+
+
+class RetryPolicy():
+    """Exponential backoff with full jitter, see https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/"""
+    def __init__(self,
+                 max_retries: int = 5,
+                 initial_backoff_seconds: float = 1.0,
+                 max_backoff_seconds: float = 60.0,
+                 multiplier: float = 2.0):
+        self.max_retries = max_retries
+        self.initial_backoff_seconds = initial_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.multiplier = multiplier
+
+    def backoff(self, attempt: int) -> float:
+        ceiling = min(self.max_backoff_seconds, self.initial_backoff_seconds * (self.multiplier ** attempt))
+        return random.uniform(0, ceiling)
+
+    def record_retry(self, name: str, reason: str) -> None:
+        retry_counter.add(1, {"limiter": name, "reason": reason})
@@ -0,0 +1,118 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import threading
+from concurrent.futures import CancelledError, Future
+from typing import Any, Awaitable, Callable, TypeVar
+
+from opentelemetry import metrics
+
+T = TypeVar("T")
+
+meter = metrics.get_meter(__name__)
+coalesced_counter = meter.create_counter(
+    "single_flight.coalesced", description="Calls that awaited an identical in-flight call instead of executing.")
+
+
+class SingleFlight():
+    """
+    Coalesces concurrent calls with the same key into a single execution. The first caller
+    (the leader) executes, every caller arriving while it is in flight awaits the leader's
+    result or exception. The in-flight call is a concurrent Future, so threads and event
+    loops share the same flights. A cancelled follower stops waiting without affecting the
+    others, and when the leader is cancelled a waiting follower takes over the call.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.flights: dict[str, Future] = {}
+        self.lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def join(self, key: str) -> tuple[Future, bool]:
+        """Returns the in-flight future for the key, and True if the caller is the leader."""
+        with self.lock:
+            future = self.flights.get(key)
+            if future is not None:
+                self.coalesced += 1
+                coalesced_counter.add(1, {"flight": self.name})
+                return future, False
+            future = Future()
+            self.flights[key] = future
+            self.executed += 1
+            return future, True
+
+    def land(self, key: str, future: Future, result: Any = None, error: BaseException|None = None) -> None:
+        with self.lock:
+            if self.flights.get(key) is future:
+                del self.flights[key]
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def abandon(self, key: str, future: Future) -> None:
+        """
+        Ends a flight whose leader was cancelled without giving its followers the
+        cancellation, they retry instead and one of them becomes the new leader.
+        """
+        with self.lock:
+            if self.flights.get(key) is future:
+                del self.flights[key]
+        future.cancel()
+
+    def do(self, key: str, func: Callable[[], T]) -> T:
+        while True:
+            future, leader = self.join(key)
+            if leader:
+                break
+            try:
+                return future.result()
+            except CancelledError:
+                continue
+        try:
+            result = func()
+        except BaseException as e:
+            self.land(key, future, error=e)
+            raise
+        self.land(key, future, result=result)
+        return result
+
+    async def do_async(self, key: str, func: Callable[[], Awaitable[T]]) -> T:
+        while True:
+            future, leader = self.join(key)
+            if leader:
+                break
+            try:
+                # shielded, so cancelling one follower leaves the shared future to the others
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            self.abandon(key, future)
+            raise
+        except BaseException as e:
+            self.land(key, future, error=e)
+            raise
+        self.land(key, future, result=result)
+        return result
+
+    def in_flight(self) -> int:
+        with self.lock:
+            return len(self.flights)
@@ -1,15 +1,176 @@
 # Copyright 2025 Google, LLC
-# 
+#
 # Licensed under the Apache License, Version 2.0 (the "License");
 # you may not use this file except in compliance with the License.
 # You may obtain a copy of the License at
-# 
+#
 #     https://www.apache.org/licenses/LICENSE-2.0
-# 
+#
 # Unless required by applicable law or agreed to in writing, software
 # distributed under the License is distributed on an "AS IS" BASIS,
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-# Coming soon.
+# Enriches the catalog of the [bigquery] origin_table into the output_table.
+import argparse
+import asyncio
+import functools
+import json
+import logging
+from typing import Any, Awaitable
+
+from commands.dedup import execute_deduplicated_batches
+from commands.main import (create_batch_enricher, language_extractor, product_completion,
+                           product_detection_from_image, product_enrichment_from_image)
+from model.batch_prediction import BatchPredictor
+from model.chain import BatchProgress, Command, Context
+from model.clients import get_bigquery_client, get_client_registry
+from model.config import Config
+from model.executor import shutdown_command_executor
+from model.sinks import close_sinks, get_streaming_insert_sink
+from model.sources import ROW_KEY, StorageReadSource, create_source
+from utils.logging import setup_logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_IN_FLIGHT = 16
+DEFAULT_BATCH_SIZE = 1000
+PROGRESS_EVERY = 1000
+
+
+def get_output_row(context: Context) -> dict[str, Any]:
+    """The output row of a context, its source row and product or errors as JSON."""
+    return {
+        "source": json.dumps(context.get(ROW_KEY), default=str),
+        "product": context.get("product_json"),
+        "errors": [str(e) for e in context.errors],
+    }
+
+
+def complete_written(source: StorageReadSource, context: Context, written: bool) -> None:
+    """
+    Marks the row of a context completed once the sink is done with its output row. A row
+    the sink dropped is logged with its source row and completed too, as the table would
+    reject it again after a restart, and holding it back would stop the checkpoint of
+    its stream from advancing while the rows completed after it pile up in memory.
+    """
+    if not written:
+        logger.error("the output of row %s was not written", json.dumps(context.get(ROW_KEY), default=str))
+    source.complete(context)
+
+
+async def write_output(source: StorageReadSource, sink: Any, context: Context) -> None:
+    """
+    Writes the output row of a completed context, which completes its row once written.
+    The sink blocks while its buffer is full, so the row is added from a thread.
+    """
+    if context.has_errors():
+        logger.warning("failed to enrich row %s: %s", context.get(ROW_KEY), context.errors[0])
+    await asyncio.to_thread(sink.put, [get_output_row(context)],
+                            on_written=functools.partial(complete_written, source, context))
+
+
+async def run(config: Config, chain: Command, source: StorageReadSource, sink: Any,
+              max_in_flight: int = DEFAULT_MAX_IN_FLIGHT, per_variant: Command|None = None) -> BatchProgress:
+    """
+    Streams the rows of the source through the chain, at most max_in_flight at once, and
+    writes every completed context to the sink. With [dedup] enabled, the chain runs once
+    per cluster of near-duplicate rows (see execute_deduplicated) and per_variant for every
+    other row of the cluster. A row is only marked completed once the sink is done with its
+    output, so the checkpoint never passes rows still buffered.
+    """
+    progress = BatchProgress()
+    contexts = execute_deduplicated_batches(chain, source.read_contexts(config), config.dedup.batch_size,
+                                            max_in_flight=max_in_flight, progress=progress, per_variant=per_variant)
+    try:
+        async for context in contexts:
+            await write_output(source, sink, context)
+            if progress.completed % PROGRESS_EVERY == 0:
+                logger.info("enriched %s", progress)
+    finally:
+        await asyncio.to_thread(sink.flush)
+        source.save_checkpoint()
+    return progress
+
+
+async def run_batch(config: Config, before: Command, predictor: BatchPredictor, after: Command,
+                    source: StorageReadSource, sink: Any, batch_size: int = DEFAULT_BATCH_SIZE,
+                    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT) -> BatchProgress:
+    """
+    Streams the rows of the source through the chain batch_size rows at a time, with the
+    prompt of the predictor executed as one batch job per batch instead of online requests:
+    the before chain runs for every row of the batch, the batch job for the rows without
+    errors, and the after chain for the rows the job generated a response for.
+    Rows are not deduplicated, as the batch job already halves the cost of every request.
+    """
+    progress = BatchProgress()
+
+    async def enrich(batch: list[Context]) -> None:
+        progress.submitted += len(batch)
+        prepared = [c async for c in before.execute_many(batch, max_in_flight=max_in_flight)]
+        predicted = predictor.execute_many([c for c in prepared if not c.has_errors()], then=after,
+                                           max_in_flight=max_in_flight)
+        for context in [c for c in prepared if c.has_errors()] + [c async for c in predicted]:
+            if context.has_errors():
+                progress.failed += 1
+            else:
+                progress.succeeded += 1
+            await write_output(source, sink, context)
+        logger.info("enriched %s", progress)
+
+    try:
+        batch = []
+        async for context in source.read_contexts(config):
+            batch.append(context)
+            if len(batch) == batch_size:
+                await enrich(batch)
+                batch = []
+        if len(batch) > 0:
+            await enrich(batch)
+    finally:
+        await asyncio.to_thread(sink.flush)
+        source.save_checkpoint()
+    return progress
+
+
+async def close_clients_after(work: Awaitable[BatchProgress]) -> BatchProgress:
+    """Awaits the work, then closes the clients in the event loop of their async transports."""
+    try:
+        return await work
+    finally:
+        await get_client_registry().aclose()
+
+
+def main():
+    """The main function of the worker"""
+    setup_logging()
+    parser = argparse.ArgumentParser(prog="worker", description="Enriches the products of a BigQuery table.")
+    parser.add_argument("-c", "--config", action="store", help="The TOML configuration file.", default="env.toml")
+    parser.add_argument("-m", "--max-in-flight", type=int, help="The products enriched at once.", default=DEFAULT_MAX_IN_FLIGHT)
+    parser.add_argument("-b", "--batch", action="store_true",
+                        help="Generates the product details with batch jobs instead of online requests.")
+    parser.add_argument("--batch-size", type=int, help="The products of each batch job.", default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    config = Config(args.config)
+    project_id = config.application.project_id
+    source = create_source(project_id, config.bigquery)
+    output_table = config.bigquery.get_table(config.bigquery.output_table, project_id)
+    sink = get_streaming_insert_sink(get_bigquery_client(), output_table)
+    try:
+        if args.batch:
+            work = run_batch(config, product_detection_from_image, create_batch_enricher(config),
+                             product_completion, source, sink, args.batch_size, args.max_in_flight)
+        else:
+            work = run(config, product_enrichment_from_image, source, sink, args.max_in_flight,
+                       per_variant=language_extractor)
+        progress = asyncio.run(close_clients_after(work))
+        print(f"Enriched {progress}")
+    finally:
+        close_sinks()
+        shutdown_command_executor()
+
+
+if __name__ == "__main__":
+    main()
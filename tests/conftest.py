@@ -12,10 +12,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from model.config import Config
+from model.config import Config, ContentGenerator, Embedding
+from model.examples import BaseProduct, Category, example_category, example_product
 import pytest
 import os
 import logging
+import asyncio
+from types import SimpleNamespace
+from google.genai import types
 from utils.logging import setup_logging, setup_tracer
 
 from opentelemetry import trace
@@ -37,6 +41,207 @@ def config() -> Config:
     os.environ['GCP_RUNTIME_ENV'] = 'test'
     config = Config("env.toml")
     yield config
-    
-        
 
+
+# The responses of the fake clients for a response schema
+SCHEMA_RESPONSES = {
+    Category: example_category.model_dump_json(),
+    BaseProduct: example_product.base.model_dump_json(),
+}
+
+
+def fake_response(text: str) -> SimpleNamespace:
+    """A response with usage metadata counting a token per 4 characters of the text."""
+    return SimpleNamespace(
+        text=text,
+        candidates=[SimpleNamespace(finish_reason=types.FinishReason.STOP)],
+        usage_metadata=types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=100, candidates_token_count=len(text) // 4))
+
+
+def fake_embeddings(contents: list[str]) -> SimpleNamespace:
+    """An embedding per text of its length and first character."""
+    return SimpleNamespace(embeddings=[SimpleNamespace(values=[len(t), ord(t[0]), 1.0]) for t in contents])
+
+
+class FakeModels():
+    """A stand-in for genai.Client.models that records calls instead of calling Gemini."""
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = []
+
+    def generate_content(self, model, config, contents):
+        self.calls.append(contents)
+        return fake_response(self.respond(config))
+
+    def embed_content(self, model, contents, config=None):
+        self.calls.append(contents)
+        return fake_embeddings(contents)
+
+    def count_tokens(self, model, contents):
+        self.calls.append(contents)
+        return SimpleNamespace(total_tokens=100)
+
+    def respond(self, config) -> str:
+        if config.response_schema is not None:
+            return SCHEMA_RESPONSES[config.response_schema]
+        return f"response {len(self.calls)}"
+
+    def generate_content_stream(self, model, config, contents):
+        self.calls.append(contents)
+        for chunk in self.stream_chunks:
+            yield fake_response(chunk)
+
+    # the chunks returned by generate_content_stream
+    stream_chunks = ["response ", "stream"]
+
+
+class FakeAsyncModels(FakeModels):
+    """A stand-in for genai.Client.aio.models."""
+    async def embed_content(self, model, contents, config=None):
+        self.calls.append(contents)
+        await asyncio.sleep(self.delay)
+        return fake_embeddings(contents)
+
+    async def generate_content(self, model, config, contents):
+        self.calls.append(contents)
+        await asyncio.sleep(self.delay)
+        return fake_response(self.respond(config))
+
+    async def generate_content_stream(self, model, config, contents):
+        self.calls.append(contents)
+
+        async def stream():
+            for chunk in self.stream_chunks:
+                await asyncio.sleep(self.delay)
+                yield fake_response(chunk)
+        return stream()
+
+
+class FakeAsyncFiles():
+    """A stand-in for genai.Client.aio.files, files are processing for the first processing_polls gets."""
+    def __init__(self, processing_polls: int = 1):
+        self.processing_polls = processing_polls
+        self.uploads = []
+        self.gets = []
+        self.deleted = []
+
+    async def upload(self, file, config=None):
+        self.uploads.append(file)
+        return types.File(name=f"files/{len(self.uploads)}", state=types.FileState.PROCESSING)
+
+    async def get(self, name):
+        self.gets.append(name)
+        polls = self.gets.count(name)
+        state = types.FileState.PROCESSING if polls < self.processing_polls else types.FileState.ACTIVE
+        return types.File(name=name, state=state)
+
+    async def delete(self, name):
+        self.deleted.append(name)
+
+
+class FakeCaches():
+    """A stand-in for genai.Client.caches recording the cached contents created, updated and deleted."""
+    def __init__(self):
+        self.created = []
+        self.updated = []
+        self.deleted = []
+
+    def create(self, model, config):
+        self.created.append(config)
+        return SimpleNamespace(name=f"cachedContents/{len(self.created)}")
+
+    def update(self, name, config):
+        self.updated.append(name)
+
+    def delete(self, name):
+        self.deleted.append(name)
+
+
+class FakeAsyncCaches(FakeCaches):
+    """A stand-in for genai.Client.aio.caches."""
+    async def create(self, model, config):
+        return super().create(model, config)
+
+    async def update(self, name, config):
+        super().update(name, config)
+
+    async def delete(self, name):
+        super().delete(name)
+
+
+def fake_client(delay: float = 0.0) -> SimpleNamespace:
+    return SimpleNamespace(models=FakeModels(delay), caches=FakeCaches(),
+                           aio=SimpleNamespace(models=FakeAsyncModels(delay), files=FakeAsyncFiles(),
+                                               caches=FakeAsyncCaches()))
+
+
+def fake_generator(settings: dict|None = None) -> ContentGenerator:
+    """A flash generator with a fake client, extra settings are applied before initialization."""
+    values = {
+        "model_name": "gemini-2.0-flash",
+        "instructions": "You are a retail merchandising expert.",
+        "ground_with_google": False,
+        "output_format": "application/json",
+        "temperature": 0.8,
+        "top_p": 0.5,
+        "top_k": 40,
+        "max_output_tokens": 8192,
+    }
+    values.update(settings or {})
+    generator = ContentGenerator(values)
+    generator.client = fake_client()
+    generator.initialize_cache("flash")
+    generator.initialize_rate_limiter("flash")
+    return generator
+
+
+def fake_embedding(settings: dict|None = None) -> Embedding:
+    """An embedding model with a fake client, extra settings are applied before initialization."""
+    values = {"model_name": "text-embedding-004", "task_type": "RETRIEVAL_DOCUMENT"}
+    values.update(settings or {})
+    embedding = Embedding(values)
+    embedding.client = fake_client()
+    embedding.initialize_cache()
+    embedding.initialize_rate_limiter()
+    return embedding
+
+
+@pytest.fixture
+def generator_factory():
+    """Creates flash generators with fake clients, see fake_generator."""
+    return fake_generator
+
+
+@pytest.fixture
+def embedding_factory():
+    """Creates embedding models with fake clients, see fake_embedding."""
+    return fake_embedding
+
+
+@pytest.fixture
+def client_factory():
+    """Creates fake genai clients, see fake_client."""
+    return fake_client
+
+
+@pytest.fixture
+def response_factory():
+    """Creates fake responses for a text, see fake_response."""
+    return fake_response
+
+
+@pytest.fixture
+def offline_config(tmp_path) -> Config:
+    """The project configuration with fake generator clients, for tests that must not call Gemini."""
+    with open("env.toml") as f:
+        toml = f.read().replace('api_key = ""', 'api_key = "offline"', 1)
+    # the caches, checkpoints and vocabulary of the test are kept apart from the working copy's
+    toml = toml.replace('".cache/', f'"{tmp_path / "cache"}/')
+    path = tmp_path / "offline.toml"
+    path.write_text(toml)
+    config = Config(str(path))
+    for generator in config.generative_ai.generators.values():
+        generator.client = fake_client(delay=0.05)
+    config.get_embedding().client = fake_client()
+    yield config
@@ -0,0 +1,92 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import pytest
+from PIL import Image
+
+from commands.main import content_enricher
+from model.batch_prediction import BatchExecutor, BatchPredictor, LocalBatchExecutor, parse_result_line
+from model.chain import Context
+from model.config import Config
+from model.examples import Category, example_category
+
+
+def respond(request: dict) -> str:
+    parts = request["contents"][0]["parts"]
+    if len(parts) < 2:
+        raise ValueError("cannot categorize without an image")
+    if "responseJsonSchema" not in request["generationConfig"]:
+        raise ValueError("expected a response schema")
+    return example_category.model_dump_json()
+
+
+@pytest.mark.asyncio
+async def test_batch_prediction_joins_results_and_resumes_chain(offline_config: Config, tmp_path):
+    work_dir = tmp_path / "batch"
+    work_dir.mkdir()
+    contexts = []
+    for sku in ["sku-1", "sku-2", "unknown"]:
+        context = Context(offline_config)
+        context.set("sku", sku)
+        if sku != "unknown":
+            context.set("product_image", Image.new("RGB", (8, 8), "white"))
+        contexts.append(context)
+
+    predictor = BatchPredictor(offline_config.get_generator_by_name("flash"),
+                               offline_config.get_prompt_by_name("category_detection"),
+                               output_variable_name="category_attributes",
+                               executor=LocalBatchExecutor(respond),
+                               image_variable_name="product_image",
+                               key_variable_name="sku",
+                               work_dir=str(work_dir),
+                               response_schema=Category,
+                               defaults={"known_categories": "[]"})
+
+    results = {c.get("sku"): c async for c in predictor.execute_many(contexts, then=content_enricher)}
+
+    assert results["sku-1"].get("category_attributes") == example_category.model_dump_json()
+    assert results["sku-1"].get("product").category == example_category
+    assert results["unknown"].has_errors()
+    assert results["unknown"].get("product_json") is None
+    assert list(work_dir.iterdir()) == []
+
+
+def test_requests_carry_the_generator_safety_settings_and_tools(offline_config: Config):
+    generator = offline_config.get_generator_by_name("flash")
+    generator.ground_with_google = True
+    predictor = BatchPredictor(generator, offline_config.get_prompt_by_name("category_detection"),
+                               output_variable_name="category_attributes", executor=LocalBatchExecutor(respond),
+                               defaults={"known_categories": "[]"})
+
+    request = predictor.build_request(Context(offline_config))
+
+    assert {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"} in request["safetySettings"]
+    assert len(request["safetySettings"]) == len(generator.get_generative_config().safety_settings)
+    assert request["tools"] == [{"googleSearch": {}}]
+
+
+def test_executors_must_implement_every_method():
+    class Incomplete(BatchExecutor):
+        def submit(self, generator, request_file):
+            return "job"
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_parse_result_line():
+    ok = parse_result_line({"key": "a", "response": {"candidates": [{"content": {"parts": [{"text": "x"}, {"text": "y"}]}}]}})
+    failed = parse_result_line({"key": "b", "error": {"code": 400}})
+
+    assert (ok.key, ok.text, ok.error) == ("a", "xy", None)
+    assert failed.error is not None
@@ -0,0 +1,79 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import threading
+import time
+
+import pytest
+
+from commands.big_query import BQEnrichmentCommand
+from model.chain import Context
+from model.config import Config
+
+BRANDS = {"Pronto Uomo": [{"brand": "Pronto Uomo", "country": "US"}], "Acme": [{"brand": "Acme", "country": "CA"}]}
+
+
+class FakeBigQuery():
+    """A stand-in for bigquery.Client.query_and_wait answering brand lookups."""
+    def __init__(self, delay: float = 0.05):
+        self.delay = delay
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def query_and_wait(self, query, job_config=None):
+        parameters = {p.name: p.value for p in job_config.query_parameters}
+        with self.lock:
+            self.queries.append((query, parameters))
+        time.sleep(self.delay)
+        return BRANDS.get(parameters["brand"], [])
+
+
+def brand_lookup(client: FakeBigQuery) -> BQEnrichmentCommand:
+    return BQEnrichmentCommand("brand-lookup", "project", "retail", "brands", "WHERE brand = @brand", "brand_details",
+                               parameters={"brand": "product_brand"}, columns=["brand", "country"], client=client)
+
+
+def brand_context(config: Config, brand: str) -> Context:
+    context = Context(config)
+    context.set("product_brand", brand)
+    return context
+
+
+@pytest.mark.asyncio
+async def test_lookups_bind_parameters_and_project_columns(offline_config: Config):
+    client = FakeBigQuery(delay=0.0)
+    context = brand_context(offline_config, "Acme' OR '1'='1")
+
+    await brand_lookup(client).execute(context)
+
+    query, parameters = client.queries[0]
+    assert query == "SELECT `brand`, `country` FROM `project.retail.brands` WHERE brand = @brand"
+    assert parameters == {"brand": "Acme' OR '1'='1"}
+    assert json.loads(context.get("brand_details")) == []
+
+
+@pytest.mark.asyncio
+async def test_concurrent_lookups_share_one_query_and_are_cached(offline_config: Config):
+    client = FakeBigQuery()
+    command = brand_lookup(client)
+    contexts = [brand_context(offline_config, brand) for brand in ["Pronto Uomo"] * 8 + ["Acme"] * 8]
+
+    results = [c async for c in command.execute_many(contexts, max_in_flight=16)]
+    again = brand_context(offline_config, "Acme")
+    await command.execute(again)
+
+    assert len(client.queries) == 2
+    assert all(not c.has_errors() for c in results)
+    assert json.loads(contexts[0].get("brand_details")) == BRANDS["Pronto Uomo"]
+    assert json.loads(again.get("brand_details")) == BRANDS["Acme"]
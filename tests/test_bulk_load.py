@@ -0,0 +1,133 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import importlib.util
+import json
+import os
+
+import pytest
+
+from google.api_core.exceptions import Conflict
+
+from model.bulk_load import (FORMAT_PARQUET, MANIFEST_FILE_NAME, PART_SUFFIX, STATE_LOADED, BigQueryLoader,
+                             BulkLoadSink, LoadError, LoadManifest, LocalLoader, get_job_id)
+
+TABLE = "project.dataset.products"
+
+
+class FailingLoader(LocalLoader):
+    """Fails every load, as a process stopping before its loads finished would."""
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.attempts = []
+
+    def load(self, path, table, file_format, schema, attempt=0):
+        self.attempts.append(attempt)
+        raise RuntimeError("load job failed")
+
+
+class FakeJob():
+    def __init__(self, error_result=None):
+        self.error_result = error_result
+
+    def done(self):
+        return True
+
+    def result(self):
+        if self.error_result is not None:
+            raise RuntimeError(self.error_result["message"])
+
+
+class FakeBigQuery():
+    """A stand-in for bigquery.Client load jobs, with the jobs that already exist by id."""
+    def __init__(self, jobs: dict[str, FakeJob]):
+        self.jobs = dict(jobs)
+        self.created = []
+
+    def load_table_from_file(self, f, table, job_id=None, job_config=None):
+        if job_id in self.jobs:
+            raise Conflict(f"job {job_id} exists")
+        self.created.append(job_id)
+        self.jobs[job_id] = FakeJob()
+        return self.jobs[job_id]
+
+    def get_job(self, job_id):
+        return self.jobs[job_id]
+
+
+def test_files_are_rotated_and_loaded(tmp_path):
+    loader = LocalLoader(str(tmp_path / "bigquery"))
+    sink = BulkLoadSink(loader, TABLE, str(tmp_path / "files"), max_file_bytes=100, max_loads_in_flight=2)
+
+    for i in range(20):
+        sink.put([{"id": i, "name": f"product {i}"}])
+    sink.close()
+
+    assert sorted(r["id"] for r in loader.read_rows(TABLE)) == list(range(20))
+    assert len(os.listdir(tmp_path / "bigquery" / TABLE)) > 1
+    manifest = LoadManifest(str(tmp_path / "files" / MANIFEST_FILE_NAME))
+    assert len(manifest.states) > 1 and set(manifest.states.values()) == {STATE_LOADED}
+    # loaded files are removed, only the manifest is left
+    assert os.listdir(tmp_path / "files") == [MANIFEST_FILE_NAME]
+
+
+def test_unloaded_files_are_loaded_once_after_a_restart(tmp_path):
+    directory = str(tmp_path / "files")
+    failing = FailingLoader(str(tmp_path / "bigquery"))
+    failed = BulkLoadSink(failing, TABLE, directory)
+    failed.put([{"id": 1}, {"id": 2}])
+    with pytest.raises(LoadError):
+        failed.close()
+    with pytest.raises(LoadError):
+        BulkLoadSink(failing, TABLE, directory).close()
+    assert failing.attempts == [0, 1]
+    # a file being written when the process stopped, with a partial last row
+    with open(os.path.join(directory, f"{TABLE}-1-abc.ndjson{PART_SUFFIX}"), "w") as f:
+        f.write(json.dumps({"id": 3}) + "\n" + '{"id": ')
+
+    loader = LocalLoader(str(tmp_path / "bigquery"))
+    BulkLoadSink(loader, TABLE, directory).close()
+    BulkLoadSink(loader, TABLE, directory).close()
+
+    assert sorted(r["id"] for r in loader.read_rows(TABLE)) == [1, 2, 3]
+
+
+def test_failed_jobs_are_not_reused(tmp_path):
+    path = tmp_path / f"{TABLE}-1-abc.ndjson"
+    path.write_text(json.dumps({"id": 1}) + "\n")
+    client = FakeBigQuery({get_job_id(TABLE, str(path)): FakeJob({"message": "schema mismatch"})})
+
+    BigQueryLoader(client).load(str(path), TABLE, "NDJSON", None)
+
+    assert client.created == [get_job_id(TABLE, str(path), 1)]
+
+
+def test_succeeded_jobs_are_reused(tmp_path):
+    path = tmp_path / f"{TABLE}-1-abc.ndjson"
+    path.write_text(json.dumps({"id": 1}) + "\n")
+    client = FakeBigQuery({get_job_id(TABLE, str(path)): FakeJob()})
+
+    BigQueryLoader(client).load(str(path), TABLE, "NDJSON", None)
+
+    assert client.created == []
+
+
+@pytest.mark.skipif(importlib.util.find_spec("pyarrow") is None, reason="pyarrow is not installed")
+def test_parquet_files_are_loaded(tmp_path):
+    loader = LocalLoader(str(tmp_path / "bigquery"))
+    sink = BulkLoadSink(loader, TABLE, str(tmp_path / "files"), file_format=FORMAT_PARQUET)
+
+    sink.put([{"id": 1, "name": "shirt"}])
+    sink.close()
+
+    assert loader.read_rows(TABLE) == [{"id": 1, "name": "shirt"}]
@@ -0,0 +1,172 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import threading
+import time
+
+import pytest
+from PIL import Image
+from pydantic import ValidationError
+
+from model.examples import Category
+from utils.cache import LRUCache, SqliteCache, TieredCache
+
+
+def test_lru_evicts_by_entries_bytes_and_ttl():
+    cache = LRUCache(max_entries=2, max_bytes=10)
+    cache.put("a", b"1234")
+    cache.put("b", b"1234")
+    cache.get("a")
+    cache.put("c", b"1234")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1234"
+
+    cache.put("d", b"12345678")
+    assert cache.size <= 10
+
+    cache.put("e", b"1", ttl_seconds=0.01)
+    time.sleep(0.02)
+    assert cache.get("e") is None
+
+
+def test_sqlite_cache_persists_and_evicts(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = SqliteCache(path, max_bytes=8)
+    cache.put("a", b"1234")
+    cache.put("b", b"1234")
+    cache.get("a")
+    cache.put("c", b"1234")
+    cache.close()
+
+    reopened = SqliteCache(path, max_bytes=8)
+    assert reopened.get("a") == b"1234"
+    assert reopened.get("b") is None
+    assert reopened.get("c") == b"1234"
+
+
+def test_sqlite_cache_hits_do_not_write(tmp_path):
+    cache = SqliteCache(str(tmp_path / "cache.db"))
+    cache.put("a", b"1234")
+    changes = cache.connection.total_changes
+
+    for _ in range(10):
+        assert cache.get("a") == b"1234"
+
+    assert cache.connection.total_changes == changes
+    assert list(cache.accessed) == ["a"]
+
+
+def test_sqlite_cache_evicts_by_the_size_of_every_process(tmp_path):
+    path = str(tmp_path / "cache.db")
+    first = SqliteCache(path, max_bytes=10)
+    second = SqliteCache(path, max_bytes=10)
+    first.put("a", b"1234")
+    second.put("b", b"1234")
+    first.put("c", b"1234")
+
+    assert (first.size, second.size) == (8, 8)
+    assert second.get("a") is None
+    assert first.get("b") == b"1234"
+
+
+def test_tiered_cache_promotes_disk_hits(tmp_path):
+    disk = SqliteCache(str(tmp_path / "cache.db"))
+    disk.put("a", b"value")
+    cache = TieredCache("test", LRUCache(), disk)
+
+    assert cache.get("a") == b"value"
+    assert cache.get("a") == b"value"
+    assert cache.get("b") is None
+    assert (cache.stats.disk_hits, cache.stats.memory_hits, cache.stats.misses) == (1, 1, 1)
+
+
+def test_tiered_cache_gets_many_from_memory_then_disk(tmp_path):
+    disk = SqliteCache(str(tmp_path / "cache.db"))
+    disk.put("b", b"disk")
+    disk.put("expired", b"value", ttl_seconds=-1)
+    cache = TieredCache("test", LRUCache(), disk)
+    cache.put_memory("a", b"memory", None)
+
+    values = cache.get_many(["a", "b", "c", "expired"])
+
+    assert values == {"a": b"memory", "b": b"disk"}
+    assert (cache.stats.memory_hits, cache.stats.disk_hits, cache.stats.misses) == (1, 1, 2)
+    assert cache.memory.get("b") == b"disk"
+
+
+class ThreadRecordingCache(SqliteCache):
+    """Records the threads the SQLite store is accessed from."""
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.threads = []
+
+    def get(self, key):
+        self.threads.append(threading.current_thread())
+        return super().get(key)
+
+    def put(self, key, value, ttl_seconds=None):
+        self.threads.append(threading.current_thread())
+        super().put(key, value, ttl_seconds)
+
+
+@pytest.mark.asyncio
+async def test_async_generation_keeps_sqlite_off_the_event_loop(tmp_path, generator_factory):
+    generator = generator_factory({"cache": {"enabled": True}})
+    disk = ThreadRecordingCache(str(tmp_path / "responses.db"))
+    generator.response_cache.disk = disk
+
+    first = await generator.generate_content_async("Describe")
+    generator.response_cache.memory = LRUCache()
+    second = await generator.generate_content_async("Describe")
+
+    assert first == second
+    assert generator.response_cache.stats.disk_hits == 1
+    assert len(disk.threads) == 3
+    assert threading.current_thread() not in disk.threads
+
+
+def test_generator_caches_identical_requests(tmp_path, generator_factory):
+    generator = generator_factory({"cache": {"enabled": True, "path": str(tmp_path / "responses.db")}})
+    image = Image.new("RGB", (8, 8), "red")
+
+    first = generator.understand_image("Describe", image)
+    second = generator.understand_image("Describe", image.copy())
+    third = generator.understand_image("Describe", Image.new("RGB", (8, 8), "blue"))
+
+    assert first == second
+    assert third != first
+    assert len(generator.client.models.calls) == 2
+    assert generator.response_cache.stats.hits == 1
+
+
+def test_generator_does_not_cache_invalid_responses(tmp_path, generator_factory):
+    generator = generator_factory({"cache": {"enabled": True, "path": str(tmp_path / "responses.db")}})
+    generator.client.models.respond = lambda config: '{"name": "truncated'
+
+    for _ in range(2):
+        with pytest.raises(ValidationError):
+            generator.generate_content("Describe", response_schema=Category)
+
+    assert len(generator.client.models.calls) == 2
+    assert generator.response_cache.stats.hits == 0
+
+
+def test_generator_without_cache_always_calls_the_model(generator_factory):
+    generator = generator_factory()
+
+    generator.generate_content("Tell me a joke.")
+    generator.generate_content("Tell me a joke.")
+
+    assert generator.response_cache is None
+    assert len(generator.client.models.calls) == 2
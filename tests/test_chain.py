@@ -0,0 +1,202 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import threading
+import time
+
+import pytest
+
+from model.chain import BatchProgress, Chain, Command, Context, GraphChain, run_batch
+from model.executor import get_command_executor
+
+
+@pytest.mark.asyncio
+async def test_sync_command_runs_off_the_event_loop():
+    loop_thread = threading.get_ident()
+
+    def blocking(context: Context) -> None:
+        time.sleep(0.05)
+        context.set("thread", threading.get_ident())
+
+    context = Context(None)
+    await Command("blocking", blocking).execute(context)
+
+    assert context.get("thread") != loop_thread
+    timing = get_command_executor().get_timing("blocking")
+    assert timing.count >= 1
+    assert timing.max_run_time >= 0.05
+
+
+@pytest.mark.asyncio
+async def test_async_command_runs_natively():
+    loop_thread = threading.get_ident()
+
+    async def native(context: Context) -> None:
+        await asyncio.sleep(0)
+        context.set("thread", threading.get_ident())
+
+    context = Context(None)
+    await Command("native", native).execute(context)
+
+    assert context.get("thread") == loop_thread
+    assert get_command_executor().get_timing("native").count >= 1
+
+
+@pytest.mark.asyncio
+async def test_blocking_commands_do_not_stall_each_other():
+    def slow(context: Context) -> None:
+        time.sleep(0.2)
+
+    chains = [Chain(f"chain-{i}", Command("slow", slow)) for i in range(4)]
+    started = time.perf_counter()
+    await asyncio.gather(*[c.execute(Context(None)) for c in chains])
+
+    assert time.perf_counter() - started < 0.6
+
+
+def recording_command(name: str, log: list, reads: list[str], writes: list[str], delay: float = 0.1) -> Command:
+    async def run(context: Context) -> None:
+        log.append(("start", name))
+        await asyncio.sleep(delay)
+        for key in writes:
+            context.set(key, name)
+        log.append(("finish", name))
+    return Command(name, run, reads=reads, writes=writes)
+
+
+def test_graph_chain_dependencies():
+    a = Command("a", None, reads=["image"], writes=["category"])
+    b = Command("b", None, reads=["category"], writes=["product"])
+    c = Command("c", None, reads=["image"], writes=["thumbnail"])
+    d = Command("d", None)
+    chain = GraphChain("graph", a, b, c, d)
+
+    assert chain.get_dependencies() == [set(), {0}, set(), {0, 1, 2}]
+
+
+@pytest.mark.asyncio
+async def test_graph_chain_runs_independent_commands_concurrently():
+    log = []
+    chain = GraphChain("graph",
+                       recording_command("detect", log, ["image"], ["category"]),
+                       recording_command("enrich", log, ["category"], ["product"]),
+                       recording_command("translate_fr", log, ["product"], ["language_fr"]),
+                       recording_command("translate_de", log, ["product"], ["language_de"]),
+                       recording_command("persist", log, ["image"], ["image_uri"]))
+    context = Context(None)
+    started = time.perf_counter()
+    await chain.execute(context)
+
+    # critical path is detect -> enrich -> translate, i.e. three steps not five
+    assert time.perf_counter() - started < 0.45
+    assert log.index(("finish", "detect")) < log.index(("start", "enrich"))
+    assert log.index(("finish", "enrich")) < log.index(("start", "translate_fr"))
+    assert log.index(("start", "persist")) < log.index(("finish", "detect"))
+    assert context.get("language_de") == "translate_de"
+
+
+@pytest.mark.asyncio
+async def test_graph_chain_respects_concurrency_cap():
+    active = []
+    peak = []
+
+    async def run(context: Context) -> None:
+        active.append(1)
+        peak.append(len(active))
+        await asyncio.sleep(0.01)
+        active.pop()
+
+    commands = [Command(f"c{i}", run, reads=[], writes=[f"k{i}"]) for i in range(6)]
+    await GraphChain("capped", *commands, max_concurrency=2).execute(Context(None))
+
+    assert max(peak) == 2
+
+
+@pytest.mark.asyncio
+async def test_graph_chain_propagates_errors():
+    async def fail(context: Context) -> None:
+        raise ValueError("boom")
+
+    chain = GraphChain("failing", Command("fail", fail, reads=[], writes=["x"]))
+    with pytest.raises(ValueError):
+        await chain.execute(Context(None))
+
+
+@pytest.mark.asyncio
+async def test_execute_many_bounds_in_flight_and_isolates_errors():
+    active = []
+    peak = []
+
+    async def enrich(context: Context) -> None:
+        active.append(1)
+        peak.append(len(active))
+        await asyncio.sleep(0.01)
+        active.pop()
+        if context.get("id") % 5 == 0:
+            raise ValueError("bad product")
+        context.set("done", True)
+
+    async def source():
+        for i in range(20):
+            context = Context(None)
+            context.set("id", i)
+            yield context
+
+    progress = BatchProgress()
+    results = [c async for c in Chain("batch", Command("enrich", enrich)).execute_many(source(), max_in_flight=3, progress=progress)]
+
+    assert len(results) == 20
+    assert max(peak) == 3
+    assert progress.succeeded == 16
+    assert progress.failed == 4
+    assert progress.in_flight == 0
+    assert progress.throughput() > 0
+    assert all(isinstance(c.errors[0], ValueError) for c in results if c.get("id") % 5 == 0)
+    assert all(c.get("done") for c in results if c.get("id") % 5 != 0)
+
+
+@pytest.mark.asyncio
+async def test_closing_execute_many_waits_for_the_cancelled_commands():
+    cancelled = []
+
+    async def enrich(context: Context) -> None:
+        try:
+            await asyncio.sleep(0 if context.get("id") == 0 else 10)
+        except asyncio.CancelledError:
+            await asyncio.sleep(0.01)
+            cancelled.append(context.get("id"))
+            raise
+
+    contexts = []
+    for i in range(3):
+        context = Context(None)
+        context.set("id", i)
+        contexts.append(context)
+    results = Command("enrich", enrich).execute_many(contexts, max_in_flight=3)
+
+    assert (await anext(results)).get("id") == 0
+    await results.aclose()
+
+    assert sorted(cancelled) == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_run_batch_accepts_plain_iterables():
+    def enrich(context: Context) -> None:
+        context.set("done", True)
+
+    results = await run_batch(Command("enrich", enrich), [Context(None) for _ in range(5)], max_in_flight=2)
+
+    assert len(results) == 5
+    assert all(c.get("done") for c in results)
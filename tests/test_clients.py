@@ -0,0 +1,176 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import importlib.util
+import logging
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from commands.big_query import BQPersistenceCommand
+from model.chain import Context
+from model.clients import ClientRegistry, PoolSettings, get_client_registry, is_http2_available
+from model.config import Config
+
+
+def test_clients_are_shared_per_credential_and_endpoint():
+    registry = ClientRegistry()
+    settings = PoolSettings(max_connections=10)
+
+    first = registry.get_client("key-1", settings)
+    second = registry.get_client("key-1", PoolSettings(max_connections=10))
+    other_key = registry.get_client("key-2", settings)
+    other_endpoint = registry.get_client("key-1", PoolSettings(max_connections=10, base_url="https://example.com/"))
+
+    assert first.get() is second.get()
+    assert first.get() is not other_key.get()
+    assert first.get() is not other_endpoint.get()
+    assert registry.created == 3
+
+
+def test_clients_are_created_on_first_use():
+    registry = ClientRegistry()
+    handle = registry.get_client("key")
+
+    assert registry.created == 0
+    handle.get()
+    assert registry.created == 1
+
+
+def test_cloud_clients_are_shared_and_reset_after_fork():
+    registry = ClientRegistry()
+    created = []
+    factory = lambda: created.append(object()) or created[-1]
+
+    first = registry.get_cloud_client("bigquery", factory)
+    assert registry.get_cloud_client("bigquery", factory) is first
+
+    registry.reset_after_fork()
+
+    assert registry.get_cloud_client("bigquery", factory) is not first
+    assert first in registry.inherited
+    assert len(created) == 2
+
+
+@pytest.mark.asyncio
+async def test_aclose_closes_the_async_transports():
+    registry = ClientRegistry()
+    closed = []
+
+    async def aclose():
+        closed.append("genai.aio")
+
+    registry.clients[("key",)] = SimpleNamespace(aio=SimpleNamespace(aclose=aclose), close=lambda: closed.append("genai"))
+    registry.get_cloud_client("bigquery", lambda: SimpleNamespace(close=lambda: closed.append("bigquery")))
+
+    await registry.aclose()
+
+    assert closed == ["genai.aio", "genai", "bigquery"]
+    assert registry.clients == {} and registry.cloud_clients == {}
+
+
+def test_http2_without_h2_is_disabled_with_a_warning(monkeypatch, caplog):
+    find_spec = importlib.util.find_spec
+    monkeypatch.setattr(importlib.util, "find_spec", lambda name: None if name == "h2" else find_spec(name))
+    is_http2_available.cache_clear()
+    try:
+        with caplog.at_level(logging.WARNING):
+            settings = [PoolSettings(http2=True) for _ in range(3)]
+    finally:
+        is_http2_available.cache_clear()
+
+    assert not any(s.http2 for s in settings)
+    assert caplog.text.count("h2 package is not installed") == 1
+
+
+def test_existence_is_checked_once_and_failures_are_retried():
+    registry = ClientRegistry()
+    calls = []
+
+    def create():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ConnectionError("unavailable")
+
+    with pytest.raises(ConnectionError):
+        registry.ensure_exists("storage.bucket", "images", create)
+    threads = [threading.Thread(target=registry.ensure_exists, args=("storage.bucket", "images", create)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 2
+
+
+def test_tables_are_created_once_across_commands(monkeypatch, offline_config: Config):
+    class FakeBigQuery():
+        def __init__(self):
+            self.created = []
+
+        def schema_from_json(self, fp):
+            return []
+
+        def create_table(self, table, exists_ok=False):
+            self.created.append(table.table_id)
+
+    client = FakeBigQuery()
+    registry = get_client_registry()
+    monkeypatch.setitem(registry.cloud_clients, "bigquery", client)
+    monkeypatch.setattr(registry, "resources", set())
+    commands = [BQPersistenceCommand(f"persist_{i}", "rows", "project", "dataset", "products", "[]",
+                                     create_table_if_not_exists=True) for i in range(2)]
+    assert client.created == []
+
+    for command in commands:
+        command.do_execute(Context(offline_config))
+
+    assert client.created == ["products"]
+
+
+def test_concurrent_lookups_create_one_client():
+    registry = ClientRegistry()
+    clients = []
+    threads = [threading.Thread(target=lambda: clients.append(registry.get_client("key").get())) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert registry.created == 1
+    assert all(c is clients[0] for c in clients)
+
+
+def test_handles_resolve_a_new_client_after_fork():
+    registry = ClientRegistry()
+    handle = registry.get_client("key")
+    parent = handle.get()
+
+    registry.reset_after_fork()
+
+    assert handle.get() is not parent
+    assert parent in registry.inherited
+
+
+def test_generators_share_one_client(tmp_path):
+    with open("env.toml") as f:
+        toml = f.read().replace('api_key = ""', 'api_key = "offline"', 1)
+    path = tmp_path / "offline.toml"
+    path.write_text(toml)
+
+    config = Config(str(path))
+    clients = {g.client.get() for g in config.generative_ai.generators.values()}
+    clients.add(config.get_embedding().client.get())
+
+    assert len(clients) == 1
@@ -0,0 +1,185 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import pytest
+from google.genai import errors
+from PIL import Image
+
+from commands.enrichment import category_detection_from_image, extract_product_details
+from model.chain import Context
+from model.config import Config
+from model.examples import Category
+from model.vocabulary import CategoryVocabulary
+
+
+class RecordingModels():
+    def __init__(self, response_factory):
+        self.response_factory = response_factory
+        self.requests = []
+
+    def generate_content(self, model, config, contents):
+        self.requests.append((config, contents))
+        return self.response_factory("ok")
+
+
+@pytest.fixture
+def caching_generator(generator_factory, response_factory):
+    """Creates generators caching prefixes of at least 10 characters in fake caches."""
+    def create(max_entries: int = 256):
+        generator = generator_factory({"context_cache": {"enabled": True, "min_prefix_chars": 10, "ttl_seconds": 600,
+                                                         "max_entries": max_entries}})
+        generator.client.models = RecordingModels(response_factory)
+        return generator
+    return create
+
+
+def test_large_prefix_is_cached_once_and_reused(caching_generator):
+    generator = caching_generator()
+    schema = "category attributes " * 10
+
+    generator.generate_content("product one", prefix=schema)
+    generator.generate_content("product two", prefix=schema)
+
+    caches = generator.client.caches
+    assert len(caches.created) == 1
+    assert caches.created[0].contents == [schema]
+    assert caches.created[0].system_instruction == generator.instructions
+    config, contents = generator.client.models.requests[1]
+    assert config.cached_content == "cachedContents/1"
+    assert config.system_instruction is None
+    assert contents == ["product two"]
+
+
+def test_small_prefix_is_sent_inline(caching_generator):
+    generator = caching_generator()
+
+    generator.generate_content("product", prefix="small")
+
+    config, contents = generator.client.models.requests[0]
+    assert generator.client.caches.created == []
+    assert config.cached_content is None
+    assert contents == ["small", "product"]
+
+
+def test_expiring_handle_is_refreshed(caching_generator):
+    generator = caching_generator()
+    schema = "category attributes " * 10
+    generator.generate_content("product one", prefix=schema)
+
+    for entry in generator.context_cache_manager.entries.values():
+        entry.expires -= 590
+    generator.generate_content("product two", prefix=schema)
+
+    assert generator.client.caches.updated == ["cachedContents/1"]
+    assert len(generator.client.caches.created) == 1
+
+
+def test_config_change_invalidates_handles(caching_generator):
+    generator = caching_generator()
+    schema = "category attributes " * 10
+    generator.generate_content("product one", prefix=schema)
+
+    generator.updateValues({"instructions": "You are a copywriter."})
+    generator.generate_content("product two", prefix=schema)
+
+    caches = generator.client.caches
+    assert caches.deleted == ["cachedContents/1"]
+    assert len(caches.created) == 2
+    assert caches.created[1].system_instruction == "You are a copywriter."
+
+
+def test_least_recently_used_handle_is_evicted(caching_generator):
+    generator = caching_generator(max_entries=2)
+    schemas = [f"category {i} attributes " * 10 for i in range(3)]
+
+    generator.generate_content("product one", prefix=schemas[0])
+    generator.generate_content("product two", prefix=schemas[1])
+    generator.generate_content("product three", prefix=schemas[0])
+    generator.generate_content("product four", prefix=schemas[2])
+
+    assert generator.client.caches.deleted == ["cachedContents/2"]
+    assert len(generator.context_cache_manager.entries) == 2
+
+
+@pytest.mark.asyncio
+async def test_async_path_deletes_through_the_async_client(caching_generator):
+    generator = caching_generator()
+    schema = "category attributes " * 10
+    await generator.context_cache_manager.get_async(generator, schema)
+
+    generator.updateValues({"instructions": "You are a copywriter."})
+    await generator.context_cache_manager.get_async(generator, schema)
+    await generator.context_cache_manager.clear_async(generator)
+
+    caches = generator.client.aio.caches
+    assert caches.deleted == ["cachedContents/1", "cachedContents/2"]
+    assert generator.client.caches.deleted == []
+
+
+def detected_category(name: str) -> Category:
+    """A category the size detection returns, with 60 attributes."""
+    return Category.model_validate({"name": name, "attributes": [
+        {"name": f"Attribute {i}", "description": f"The {i}th retail selling or supply chain attribute of the product.",
+         "value_range": ["small", "medium", "large"]} for i in range(60)]})
+
+
+@pytest.mark.asyncio
+async def test_shipped_prompts_send_the_category_as_cached_content(offline_config: Config):
+    flash = offline_config.get_generator_by_name("flash")
+    category = detected_category("Clothing > Men's Clothing > Men's Shirts > Dress Shirts")
+    contexts = []
+    for _ in range(2):
+        context = Context(offline_config)
+        context.set("category", category)
+        context.set("category_attributes", category.model_dump_json())
+        contexts.append(context)
+
+    for context in contexts:
+        await extract_product_details(context)
+
+    caches = flash.client.aio.caches
+    assert len(caches.created) == 1
+    assert category.model_dump_json() in caches.created[0].contents[0]
+    assert all(category.model_dump_json() not in str(call) for call in flash.client.aio.models.calls)
+
+
+@pytest.mark.asyncio
+async def test_shipped_detection_prompt_sends_the_known_categories_as_cached_content(offline_config: Config):
+    flash = offline_config.get_generator_by_name("flash")
+    vocabulary = CategoryVocabulary()
+    vocabulary.add([detected_category(f"Clothing > Shirts > Kind {i}") for i in range(3)], [[1.0, 0.0], [0.0, 1.0], [1.0, 1.0]])
+    offline_config.vocabulary.categories = vocabulary
+    context = Context(offline_config)
+    context.set("product_image", Image.new("RGB", (8, 8), "white"))
+
+    await category_detection_from_image(context)
+
+    assert len(flash.client.aio.caches.created) == 1
+    assert flash.client.aio.caches.created[0].contents == [
+        offline_config.get_prompt_by_name("category_detection").render_prefix(context, {"known_categories": vocabulary.to_json()})]
+
+
+def test_prefix_the_service_refuses_is_sent_inline(caching_generator):
+    generator = caching_generator()
+    schema = "category attributes " * 10
+
+    def refuse(model, config):
+        raise errors.ClientError(400, {"error": {"code": 400, "status": "INVALID_ARGUMENT", "message": "too small"}})
+
+    generator.client.caches.create = refuse
+    generator.generate_content("product one", prefix=schema)
+    generator.generate_content("product two", prefix=schema)
+
+    config, contents = generator.client.models.requests[1]
+    assert config.cached_content is None
+    assert contents == [schema, "product two"]
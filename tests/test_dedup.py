@@ -0,0 +1,134 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+
+import pytest
+from PIL import Image, ImageDraw
+
+from commands.dedup import execute_deduplicated, execute_deduplicated_batches
+from commands.main import language_extractor, product_enrichment_from_image
+from model.chain import BatchProgress, Command, Context
+from model.config import Config
+from model.examples import BaseProduct
+from utils.dedup import NearDuplicateIndex, dhash
+
+DESCRIPTION = "A long sleeve dress shirt in stretch cotton with a spread collar and a slim fit."
+
+
+def shirt_image(colour: str, size: int = 256) -> Image.Image:
+    image = Image.new("RGB", (size, size), "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((size // 4, size // 8, size * 3 // 4, size * 7 // 8), fill=colour)
+    draw.rectangle((0, size // 8, size // 4, size // 2), fill=colour)
+    return image
+
+
+def test_variants_are_clustered_and_different_products_are_not():
+    index = NearDuplicateIndex()
+    shirt = index.add(f"Dress Shirt Blue M\n{DESCRIPTION}", shirt_image("blue"))
+    variant = index.add(f"Dress Shirt Red L\n{DESCRIPTION}", shirt_image("red", size=512))
+    sofa = index.add("Three seat sofa\nA velvet sofa with oak legs and deep cushions.", Image.new("RGB", (256, 256), "green"))
+
+    assert (shirt, variant, sofa) == (0, 0, 2)
+    assert index.get_clusters() == {0: [0, 1], 2: [2]}
+
+
+def test_different_images_split_similar_text():
+    index = NearDuplicateIndex()
+    index.add(DESCRIPTION, shirt_image("blue"))
+    index.add(DESCRIPTION, shirt_image("blue").transpose(Image.Transpose.ROTATE_90))
+
+    assert len(index.get_clusters()) == 2
+
+
+def test_dhash_ignores_scale_and_colour():
+    assert dhash(shirt_image("blue")) == dhash(shirt_image("navy", size=1024))
+
+
+def variant_contexts(config: Config) -> list[Context]:
+    """A blue M shirt with its red L and black S variants, the flash model describes the blue M."""
+    generated = BaseProduct(language="US_EN", name="Dress Shirt Blue M",
+                            description="A blue dress shirt in stretch cotton, this is the size M.",
+                            seo_html_header="<title>Blue Dress Shirt M</title>", attribute_values=[])
+    flash = config.get_generator_by_name("flash").client.aio.models
+    respond = flash.respond
+    flash.respond = lambda c: generated.model_dump_json() if c.response_schema is BaseProduct else respond(c)
+
+    contexts = []
+    for colour, size in [("Blue", "M"), ("Red", "L"), ("Black", "S")]:
+        context = Context(config)
+        context.set("product_image", shirt_image(colour.lower()))
+        context.set("product_name", f"Dress Shirt {colour} {size}")
+        context.set("product_description", DESCRIPTION)
+        context.set("variant_attributes", {"color": colour, "size": size})
+        context.set("languages", ["FR_FR"])
+        contexts.append(context)
+    return contexts
+
+
+@pytest.mark.asyncio
+async def test_duplicates_are_enriched_once(offline_config: Config):
+    contexts = variant_contexts(offline_config)
+
+    progress = BatchProgress()
+    results = [c async for c in execute_deduplicated(product_enrichment_from_image, contexts, progress=progress)]
+
+    flash = offline_config.get_generator_by_name("flash").client
+    # detection, extraction and one translation for the representative only
+    assert len(flash.aio.models.calls) == 3
+    assert len(results) == 3 and progress.succeeded == 3
+    red = contexts[1]
+    values = {v.name: v.value for v in red.get("product").base.attribute_values}
+    assert values["size"] == "L" and values["color"] == "Red"
+    assert red.get("product").base.name == "Dress Shirt Red L"
+    assert red.get("product").base.description == "A red dress shirt in stretch cotton, this is the size L."
+    assert red.get("product").base.seo_html_header == "<title>Red Dress Shirt L</title>"
+    assert json.loads(red.get("product_json"))["base"]["attribute_values"] == json.loads(
+        red.get("product").base.model_dump_json())["attribute_values"]
+    assert json.loads(red.get("language_FR_FR"))["name"] == "Dress Shirt Red L"
+    assert red.get("product_image") is not contexts[0].get("product_image")
+    assert contexts[0].get("product").base.name == "Dress Shirt Blue M"
+
+
+@pytest.mark.asyncio
+async def test_per_variant_commands_run_for_every_duplicate(offline_config: Config):
+    contexts = variant_contexts(offline_config)
+
+    results = [c async for c in execute_deduplicated(product_enrichment_from_image, contexts, per_variant=language_extractor)]
+
+    flash = offline_config.get_generator_by_name("flash").client
+    # one more translation for each duplicate, from its own patched product
+    assert len(results) == 3
+    assert len(flash.aio.models.calls) == 5
+    assert sum("Dress Shirt Black S" in str(call) for call in flash.aio.models.calls) == 1
+    assert contexts[2].has_key("language_FR_FR")
+
+
+@pytest.mark.asyncio
+async def test_unbounded_inputs_are_clustered_per_batch(offline_config: Config):
+    executed = []
+    command = Command("describe", lambda context: executed.append(context), writes=["description"])
+
+    async def contexts():
+        for _ in range(6):
+            context = Context(offline_config)
+            context.set("product_name", "Dress Shirt")
+            context.set("product_description", DESCRIPTION)
+            yield context
+
+    progress = BatchProgress()
+    results = [c async for c in execute_deduplicated_batches(command, contexts(), 4, progress=progress)]
+
+    assert len(results) == 6 and progress.succeeded == 6
+    assert len(executed) == 2
@@ -0,0 +1,64 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import numpy as np
+import pytest
+
+
+def cache_settings(tmp_path) -> dict:
+    return {"cache": {"enabled": True, "path": str(tmp_path / "embeddings.db")}}
+
+
+@pytest.mark.asyncio
+async def test_texts_are_embedded_in_chunks_as_a_matrix(tmp_path, embedding_factory):
+    embedding = embedding_factory({"batch_size": 2, **cache_settings(tmp_path)})
+    texts = ["shirt", "dress", "shirt", "hat", "scarf"]
+
+    matrix = await embedding.embed_texts_async(texts)
+
+    assert matrix.dtype == np.float32
+    assert matrix.shape == (5, 3)
+    assert matrix.flags["C_CONTIGUOUS"]
+    assert matrix[0].tolist() == [5.0, ord("s"), 1.0]
+    np.testing.assert_array_equal(matrix[0], matrix[2])
+    # four distinct texts in chunks of two
+    assert [len(c) for c in embedding.client.aio.models.calls] == [2, 2]
+
+
+def test_unchanged_texts_are_served_from_the_disk_cache(tmp_path, embedding_factory):
+    texts = ["shirt", "dress", "hat"]
+    first = embedding_factory(cache_settings(tmp_path)).embed_texts(texts)
+
+    embedding = embedding_factory(cache_settings(tmp_path))
+    second = embedding.embed_texts(texts + ["scarf"])
+
+    np.testing.assert_array_equal(first, second[:3])
+    assert embedding.client.models.calls == [["scarf"]]
+
+
+def test_cached_vectors_are_read_in_one_query(tmp_path, embedding_factory):
+    texts = ["shirt", "dress", "hat"]
+    embedding_factory(cache_settings(tmp_path)).embed_texts(texts)
+    embedding = embedding_factory(cache_settings(tmp_path))
+    statements = []
+    embedding.vector_cache.disk.connection.set_trace_callback(statements.append)
+
+    embedding.embed_texts(texts + ["shirt", "scarf"])
+
+    assert len([s for s in statements if s.startswith("SELECT key")]) == 1
+    assert embedding.vector_cache.stats.disk_hits == 3
+    assert embedding.client.models.calls == [["scarf"]]
+
+
+def test_empty_input(embedding_factory):
+    assert embedding_factory().embed_texts([]).shape == (0, 0)
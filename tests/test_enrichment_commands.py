@@ -0,0 +1,82 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import time
+
+import pytest
+from PIL import Image
+
+from commands.main import product_enrichment_from_image, product_enrichment_streaming
+from model.chain import Context
+from model.config import Config
+from model.examples import example_category, example_product
+
+
+def product_context(config: Config) -> Context:
+    context = Context(config)
+    context.set("product_image", Image.new("RGB", (16, 16), "white"))
+    return context
+
+
+@pytest.mark.asyncio
+async def test_enrichment_awaits_the_aio_client(offline_config: Config):
+    context = product_context(offline_config)
+    context.set("languages", ["FR_FR", "DE_DE", "ES_ES", "IT_IT"])
+
+    started = time.perf_counter()
+    await product_enrichment_from_image.execute(context)
+    elapsed = time.perf_counter() - started
+
+    flash = offline_config.get_generator_by_name("flash").client
+    assert len(flash.models.calls) == 0
+    assert len(flash.aio.models.calls) == 6
+    assert context.get("category") == example_category
+    assert context.get("product").base == example_product.base
+    assert context.get("product").category == example_category
+    assert all(context.get(f"language_{l}") is not None for l in ["FR_FR", "DE_DE", "ES_ES", "IT_IT"])
+    # detection, extraction and one round of concurrent translations
+    assert elapsed < 0.3
+
+
+@pytest.mark.asyncio
+async def test_enrichment_extracts_video_attributes(offline_config: Config, tmp_path):
+    video = tmp_path / "product.mp4"
+    video.write_bytes(b"video")
+    context = product_context(offline_config)
+    context.set("product_video", str(video))
+    flash = offline_config.get_generator_by_name("flash")
+    flash.video_files.initial_poll_seconds = 0.01
+
+    await product_enrichment_from_image.execute(context)
+
+    assert context.get("video_attributes") is not None
+    assert context.get("product").base == example_product.base
+    assert len(flash.client.aio.files.uploads) == 1
+
+
+@pytest.mark.asyncio
+async def test_streaming_enrichment_publishes_fields(offline_config: Config):
+    context = product_context(offline_config)
+    context.set("languages", [])
+    flash = offline_config.get_generator_by_name("flash").client
+    text = example_product.base.model_dump_json()
+    flash.aio.models.stream_chunks = [text[i:i + 10] for i in range(0, len(text), 10)]
+
+    events = []
+    context.subscribe(lambda event, data: events.append((event, data)))
+    await product_enrichment_streaming.execute(context)
+
+    fields = {data["name"]: data["value"] for event, data in events if event == "field"}
+    assert fields == example_product.base.model_dump(mode="json")
+    assert context.get("product").base == example_product.base
+    assert ("command_finish", {"command": "content-streamer"}) in events
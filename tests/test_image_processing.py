@@ -0,0 +1,87 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import io
+
+import pytest
+from google.genai import types
+from PIL import Image
+
+from commands.image_processing import ImagePreprocessCommand, preprocess_image, shutdown_image_process_pool
+from model.chain import Context
+from model.config import Config
+
+EXIF_ORIENTATION = 0x0112
+ROTATE_90 = 6
+
+
+def jpeg_bytes(size: tuple[int, int], orientation: int|None = None, quality: int = 75) -> bytes:
+    image = Image.effect_noise(size, 64).convert("RGB")
+    exif = Image.Exif()
+    if orientation is not None:
+        exif[EXIF_ORIENTATION] = orientation
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", exif=exif.tobytes() if orientation is not None else b"", quality=quality)
+    return buffer.getvalue()
+
+
+def test_large_images_are_resized_and_oriented():
+    encoded = preprocess_image(jpeg_bytes((4000, 2000), orientation=ROTATE_90), 1024, "JPEG", 85)
+
+    image = Image.open(io.BytesIO(encoded))
+    assert image.size == (512, 1024)
+    assert image.getexif().get(EXIF_ORIENTATION) is None
+
+
+def test_small_images_in_the_target_format_are_kept():
+    source = jpeg_bytes((64, 64), quality=50)
+    assert preprocess_image(source, 1024, "JPEG", 85) == source
+
+
+def test_the_source_image_is_not_changed():
+    image = Image.open(io.BytesIO(jpeg_bytes((2000, 1000))))
+
+    encoded = preprocess_image(image, 500, "JPEG", 85)
+
+    assert Image.open(io.BytesIO(encoded)).size == (500, 250)
+    assert image.size == (2000, 1000)
+
+
+@pytest.mark.asyncio
+async def test_preprocessing_is_cached_by_source(offline_config: Config):
+    command = ImagePreprocessCommand("image-preprocessing", "product_image", "product_image", max_edge=256)
+    first, second = Context(offline_config), Context(offline_config)
+    first.set("product_image", Image.new("RGB", (1024, 512), "white"))
+    second.set("product_image", Image.new("RGB", (1024, 512), "white"))
+
+    await command.execute(first)
+    await command.execute(second)
+
+    part = first.get("product_image")
+    assert isinstance(part, types.Part)
+    assert part.inline_data.mime_type == "image/jpeg"
+    assert Image.open(io.BytesIO(part.inline_data.data)).size == (256, 128)
+    assert offline_config.images.encoded_cache.stats.memory_hits == 1
+
+
+@pytest.mark.asyncio
+async def test_large_images_use_the_process_pool(offline_config: Config):
+    command = ImagePreprocessCommand("image-preprocessing", "product_image", "product_image", max_edge=512)
+    context = Context(offline_config)
+    context.set("product_image", Image.new("RGB", (2048, 1024), "white"))
+    try:
+        await command.execute(context)
+    finally:
+        shutdown_image_process_pool()
+
+    assert Image.open(io.BytesIO(context.get("product_image").inline_data.data)).size == (512, 256)
@@ -0,0 +1,209 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from commands.images import ImageDownloadCommand, get_blob_name
+from model.chain import Context
+from model.clients import get_client_registry
+from model.config import Config
+from model.ingestion import ImageIngester
+
+IMAGE = bytes(range(256)) * 1200
+
+
+class ImageServer(ThreadingHTTPServer):
+    """Serves IMAGE, fails /unavailable/ once with a 503 and holds /slow/ for a while."""
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), ImageHandler)
+        self.hits: Counter = Counter()
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}{path}"
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server: ImageServer = self.server
+        with server.lock:
+            server.hits[self.path] += 1
+            hits = server.hits[self.path]
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            if self.path.startswith("/missing/") or (self.path.startswith("/unavailable/") and hits == 1):
+                self.send_error(404 if self.path.startswith("/missing/") else 503)
+                return
+            if self.path.startswith("/slow/"):
+                time.sleep(0.1)
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(IMAGE)))
+            self.end_headers()
+            self.wfile.write(IMAGE)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeWriter():
+    def __init__(self, storage: "FakeStorage", name: str, content_type: str):
+        self.storage = storage
+        self.name = name
+        self.content_type = content_type
+        self.chunks: list[bytes] = []
+
+    def write(self, chunk: bytes) -> None:
+        self.chunks.append(chunk)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.storage.objects[self.name] = (b"".join(self.chunks), self.content_type, len(self.chunks))
+
+
+class FakeStorage():
+    """A stand-in for storage.Client recording the objects written through blob.open."""
+    def __init__(self):
+        self.objects: dict[str, tuple[bytes, str, int]] = {}
+        self.buckets: set[str] = set()
+
+    def bucket(self, bucket_name: str):
+        storage = self
+
+        class Bucket():
+            def exists(self):
+                return bucket_name in storage.buckets
+
+            def blob(self, blob_name: str):
+                class Blob():
+                    def open(self, mode, chunk_size=None, content_type=None):
+                        assert mode == "wb"
+                        return FakeWriter(storage, f"{bucket_name}/{blob_name}", content_type)
+                return Blob()
+        return Bucket()
+
+    def create_bucket(self, bucket_name: str):
+        self.buckets.add(bucket_name)
+
+
+@pytest.fixture(scope="module")
+def image_server():
+    server = ImageServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def storage():
+    return FakeStorage()
+
+
+@pytest.fixture
+def ingester(storage):
+    ingester = ImageIngester(max_per_host=2, read_size=16 * 1024, max_retries=2, storage_client=storage)
+    ingester.retry_policy.initial_backoff_seconds = 0.01
+    yield ingester
+    ingester.close()
+
+
+def test_blob_names_keep_the_extension():
+    assert get_blob_name("https://cdn.example.com/a/shoe.front.jpg?w=2", "products/", "_gallery") == "products/shoe.front_gallery.jpg"
+
+
+@pytest.mark.asyncio
+async def test_images_are_streamed_in_chunks(image_server: ImageServer, ingester: ImageIngester, storage: FakeStorage):
+    results = await ingester.ingest_many([(image_server.url("/images/a.jpg"), "bucket", "a.jpg")])
+
+    assert results == ["gs://bucket/a.jpg"]
+    data, content_type, chunks = storage.objects["bucket/a.jpg"]
+    assert data == IMAGE
+    assert content_type == "image/jpeg"
+    assert chunks > 1
+
+
+@pytest.mark.asyncio
+async def test_downloads_per_host_are_bounded(image_server: ImageServer, ingester: ImageIngester, storage: FakeStorage):
+    image_server.max_active = 0
+    images = [(image_server.url(f"/slow/{i}.jpg"), "bucket", f"{i}.jpg") for i in range(8)]
+
+    results = await ingester.ingest_many(images)
+
+    assert results == [f"gs://bucket/{i}.jpg" for i in range(8)]
+    assert image_server.max_active == 2
+
+
+@pytest.mark.asyncio
+async def test_a_busy_host_does_not_hold_back_other_hosts(image_server: ImageServer, storage: FakeStorage):
+    ingester = ImageIngester(max_concurrent=2, max_per_host=1, storage_client=storage)
+    other_host = image_server.url("/images/other.jpg").replace("127.0.0.1", "localhost")
+    finished = []
+
+    async def ingest(url: str, name: str) -> None:
+        await ingester.ingest_async(url, "bucket", name)
+        finished.append(name)
+
+    try:
+        await asyncio.gather(*[ingest(image_server.url(f"/slow/{i}.jpg"), f"{i}.jpg") for i in range(4)],
+                             ingest(other_host, "other.jpg"))
+    finally:
+        ingester.close()
+
+    assert len(finished) == 5
+    assert finished.index("other.jpg") < 2
+
+
+@pytest.mark.asyncio
+async def test_transient_errors_are_retried(image_server: ImageServer, ingester: ImageIngester, storage: FakeStorage):
+    results = await ingester.ingest_many([(image_server.url("/unavailable/b.jpg"), "bucket", "b.jpg"),
+                                          (image_server.url("/missing/c.jpg"), "bucket", "c.jpg")])
+
+    assert results[0] == "gs://bucket/b.jpg"
+    assert isinstance(results[1], requests.HTTPError)
+    assert image_server.hits["/unavailable/b.jpg"] == 2
+    assert image_server.hits["/missing/c.jpg"] == 1
+    assert list(storage.objects) == ["bucket/b.jpg"]
+
+
+@pytest.mark.asyncio
+async def test_command_maps_urls_and_records_failures(monkeypatch, image_server: ImageServer, ingester: ImageIngester,
+                                                     storage: FakeStorage, offline_config: Config):
+    monkeypatch.setattr("model.ingestion._image_ingester", ingester)
+    monkeypatch.setattr(get_client_registry(), "resources", set())
+    command = ImageDownloadCommand("download", "image_urls", "image_paths", "gallery", "products/", "")
+    context = Context(offline_config)
+    urls = [image_server.url(f"/images/{i}.jpg") for i in range(3)] + [image_server.url("/missing/d.jpg")]
+    context.set("image_urls", urls + urls[:1])
+
+    await command.execute(context)
+
+    assert context.get("image_paths") == {url: f"gs://gallery/products/{i}.jpg" for i, url in enumerate(urls[:3])}
+    assert len(context.errors) == 1
+    assert storage.buckets == {"gallery"}
@@ -0,0 +1,40 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from utils.json_stream import IncrementalJSONParser
+
+
+def feed_all(chunks: list[str]) -> list:
+    parser = IncrementalJSONParser()
+    members = []
+    for chunk in chunks:
+        members.extend(parser.feed(chunk))
+    return members
+
+
+def test_object_members_complete_across_chunks():
+    text = '```json\n{"name": "Shirt \\"X\\"", "n": 12, "ok": true, "attrs": [{"a": "}"}], "last": null}\n```'
+    members = feed_all([text[i:i + 3] for i in range(0, len(text), 3)])
+    assert members == [
+        ("name", 'Shirt "X"'), ("n", 12), ("ok", True), ("attrs", [{"a": "}"}]), ("last", None)]
+
+
+def test_member_is_returned_as_soon_as_it_is_complete():
+    parser = IncrementalJSONParser()
+    assert parser.feed('{"title": "Linen') == []
+    assert parser.feed(' shirt", "price"') == [("title", "Linen shirt")]
+    assert parser.feed(': 12.5}') == [("price", 12.5)]
+
+
+def test_array_elements_are_indexed():
+    assert feed_all(['[1, {"a"', ': 2}, "x",', ' 3]']) == [(0, 1), (1, {"a": 2}), (2, "x"), (3, 3)]
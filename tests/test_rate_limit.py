@@ -0,0 +1,138 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+from google.genai import errors
+
+from utils.rate_limit import AdaptiveRateLimiter, RetryPolicy
+
+
+def quota_error() -> errors.ClientError:
+    return errors.ClientError(429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED", "message": "quota"}})
+
+
+class FlakyModels():
+    def __init__(self, failures: list[Exception], response_factory):
+        self.failures = failures
+        self.response_factory = response_factory
+        self.calls = 0
+
+    def generate_content(self, model, config, contents):
+        self.calls += 1
+        if self.failures:
+            raise self.failures.pop(0)
+        return self.response_factory("ok")
+
+
+def test_limiter_spaces_requests_beyond_the_burst():
+    limiter = AdaptiveRateLimiter("test", requests_per_minute=120)
+    limiter.request_balance = 1
+
+    assert limiter.reserve() == 0
+    assert limiter.reserve() == pytest.approx(0.5, abs=0.01)
+    assert limiter.reserve() == pytest.approx(1.0, abs=0.01)
+
+
+def test_limiter_enforces_token_budget():
+    limiter = AdaptiveRateLimiter("test", requests_per_minute=1000, tokens_per_minute=600)
+
+    assert limiter.reserve(600) == 0
+    assert limiter.reserve(60) == pytest.approx(6.0, abs=0.05)
+
+
+def test_limiter_adapts_to_quota_errors():
+    limiter = AdaptiveRateLimiter("test", requests_per_minute=100, recovery_fraction=0.25)
+
+    limiter.on_quota_error()
+    assert limiter.current_requests_per_minute() == 50
+    limiter.on_success()
+    limiter.on_success()
+    assert limiter.current_requests_per_minute() == 100
+    assert limiter.quota_errors == 1
+
+
+def test_generator_retries_quota_errors(generator_factory, response_factory):
+    generator = generator_factory({"rate_limit": {"requests_per_minute": 600, "initial_backoff_seconds": 0.01}})
+    generator.client.models = FlakyModels([quota_error(), quota_error()], response_factory)
+
+    assert generator.generate_content("Tell me a joke.") == "ok"
+    assert generator.client.models.calls == 3
+    assert generator.rate_limiter.quota_errors == 2
+
+
+def test_generator_gives_up_after_max_retries(generator_factory, response_factory):
+    generator = generator_factory({"rate_limit": {"max_retries": 1, "initial_backoff_seconds": 0.01}})
+    generator.client.models = FlakyModels([quota_error(), quota_error()], response_factory)
+
+    with pytest.raises(errors.ClientError):
+        generator.generate_content("Tell me a joke.")
+
+
+def test_generator_does_not_retry_client_errors(generator_factory, response_factory):
+    generator = generator_factory()
+    invalid = errors.ClientError(400, {"error": {"code": 400, "status": "INVALID_ARGUMENT"}})
+    generator.client.models = FlakyModels([invalid], response_factory)
+
+    with pytest.raises(errors.ClientError):
+        generator.generate_content("Tell me a joke.")
+    assert generator.client.models.calls == 1
+
+
+class FlakyStreamingModels(FlakyModels):
+    """Fails the first calls, the stream of the failing calls breaks before its first chunk."""
+    def generate_content_stream(self, model, config, contents):
+        self.calls += 1
+        failure = self.failures.pop(0) if self.failures else None
+
+        def stream():
+            if failure is not None:
+                raise failure
+            yield self.response_factory("o")
+            yield self.response_factory("k")
+        return stream()
+
+
+def test_streams_retry_quota_errors_before_the_first_chunk(generator_factory, response_factory):
+    generator = generator_factory({"rate_limit": {"requests_per_minute": 600, "initial_backoff_seconds": 0.01}})
+    generator.client.models = FlakyStreamingModels([quota_error(), quota_error()], response_factory)
+
+    assert "".join(generator.generate_content_stream("Tell me a joke.")) == "ok"
+    assert generator.client.models.calls == 3
+    assert generator.rate_limiter.quota_errors == 2
+
+
+@pytest.mark.asyncio
+async def test_async_streams_retry_quota_errors_before_the_first_chunk(generator_factory, response_factory):
+    generator = generator_factory({"rate_limit": {"requests_per_minute": 600, "initial_backoff_seconds": 0.01}})
+    models = FlakyStreamingModels([quota_error()], response_factory)
+
+    async def generate_content_stream(model, config, contents):
+        chunks = models.generate_content_stream(model, config, contents)
+
+        async def stream():
+            for chunk in chunks:
+                yield chunk
+        return stream()
+
+    generator.client.aio.models.generate_content_stream = generate_content_stream
+
+    assert "".join([c async for c in generator.generate_content_stream_async("Tell me a joke.")]) == "ok"
+    assert models.calls == 2
+    assert generator.rate_limiter.quota_errors == 1
+
+
+def test_backoff_is_bounded():
+    policy = RetryPolicy(initial_backoff_seconds=1, max_backoff_seconds=4)
+
+    assert all(0 <= policy.backoff(attempt) <= 4 for attempt in range(10))
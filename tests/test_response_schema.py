@@ -0,0 +1,47 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import pytest
+
+from model.config import JSON_MIME_TYPE
+from model.examples import BaseProduct, Category, example_product
+
+
+def test_response_schema_returns_the_model(generator_factory):
+    generator = generator_factory({"output_format": "text/plain"})
+
+    product = generator.generate_content("describe the shirt", response_schema=BaseProduct)
+
+    assert product == example_product.base
+    assert generator.get_generative_config(response_schema=BaseProduct).response_mime_type == JSON_MIME_TYPE
+    assert generator.generate_content("describe the shirt") == "response 2"
+
+
+def test_response_schema_is_part_of_the_cache_key(generator_factory):
+    generator = generator_factory()
+    contents = ["describe the shirt"]
+
+    keys = {generator.get_cache_key(contents),
+            generator.get_cache_key(contents, BaseProduct),
+            generator.get_cache_key(contents, Category)}
+
+    assert len(keys) == 3
+
+
+@pytest.mark.asyncio
+async def test_response_schema_async(generator_factory):
+    generator = generator_factory()
+
+    category = await generator.understand_image_async("categorize", b"image", response_schema=Category)
+
+    assert isinstance(category, Category)
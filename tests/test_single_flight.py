@@ -0,0 +1,113 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from PIL import Image
+
+from utils.single_flight import SingleFlight
+
+
+def test_threads_share_one_execution():
+    flight = SingleFlight("test")
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.1)
+        return "result"
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        results = list(pool.map(lambda _: flight.do("key", slow), range(5)))
+
+    assert results == ["result"] * 5
+    assert len(calls) == 1
+    assert flight.coalesced == 4
+    assert flight.in_flight() == 0
+
+
+@pytest.mark.asyncio
+async def test_async_callers_share_errors():
+    flight = SingleFlight("test")
+
+    async def fail():
+        await asyncio.sleep(0.05)
+        raise ValueError("boom")
+
+    results = await asyncio.gather(*[flight.do_async("key", fail) for _ in range(3)], return_exceptions=True)
+
+    assert all(isinstance(r, ValueError) for r in results)
+    assert flight.executed == 1
+
+
+@pytest.mark.asyncio
+async def test_cancelled_follower_leaves_the_others_waiting():
+    flight = SingleFlight("test")
+
+    async def slow():
+        await asyncio.sleep(0.1)
+        return "result"
+
+    leader = asyncio.create_task(flight.do_async("key", slow))
+    await asyncio.sleep(0.01)
+    followers = [asyncio.create_task(flight.do_async("key", slow)) for _ in range(3)]
+    await asyncio.sleep(0.01)
+    followers[0].cancel()
+
+    results = await asyncio.gather(leader, *followers, return_exceptions=True)
+
+    assert isinstance(results[1], asyncio.CancelledError)
+    assert results[0] == results[2] == results[3] == "result"
+    assert flight.executed == 1
+    assert flight.in_flight() == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_leader_hands_over_to_a_follower():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def slow():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return "result"
+
+    leader = asyncio.create_task(flight.do_async("key", slow))
+    await asyncio.sleep(0.01)
+    followers = [asyncio.create_task(flight.do_async("key", slow)) for _ in range(3)]
+    await asyncio.sleep(0.01)
+    leader.cancel()
+
+    results = await asyncio.gather(leader, *followers, return_exceptions=True)
+
+    assert isinstance(results[0], asyncio.CancelledError)
+    assert results[1:] == ["result"] * 3
+    assert len(calls) == 2
+    assert flight.in_flight() == 0
+
+
+@pytest.mark.asyncio
+async def test_generator_coalesces_identical_image_requests(generator_factory, client_factory):
+    generator = generator_factory({"coalesce_requests": True})
+    generator.client = client_factory(delay=0.05)
+    image = Image.new("RGB", (8, 8), "red")
+
+    results = await asyncio.gather(*[generator.understand_image_async("Detect the category", image.copy()) for _ in range(10)],
+                                   generator.understand_image_async("Detect the category", Image.new("RGB", (8, 8), "blue")))
+
+    assert len(set(results[:10])) == 1
+    assert len(generator.client.aio.models.calls) == 2
+    assert generator.single_flight.coalesced == 9
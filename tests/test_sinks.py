@@ -0,0 +1,78 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import threading
+import time
+
+from model.sinks import StreamingInsertSink
+from utils.rate_limit import RetryPolicy
+
+NO_BACKOFF = RetryPolicy(max_retries=3, initial_backoff_seconds=0.0, max_backoff_seconds=0.0)
+
+
+class FakeBigQuery():
+    """A stand-in for bigquery.Client.insert_rows_json, rejecting the rows of the given reasons once."""
+    def __init__(self, reject: dict[int, str]|None = None):
+        self.reject = dict(reject or {})
+        self.requests: list[list[dict]] = []
+        self.inserted: dict[str, dict] = {}
+        self.lock = threading.Lock()
+
+    def insert_rows_json(self, table, rows, row_ids=None):
+        with self.lock:
+            self.requests.append(rows)
+            errors = []
+            for i, (row, row_id) in enumerate(zip(rows, row_ids)):
+                reason = self.reject.pop(row["id"], None)
+                if reason is not None:
+                    errors.append({"index": i, "errors": [{"reason": reason}]})
+                else:
+                    self.inserted[row_id] = row
+            return errors
+
+
+def test_rows_are_batched_by_count():
+    client = FakeBigQuery()
+    sink = StreamingInsertSink(client, "p.d.t", flush_rows=10, flush_seconds=60.0, retry_policy=NO_BACKOFF)
+
+    for i in range(25):
+        sink.put([{"id": i}])
+    sink.close()
+
+    assert [len(r) for r in client.requests] == [10, 10, 5]
+    assert sorted(r["id"] for r in client.inserted.values()) == list(range(25))
+
+
+def test_rows_are_flushed_by_age():
+    client = FakeBigQuery()
+    sink = StreamingInsertSink(client, "p.d.t", flush_rows=100, flush_seconds=0.05, retry_policy=NO_BACKOFF)
+
+    sink.put([{"id": 1}, {"id": 2}])
+    time.sleep(0.3)
+
+    assert [len(r) for r in client.requests] == [2]
+    sink.close()
+
+
+def test_failed_rows_are_retried_alone_and_invalid_rows_dropped():
+    client = FakeBigQuery(reject={3: "backendError", 5: "invalid"})
+    sink = StreamingInsertSink(client, "p.d.t", flush_rows=10, flush_seconds=60.0, retry_policy=NO_BACKOFF)
+
+    sink.put([{"id": i} for i in range(10)])
+    assert sink.flush(timeout=5.0)
+
+    assert [len(r) for r in client.requests] == [10, 1]
+    assert client.requests[1] == [{"id": 3}]
+    assert sorted(r["id"] for r in client.inserted.values()) == [0, 1, 2, 3, 4, 6, 7, 8, 9]
+    assert sink.failed_rows == 1
+    sink.close()
@@ -0,0 +1,207 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import io
+import json
+import threading
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+from commands.main import create_batch_enricher, product_completion, product_detection_from_image
+from model.batch_prediction import LocalBatchExecutor
+from model.chain import Command, Context
+from model.config import Config
+from model.examples import example_category, example_product
+from model.sinks import StreamingInsertSink
+from model.sources import OFFSET_KEY, STREAM_KEY, ReadCheckpoint, StorageReadSource
+from worker.main import run, run_batch
+
+TABLE = "project.retail.products"
+STREAMS = ["sessions/s/streams/0", "sessions/s/streams/1"]
+ROWS_PER_STREAM = 25
+BATCH_ROWS = 10
+
+
+class FakeBatch():
+    """A stand-in for a pyarrow.RecordBatch."""
+    def __init__(self, rows: list[dict]):
+        self.rows = rows
+        self.num_rows = len(rows)
+
+    def to_pylist(self) -> list[dict]:
+        return self.rows
+
+
+class FakeReadClient():
+    """A stand-in for BigQueryReadClient.read_rows, every stream has ROWS_PER_STREAM rows."""
+    def __init__(self):
+        self.reads = []
+
+    def read_rows(self, stream, offset=0):
+        self.reads.append((stream, offset))
+        index = STREAMS.index(stream)
+        rows = [{"product_name": f"product {index}-{i}"} for i in range(offset, ROWS_PER_STREAM)]
+        pages = [SimpleNamespace(to_arrow=lambda b=rows[i:i + BATCH_ROWS]: FakeBatch(b))
+                 for i in range(0, len(rows), BATCH_ROWS)]
+        return SimpleNamespace(rows=lambda: SimpleNamespace(pages=pages))
+
+
+def source(tmp_path, client: FakeReadClient) -> StorageReadSource:
+    path = str(tmp_path / "checkpoint.json")
+    source = StorageReadSource("project", TABLE, checkpoint_path=path, max_queued_batches=1, client=client)
+    if not (tmp_path / "checkpoint.json").exists():
+        ReadCheckpoint(TABLE, source.get_options(), "sessions/s", STREAMS).save(path)
+    return source
+
+
+@pytest.mark.asyncio
+async def test_every_stream_is_read_into_contexts(tmp_path, offline_config: Config):
+    contexts = [c async for c in source(tmp_path, FakeReadClient()).read_contexts(offline_config)]
+
+    assert len(contexts) == 2 * ROWS_PER_STREAM
+    assert {c.get("product_name") for c in contexts} == {f"product {s}-{i}" for s in range(2) for i in range(ROWS_PER_STREAM)}
+    first = next(c for c in contexts if c.get("product_name") == "product 1-12")
+    assert (first.get(STREAM_KEY), first.get(OFFSET_KEY)) == (STREAMS[1], 12)
+
+
+@pytest.mark.asyncio
+async def test_reading_resumes_after_the_completed_rows(tmp_path, offline_config: Config):
+    first = source(tmp_path, FakeReadClient())
+    contexts = [c async for c in first.read_contexts(offline_config)]
+    # the rows of stream 0 complete out of order up to offset 10, offset 11 is still in flight
+    for context in contexts:
+        offset = context.get(OFFSET_KEY)
+        if context.get(STREAM_KEY) == STREAMS[0] and (offset <= 10 or offset == 12):
+            first.complete(context)
+    first.save_checkpoint()
+
+    client = FakeReadClient()
+    resumed = [c async for c in source(tmp_path, client).read_contexts(offline_config)]
+
+    assert sorted(client.reads) == [(STREAMS[0], 11), (STREAMS[1], 0)]
+    assert len(resumed) == 2 * ROWS_PER_STREAM - 11
+
+
+class FakeInsertClient():
+    """A stand-in for bigquery.Client.insert_rows_json, rejecting the rows of the given products."""
+    def __init__(self, invalid: set[str]|None = None):
+        self.invalid = invalid or set()
+        self.rows = []
+
+    def insert_rows_json(self, table, rows, row_ids=None):
+        errors = []
+        for i, row in enumerate(rows):
+            if json.loads(row["source"])["product_name"] in self.invalid:
+                errors.append({"index": i, "errors": [{"reason": "invalid"}]})
+            else:
+                self.rows.append(row)
+        return errors
+
+
+def enrich(context: Context) -> None:
+    context.set("product_json", json.dumps({"name": context.get("product_name").upper()}))
+
+
+@pytest.mark.asyncio
+async def test_the_worker_writes_every_row_and_checkpoints(tmp_path, offline_config: Config):
+    client = FakeInsertClient()
+    sink = StreamingInsertSink(client, TABLE, flush_rows=10, flush_seconds=60.0)
+    progress = await run(offline_config, Command("enrich", enrich), source(tmp_path, FakeReadClient()), sink, 4)
+    sink.close()
+
+    assert progress.succeeded == 2 * ROWS_PER_STREAM
+    assert len(client.rows) == 2 * ROWS_PER_STREAM
+    row = client.rows[0]
+    assert json.loads(row["source"])["product_name"].upper() == json.loads(row["product"])["name"]
+    checkpoint = ReadCheckpoint.load(str(tmp_path / "checkpoint.json"))
+    assert checkpoint.offsets == {s: ROWS_PER_STREAM for s in STREAMS}
+
+
+@pytest.mark.asyncio
+async def test_a_dropped_row_does_not_hold_back_the_checkpoint(tmp_path, offline_config: Config, caplog):
+    client = FakeInsertClient(invalid={"product 1-7"})
+    sink = StreamingInsertSink(client, TABLE, flush_rows=10, flush_seconds=60.0)
+    reader = source(tmp_path, FakeReadClient())
+    await run(offline_config, Command("enrich", enrich), reader, sink, 4)
+    sink.close()
+
+    assert len(client.rows) == 2 * ROWS_PER_STREAM - 1
+    assert "product 1-7" in caplog.text
+    assert all(len(w.completed) == 0 for w in reader.watermarks.values())
+    checkpoint = ReadCheckpoint.load(str(tmp_path / "checkpoint.json"))
+    assert checkpoint.offsets == {s: ROWS_PER_STREAM for s in STREAMS}
+
+
+class ThreadRecordingSink(StreamingInsertSink):
+    """Records the threads rows are put from."""
+    def __init__(self, client):
+        super().__init__(client, TABLE, flush_rows=10, flush_seconds=60.0)
+        self.threads = set()
+
+    def put(self, rows, on_written=None):
+        self.threads.add(threading.current_thread())
+        super().put(rows, on_written)
+
+
+@pytest.mark.asyncio
+async def test_the_worker_puts_rows_off_the_event_loop(tmp_path, offline_config: Config):
+    sink = ThreadRecordingSink(FakeInsertClient())
+    await run(offline_config, Command("enrich", enrich), source(tmp_path, FakeReadClient()), sink, 4)
+    sink.close()
+
+    assert len(sink.threads) > 0
+    assert threading.current_thread() not in sink.threads
+
+
+class ImageReadClient(FakeReadClient):
+    """A FakeReadClient whose rows have a product_image."""
+    def read_rows(self, stream, offset=0):
+        buffer = io.BytesIO()
+        Image.new("RGB", (8, 8), "white").save(buffer, format="PNG")
+        response = super().read_rows(stream, offset)
+        for page in response.rows().pages:
+            for row in page.to_arrow().rows:
+                row["product_image"] = buffer.getvalue()
+        return response
+
+
+@pytest.mark.asyncio
+async def test_the_batch_worker_generates_the_product_details_in_batch_jobs(tmp_path, offline_config: Config):
+    requests = []
+
+    def respond(request: dict) -> str:
+        requests.append(request)
+        if len(requests) == 1:
+            raise ValueError("blocked")
+        return example_product.base.model_dump_json()
+
+    executor = LocalBatchExecutor(respond)
+    client = FakeInsertClient()
+    sink = StreamingInsertSink(client, TABLE, flush_rows=10, flush_seconds=60.0)
+    progress = await run_batch(offline_config, product_detection_from_image, create_batch_enricher(offline_config, executor),
+                               product_completion, source(tmp_path, ImageReadClient()), sink, batch_size=20, max_in_flight=4)
+    sink.close()
+
+    assert len(executor.jobs) == 3
+    assert len(requests) == 2 * ROWS_PER_STREAM
+    assert example_category.model_dump_json() in requests[0]["contents"][0]["parts"][0]["text"]
+    assert (progress.succeeded, progress.failed) == (2 * ROWS_PER_STREAM - 1, 1)
+    products = [json.loads(row["product"]) for row in client.rows if row["product"] is not None]
+    assert len(client.rows) == 2 * ROWS_PER_STREAM
+    assert len(products) == 2 * ROWS_PER_STREAM - 1
+    assert products[0]["base"]["name"] == example_product.base.name
+    assert products[0]["category"]["name"] == example_category.name
+    checkpoint = ReadCheckpoint.load(str(tmp_path / "checkpoint.json"))
+    assert checkpoint.offsets == {s: ROWS_PER_STREAM for s in STREAMS}
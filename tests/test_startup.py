@@ -0,0 +1,76 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import logging
+import os
+import subprocess
+import sys
+
+logger = logging.getLogger(__name__)
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+# generous, cold starts of autoscaled instances are tracked by the logged timings
+CLI_BUDGET_SECONDS = 5.0
+SERVER_BUDGET_SECONDS = 15.0
+CLOUD_MODULES = ["google.cloud.bigquery", "google.cloud.storage"]
+
+
+def cold_start(code: str) -> dict:
+    """Runs code in a new interpreter, returning the JSON it prints on its last line."""
+    script = f"""
+import json, sys, time
+started = time.perf_counter()
+{code}
+seconds = time.perf_counter() - started
+print(json.dumps({{"seconds": seconds, "modules": [m for m in {CLOUD_MODULES + ["google.genai"]!r} if m in sys.modules]}}))
+"""
+    env = dict(os.environ, PYTHONPATH=SRC)
+    result = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_cli_cold_start(tmp_path):
+    timing = cold_start(f"""
+import os
+os.chdir({str(tmp_path)!r})
+sys.argv = ["gemini-content-enrichment", "generate-salt"]
+from cli.main import main
+main()
+""")
+    logger.info("cli generate-salt cold start: %.2fs", timing["seconds"])
+
+    assert timing["modules"] == []
+    assert timing["seconds"] < CLI_BUDGET_SECONDS
+
+
+def test_server_cold_start():
+    timing = cold_start("""
+import api.server
+from model.clients import get_client_registry
+assert api.server._config is None
+assert get_client_registry().cloud_clients == {}
+""")
+    logger.info("server import cold start: %.2fs", timing["seconds"])
+
+    assert timing["seconds"] < SERVER_BUDGET_SECONDS
+
+
+def test_loading_the_configuration_opens_no_caches(tmp_path, offline_config):
+    assert not (tmp_path / "cache").exists()
+    assert offline_config.vocabulary.categories is None
+
+    offline_config.get_embedding().vector_cache.put("key", b"value")
+
+    assert "embeddings.db" in os.listdir(tmp_path / "cache")
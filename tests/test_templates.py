@@ -0,0 +1,53 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import pytest
+
+from model.chain import Context
+from model.templates import MissingVariablesError, PromptTemplate
+
+
+def test_template_slots():
+    template = PromptTemplate("Translate ${product_json} from ${base_language} to ${target_language}.", "translate")
+
+    assert template.variables == ["product_json", "base_language", "target_language"]
+    assert template.literals == ["Translate ", " from ", " to ", "."]
+
+
+def test_template_renders_from_context_and_defaults():
+    template = PromptTemplate("Translate ${product_json} from ${base_language} to ${target_language}.")
+    context = Context(None)
+    context.set("product_json", '{"name": "Shirt"}')
+    context.set("target_language", "FR_FR")
+
+    rendered = template.render(context, defaults={"base_language": "US_EN"})
+
+    assert rendered == 'Translate {"name": "Shirt"} from US_EN to FR_FR.'
+
+
+def test_template_reports_all_missing_variables():
+    template = PromptTemplate("${a} ${b} ${a} ${c}", "missing")
+
+    with pytest.raises(MissingVariablesError) as e:
+        template.render({"b": "present"})
+
+    assert e.value.variables == ["a", "c"]
+    assert template.missing_variables({"b": "present"}) == ["a", "c"]
+    assert template.render({"b": "present"}, strict=False) == " present  "
+
+
+def test_expand_variables_is_lenient():
+    context = Context(None)
+    context.set("name", "Shirt")
+
+    assert context.expand_variables("${name} ${unknown}") == "Shirt "
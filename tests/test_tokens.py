@@ -0,0 +1,68 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+
+import pytest
+
+from commands.main import product_enrichment_from_image
+from model.config import Config
+from model.examples import Attribute, Category
+from model.templates import PromptTemplate
+from model.tokens import TokenBudget, get_token_accounting, trim_value
+from tests.test_enrichment_commands import product_context
+
+
+@pytest.mark.asyncio
+async def test_usage_is_recorded_by_command_and_model(offline_config: Config):
+    accounting = get_token_accounting()
+    accounting.clear()
+    context = product_context(offline_config)
+    context.set("languages", ["FR_FR", "DE_DE"])
+
+    await product_enrichment_from_image.execute(context)
+
+    assert accounting.get_usage(command="category-detection").calls == 1
+    assert accounting.get_usage(command="language-extractor").calls == 2
+    assert accounting.get_usage(model="gemini-2.0-flash").input_tokens == 400
+    assert accounting.report()[0]["command"] == "language-extractor"
+
+
+def test_count_tokens_is_cached(generator_factory):
+    generator = generator_factory({"count_tokens_with_api": True})
+
+    assert generator.estimate_input_tokens(["describe the shirt"]) == 100
+    assert generator.estimate_input_tokens(["describe the shirt"]) == 100
+    assert len(generator.client.models.calls) == 1
+
+
+def test_json_values_are_trimmed_by_dropping_items():
+    category = Category(name="Shirts", attributes=[
+        Attribute(name=f"attribute {i}", description="d" * 50, value_range=["a", "b"]) for i in range(50)])
+    value = category.model_dump_json()
+
+    trimmed = trim_value(value, len(value) // 2)
+
+    assert len(trimmed) <= len(value) // 2
+    assert 0 < len(Category.model_validate_json(trimmed).attributes) < 50
+    assert trim_value("x" * 100, 10) == "xxxxxxx..."
+
+
+def test_budget_trims_variables_until_the_prompt_fits():
+    template = PromptTemplate("Attributes: ${attributes} for ${name}", "test")
+    values = {"attributes": json.dumps(["attribute value"] * 400), "name": "shirt"}
+
+    rendered = TokenBudget(max_tokens=500, trim=["attributes"]).render(template, values)
+
+    assert len(rendered) // 4 + 1 <= 500
+    assert rendered.endswith("] for shirt")
@@ -0,0 +1,93 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+
+import pytest
+
+from model.video import VideoFiles
+
+
+def write_video(tmp_path, name: str, content: bytes) -> str:
+    path = tmp_path / name
+    path.write_bytes(content)
+    return str(path)
+
+
+@pytest.mark.asyncio
+async def test_identical_videos_are_uploaded_once(tmp_path, generator_factory):
+    generator = generator_factory({"video": {"initial_poll_seconds": 0.01}})
+    first = write_video(tmp_path, "a.mp4", b"video")
+    copy = write_video(tmp_path, "b.mp4", b"video")
+
+    responses = await asyncio.gather(
+        generator.understand_video_async("describe", first),
+        generator.understand_video_async("describe", copy))
+
+    files = generator.client.aio.files
+    assert len(responses) == 2
+    assert len(files.uploads) == 1
+    assert files.deleted == []
+
+    await generator.video_files.clear(generator.client)
+    assert files.deleted == ["files/1"]
+
+
+@pytest.mark.asyncio
+async def test_polling_backs_off_and_unretained_files_are_deleted(tmp_path, generator_factory):
+    generator = generator_factory()
+    generator.client.aio.files.processing_polls = 3
+    videos = VideoFiles("test", initial_poll_seconds=0.01, max_poll_seconds=0.02, retain_seconds=0)
+
+    started = asyncio.get_running_loop().time()
+    async with videos.use(generator.client, write_video(tmp_path, "a.mp4", b"video")) as file:
+        assert file.state.name == "ACTIVE"
+    elapsed = asyncio.get_running_loop().time() - started
+
+    files = generator.client.aio.files
+    assert len(files.gets) == 3
+    # 0.01 + 0.02 + 0.02, capped at max_poll_seconds
+    assert 0.05 <= elapsed < 0.5
+    assert files.deleted == ["files/1"]
+
+
+@pytest.mark.asyncio
+async def test_processing_timeout_deletes_the_file(tmp_path, generator_factory):
+    generator = generator_factory()
+    generator.client.aio.files.processing_polls = 100
+    videos = VideoFiles("test", initial_poll_seconds=0.01, max_poll_seconds=0.01, processing_timeout_seconds=0.05)
+
+    with pytest.raises(TimeoutError):
+        async with videos.use(generator.client, write_video(tmp_path, "a.mp4", b"video")):
+            pass
+
+    assert generator.client.aio.files.deleted == ["files/1"]
+
+
+@pytest.mark.asyncio
+async def test_shared_uploads_are_not_deleted_while_callers_wait_for_them(tmp_path, generator_factory):
+    generator = generator_factory()
+    videos = VideoFiles("test", initial_poll_seconds=0.01, retain_seconds=0)
+    path = write_video(tmp_path, "a.mp4", b"video")
+    files = generator.client.aio.files
+    deleted_in_use = []
+
+    async def use() -> None:
+        async with videos.use(generator.client, path) as file:
+            deleted_in_use.append(file.name in files.deleted)
+
+    await asyncio.gather(use(), use())
+
+    assert deleted_in_use == [False, False]
+    assert len(files.uploads) == 1
+    assert files.deleted == ["files/1"]
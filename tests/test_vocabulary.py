@@ -0,0 +1,97 @@
+# Copyright 2025 Google, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import numpy as np
+import pytest
+from PIL import Image
+
+from commands.main import product_enrichment_from_image
+from commands.vocabulary import CategoryLookupCommand
+from model.chain import Context
+from model.config import Config
+from model.examples import Category, example_category
+from model.vocabulary import CategoryVocabulary, VectorIndex
+
+footwear = Category(name="Footwear", attributes=[])
+# the fake embedding of a text of 10 characters starting with "S"
+SHIRT_VECTOR = [10.0, ord("S"), 1.0]
+
+
+def test_search_returns_the_nearest_vectors_first():
+    index = VectorIndex()
+    index.add(np.array([[1, 0, 0], [0, 1, 0], [1, 1, 0]]))
+
+    scores, positions = index.search(np.array([[1, 0.1, 0], [0, 0, 1]]), k=2)
+
+    assert positions[0].tolist() == [0, 2]
+    assert scores[0, 0] == pytest.approx(1 / np.sqrt(1.01))
+    assert scores[1].tolist() == [0.0, 0.0]
+
+
+def test_vocabulary_is_saved_and_loaded(tmp_path):
+    vocabulary = CategoryVocabulary()
+    vocabulary.add([example_category, footwear], np.array([SHIRT_VECTOR, [-1.0, 0.0, 0.0]]))
+    path = str(tmp_path / "vocabulary.npz")
+
+    vocabulary.save(path)
+    loaded = CategoryVocabulary.load(path)
+
+    category, score = loaded.nearest(np.array(SHIRT_VECTOR))
+    assert category == example_category
+    assert score == pytest.approx(1.0)
+
+
+@pytest.mark.asyncio
+async def test_categories_are_embedded_in_a_batch(embedding_factory):
+    embedding = embedding_factory()
+    vocabulary = CategoryVocabulary()
+
+    await vocabulary.add_embedded(embedding, [example_category, footwear])
+
+    assert len(vocabulary) == 2
+    assert len(embedding.client.aio.models.calls) == 1
+    assert vocabulary.nearest(np.array([len("Footwear: "), ord("F"), 1.0]))[0] == footwear
+
+
+@pytest.mark.asyncio
+async def test_matched_products_skip_category_detection(offline_config: Config):
+    offline_config.vocabulary.get_categories().add([example_category], np.array([SHIRT_VECTOR]))
+    context = Context(offline_config)
+    context.set("product_image", Image.new("RGB", (16, 16), "white"))
+    context.set("product_name", "Shirt blue")
+    context.set("languages", [])
+
+    await product_enrichment_from_image.execute(context)
+
+    flash = offline_config.get_generator_by_name("flash").client
+    assert len(flash.aio.models.calls) == 1
+    assert context.get("category") == example_category
+    assert context.get("category_score") == pytest.approx(1.0)
+    assert context.get("product").category == example_category
+
+
+@pytest.mark.asyncio
+async def test_unmatched_products_are_detected(offline_config: Config):
+    offline_config.vocabulary.get_categories().add([footwear], np.array([[-1.0, 0.0, 0.0]]))
+    command = CategoryLookupCommand("category-lookup")
+    context = Context(offline_config)
+    context.set("product_name", "Shirt blue")
+
+    await command.execute(context)
+
+    assert not context.has_key("category_attributes")
+
+
+def test_lookup_declares_the_text_it_reads():
+    assert CategoryLookupCommand("category-lookup").reads == ["product_name", "product_description"]
+    assert CategoryLookupCommand("category-lookup", ["title"], "vector").reads == ["title", "vector"]